@@ -13,13 +13,35 @@ import os
 import time
 import socket
 import platform
+import gzip
+import json
+import random
+from collections import deque
 from datetime import datetime
 
+try:
+    import requests
+except ImportError:  # Installed by main() on first run, imported in http_session()
+    requests = None
+
 # Server configuration
 SERVER_IP = "192.168.209.126"  # Your server IP
 SERVER_PORT = "5000"
 SERVER_URL = f"http://{SERVER_IP}:{SERVER_PORT}"
 
+# Upload batching: flush every BATCH_SIZE samples or when the oldest queued
+# sample is MAX_BATCH_AGE seconds old; unsent samples go to the journal
+BATCH_SIZE = 6
+MAX_BATCH_AGE = 15
+MAX_QUEUE = 1000
+RETRY_MAX = 60
+JOURNAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "auto_client.journal")
+
+sample_queue = deque()  # (queued_at, metrics) tuples
+retry_state = {'failures': 0, 'retry_at': 0.0}
+session_state = {'session': None}  # One keep-alive HTTP session for all uploads
+batch_state = {'supported': True}  # False once an older server 404s the batch endpoint
+
 def install_package(package):
     """Install a Python package"""
     try:
@@ -32,20 +54,41 @@ def install_package(package):
         print(f"❌ Failed to install {package}")
         return False
 
+def http_session():
+    """Shared keep-alive session, created on first use
+
+    Connections are pooled and reused across uploads; a pooled connection
+    the server closed is replaced by retrying the connect once.
+    """
+    global requests
+    session = session_state['session']
+    if session is None:
+        if requests is None:
+            import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        session = requests.Session()
+        retry = Retry(total=1, connect=1, read=0, redirect=0, status=0, other=0)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session_state['session'] = session
+    return session
+
 def test_connection():
     """Test connection to server"""
     try:
         print(f"🔍 Testing connection to {SERVER_URL}...")
         
-        # Try to import requests (install if needed)
+        # Make sure requests is available (install if needed)
         try:
-            import requests
+            http_session()
         except ImportError:
             if not install_package("requests"):
                 return False
         
         # Test connection
-        response = requests.get(f"{SERVER_URL}/test", timeout=5)
+        response = http_session().get(f"{SERVER_URL}/test", timeout=5)
         
         if response.status_code == 200:
             print("✅ Connection successful!")
@@ -68,8 +111,9 @@ def get_system_metrics():
     try:
         import psutil
         
-        # CPU usage
-        cpu_percent = psutil.cpu_percent(interval=1)
+        # CPU usage since the previous call (primed in run_monitoring, so
+        # this returns immediately instead of blocking for a second)
+        cpu_percent = psutil.cpu_percent(interval=None)
         
         # Memory usage
         memory = psutil.virtual_memory()
@@ -114,25 +158,157 @@ def get_system_metrics():
         print(f"Error collecting metrics: {e}")
         return None
 
-def send_metrics(metrics):
-    """Send metrics to server"""
+def journal_append(samples):
+    """Append unsent samples to the on-disk journal"""
+    if not samples:
+        return
+    with open(JOURNAL_PATH, 'a', encoding='utf-8') as f:
+        for sample in samples:
+            f.write(json.dumps(sample) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def journal_read():
+    """Read all journaled samples, skipping a torn last line"""
+    if not os.path.exists(JOURNAL_PATH):
+        return []
+    samples = []
+    with open(JOURNAL_PATH, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                samples.append(json.loads(line))
+            except ValueError:
+                continue
+    return samples
+
+def journal_replace(samples):
+    """Atomically rewrite the journal with the remaining samples"""
+    if not samples:
+        if os.path.exists(JOURNAL_PATH):
+            os.remove(JOURNAL_PATH)
+        return
+    with open(JOURNAL_PATH + ".tmp", 'w', encoding='utf-8') as f:
+        for sample in samples:
+            f.write(json.dumps(sample) + "\n")
+    os.replace(JOURNAL_PATH + ".tmp", JOURNAL_PATH)
+
+def send_batch(samples):
+    """POST a gzip-compressed batch and return ``(outcome, done)``
+
+    The outcome is one of "ok", "retry" (5xx/timeout), "unreachable" or
+    "rejected" (4xx). ``done`` counts the leading samples that need no
+    resend (stored or rejected); the rest are retried or journaled.
+    """
+    if not batch_state['supported']:
+        return send_one_by_one(samples)
+    session = http_session()
     try:
-        import requests
-        
-        response = requests.post(
-            f"{SERVER_URL}/api/metrics",
-            json=metrics,
-            headers={'Content-Type': 'application/json'},
-            timeout=5
+        body = gzip.compress(json.dumps({'samples': samples}).encode('utf-8'))
+        response = session.post(
+            f"{SERVER_URL}/api/metrics/batch",
+            data=body,
+            headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'},
+            timeout=10
         )
-        
-        if response.status_code == 200:
-            print(f"✓ Sent: CPU {metrics['cpu_percent']}%, RAM {metrics['memory_percent']}%")
-        else:
-            print(f"✗ Failed to send. Status: {response.status_code}")
-            
+    except requests.exceptions.ConnectionError:
+        print("✗ Cannot connect to server.")
+        return "unreachable", 0
     except Exception as e:
         print(f"✗ Error sending metrics: {e}")
+        return "retry", 0
+
+    if response.status_code == 200:
+        latest = samples[-1]
+        print(f"✓ Sent {len(samples)} samples: CPU {latest['cpu_percent']}%, RAM {latest['memory_percent']}%")
+        return "ok", len(samples)
+    if response.status_code == 404:
+        print("⚠️  Server has no batch endpoint, sending samples one by one")
+        batch_state['supported'] = False
+        return send_one_by_one(samples)
+    if response.status_code >= 500:
+        print(f"✗ Server error {response.status_code}, will retry")
+        return "retry", 0
+    print(f"✗ Failed to send. Status: {response.status_code}")
+    return "rejected", len(samples)
+
+def send_one_by_one(samples):
+    """Older server without the batch endpoint: one POST per sample
+
+    A rejected sample (4xx) is skipped; a server error or lost connection
+    stops, and the samples not sent yet are retried or journaled like a
+    failed batch. Returns ``(outcome, done)`` like send_batch.
+    """
+    session = http_session()
+    rejected = 0
+    for done, sample in enumerate(samples):
+        try:
+            response = session.post(f"{SERVER_URL}/api/metrics", json=sample, timeout=5)
+        except requests.exceptions.ConnectionError:
+            print("✗ Cannot connect to server.")
+            return "unreachable", done
+        except Exception as e:
+            print(f"✗ Error sending metrics: {e}")
+            return "retry", done
+        if response.status_code >= 500:
+            print(f"✗ Server error {response.status_code}, will retry")
+            return "retry", done
+        if response.status_code != 200:
+            print(f"✗ Sample rejected. Status: {response.status_code}")
+            rejected += 1
+
+    if rejected == len(samples):
+        return "rejected", len(samples)
+    latest = samples[-1]
+    print(f"✓ Sent {len(samples) - rejected} samples: CPU {latest['cpu_percent']}%, RAM {latest['memory_percent']}%")
+    return "ok", len(samples)
+
+def backoff(now):
+    """Schedule the next upload attempt with exponential backoff and jitter"""
+    retry_state['failures'] += 1
+    delay = min(RETRY_MAX, 2 ** (retry_state['failures'] - 1))
+    retry_state['retry_at'] = now + delay * random.uniform(0.5, 1.0)
+
+def queue_metrics(metrics):
+    """Buffer a sample, spilling the oldest to the journal when the queue is full"""
+    sample_queue.append((time.time(), metrics))
+    if len(sample_queue) > MAX_QUEUE:
+        journal_append([sample_queue.popleft()[1]])
+
+def flush_queue():
+    """Upload queued samples if a size/age threshold is reached"""
+    now = time.time()
+    if not sample_queue or now < retry_state['retry_at']:
+        return
+    if len(sample_queue) < BATCH_SIZE and now - sample_queue[0][0] < MAX_BATCH_AGE:
+        return
+
+    while sample_queue:
+        count = min(BATCH_SIZE, len(sample_queue))
+        status, done = send_batch([sample_queue[i][1] for i in range(count)])
+        for _ in range(done):
+            sample_queue.popleft()
+        if status == "retry":
+            backoff(now)
+            return
+        if status == "unreachable":
+            journal_append([metrics for _, metrics in sample_queue])
+            sample_queue.clear()
+            backoff(now)
+            return
+    retry_state['failures'] = 0
+    retry_state['retry_at'] = 0.0
+
+    # Server is reachable again: replay anything journaled earlier
+    pending = journal_read()
+    sent = 0
+    while sent < len(pending):
+        status, done = send_batch(pending[sent:sent + BATCH_SIZE * 10])
+        sent += done
+        if status in ("retry", "unreachable"):
+            backoff(now)
+            break
+    if pending:
+        journal_replace(pending[sent:])
 
 def run_monitoring():
     """Run the monitoring loop"""
@@ -140,18 +316,34 @@ def run_monitoring():
     print(f"📊 PC Name: {socket.gethostname()}")
     print(f"🌐 Server: {SERVER_URL}")
     print(f"⏱️  Update Interval: 5 seconds")
+    print(f"📦 Upload: gzip batches of {BATCH_SIZE} samples (or every {MAX_BATCH_AGE}s)")
     print(f"📈 Press Ctrl+C to stop monitoring\n")
     
     try:
+        import psutil
+        psutil.cpu_percent(interval=None)  # Baseline for non-blocking CPU deltas
+
+        # Fixed-rate ticks on 5-second wall-clock boundaries, so the period
+        # does not drift by the time spent collecting and sending
+        interval = 5
+        next_tick = (int(time.time() // interval) + 1) * interval
         while True:
+            time.sleep(max(0, next_tick - time.time()))
+            next_tick += interval
+            if next_tick <= time.time():
+                # Fell behind; skip missed ticks instead of bursting
+                next_tick = (int(time.time() // interval) + 1) * interval
+
             metrics = get_system_metrics()
             if metrics:
-                send_metrics(metrics)
-            
-            time.sleep(5)
+                queue_metrics(metrics)
+            flush_queue()
             
     except KeyboardInterrupt:
         print("\n🛑 Monitoring stopped by user")
+        # Keep buffered samples for the next run
+        journal_append([metrics for _, metrics in sample_queue])
+        sample_queue.clear()
     except Exception as e:
         print(f"❌ Unexpected error: {e}")
 
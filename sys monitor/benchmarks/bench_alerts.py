@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Alert evaluation cost as history grows.
+
+Feeds batches of samples for a fleet of hosts through AlertEngine and
+prints the time per sample after every round. The rules only keep running
+state, so the cost should stay flat however many samples came before.
+
+Usage: python benchmarks/bench_alerts.py [hosts] [rounds]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from alerts import AlertEngine, Rule  # noqa: E402
+from metrics_store import NUMERIC_FIELDS  # noqa: E402
+
+RULES = [
+    Rule('cpu_high', 'cpu_percent > 90 for 2m'),
+    Rule('memory_high', 'memory_percent > 90 for 5m'),
+    Rule('disk_full', 'disk_percent >= 95', 'critical'),
+    Rule('disk_filling', 'rate(disk_used_gb) > 0.01 over 10m for 10m'),
+    Rule('load_high', 'load.1m > 8 for 1m'),
+]
+
+
+def main():
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    engine = AlertEngine(RULES)
+    names = [f'PC-{i:05d}' for i in range(hosts)]
+    now = time.time()
+
+    print(f"{len(RULES)} rules, {hosts} hosts")
+    print(f"{'samples/host':>12} {'us/sample':>10} {'events':>7}")
+    for round_ in range(rounds):
+        entries, extended = [], []
+        for step in range(60):  # One batch per round: 60 samples per host
+            timestamp = now + (round_ * 60 + step) * 5
+            for name in names:
+                values = [random.uniform(0, 100) for _ in NUMERIC_FIELDS]
+                entries.append((name, timestamp, values, {}))
+                extended.append(({'load.1m': random.uniform(0, 10)}, {}))
+        start = time.perf_counter()
+        events = engine.evaluate(entries, extended)
+        elapsed = time.perf_counter() - start
+        print(f"{(round_ + 1) * 60:>12} {elapsed / len(entries) * 1e6:>10.2f} {len(events):>7}")
+
+
+if __name__ == "__main__":
+    main()
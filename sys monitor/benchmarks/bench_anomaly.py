@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Anomaly detection cost for a large fleet.
+
+Each round every host sends one sample (in batches of 100, as ingest
+would), then one vectorized AnomalyDetector.run() scores them all. The
+whole round has to fit in one ingest interval (5 s) on a single core.
+A few hosts get a CPU spike in the last round to check they are flagged.
+
+Usage: python benchmarks/bench_anomaly.py [hosts] [rounds]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from anomaly import AnomalyDetector  # noqa: E402
+from metrics_store import NUMERIC_FIELDS  # noqa: E402
+
+
+def main():
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    rng = np.random.default_rng(7)
+    names = [f'PC-{i:05d}' for i in range(hosts)]
+    base = rng.uniform(10, 80, size=(hosts, len(NUMERIC_FIELDS)))
+    spiked = set(range(0, hosts, max(1, hosts // 10)))
+    detector = AnomalyDetector()
+    now = time.time() - rounds * 5
+
+    print(f"{hosts} hosts, fields {', '.join(detector.fields)}")
+    print(f"{'round':>5} {'observe ms':>11} {'run ms':>8} {'events':>7}")
+    for round_ in range(rounds):
+        values = base + rng.normal(0, 2, size=base.shape)
+        if round_ == rounds - 1:
+            values[sorted(spiked), 0] = 100.0
+        entries = [(name, now + round_ * 5, row, {}) for name, row in zip(names, values.tolist())]
+        start = time.perf_counter()
+        for i in range(0, hosts, 100):
+            detector.observe(entries[i:i + 100])
+        observed = time.perf_counter() - start
+        start = time.perf_counter()
+        events = detector.run(now + round_ * 5)
+        ran = time.perf_counter() - start
+        if round_ % 10 == 0 or round_ == rounds - 1:
+            print(f"{round_:>5} {observed * 1000:>11.1f} {ran * 1000:>8.1f} {len(events):>7}")
+
+    flagged = {event['pc_name'] for event in events if event['state'] == 'firing'}
+    caught = sum(1 for i in spiked if names[i] in flagged)
+    print(f"spiked hosts flagged: {caught}/{len(spiked)}, others flagged: {len(flagged) - caught}")
+    print(f"state: {detector.nbytes() / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
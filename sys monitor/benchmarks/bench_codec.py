@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+JSON codec micro-benchmark on fleet-shaped payloads.
+
+Compares the standard library ``json`` with ``orjson`` (when installed)
+for the three hot paths of the server:
+
+  ingest   parse a POST /api/metrics/batch body and decode it into
+           (pc_name, epoch, values, static) entries
+  query    serialize a 1000-row GET /api/metrics/<pc_name> response
+  fleet    serialize GET /api/metrics for the whole fleet, as one
+           document vs. streamed one PC at a time (peak memory included;
+           the streamed timing also covers building the rows from the store)
+
+Usage: python benchmarks/bench_codec.py [hosts] [rows_per_host]
+"""
+
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from metrics_store import MetricsStore, decode_sample  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def make_sample(pc_name, when):
+    """Build a sample shaped like SystemMonitor.get_system_metrics()"""
+    return {
+        "pc_name": pc_name,
+        "timestamp": when.isoformat(),
+        "cpu_percent": round(random.uniform(0, 100), 2),
+        "memory_percent": round(random.uniform(0, 100), 2),
+        "memory_used_gb": round(random.uniform(1, 32), 2),
+        "memory_total_gb": 32.0,
+        "disk_percent": round(random.uniform(0, 100), 2),
+        "disk_used_gb": round(random.uniform(10, 500), 2),
+        "disk_total_gb": 512.0,
+        "network_sent_mb": round(random.uniform(0, 1e5), 2),
+        "network_recv_mb": round(random.uniform(0, 1e5), 2),
+        "uptime_seconds": random.randint(0, 10**7),
+        "os_info": "Windows 10",
+    }
+
+
+def codecs():
+    encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+    found = [('json', json.loads, lambda obj: encoder.encode(obj).encode('utf-8'))]
+    if orjson is not None:
+        found.append(('orjson', orjson.loads, orjson.dumps))
+    return found
+
+
+def best_of(func, repeat=5):
+    """Fastest of ``repeat`` runs, in milliseconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def peak_kib(func):
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024
+
+
+def main():
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rows_per_host = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    now = datetime.now()
+    batch = [make_sample(f"PC-{i % 50:03d}", now - timedelta(seconds=i)) for i in range(1000)]
+    batch_body = json.dumps(batch).encode('utf-8')
+
+    store = MetricsStore(capacity=max(1000, rows_per_host))
+    for h in range(hosts):
+        pc_name = f"PC-{h:05d}"
+        for i in range(rows_per_host):
+            store.append(pc_name, (now - timedelta(seconds=5 * i)).timestamp(),
+                         make_sample(pc_name, now))
+    single = MetricsStore(capacity=1000)
+    for i in range(1000):
+        single.append("PC-00000", (now - timedelta(seconds=5 * i)).timestamp(), make_sample("PC-00000", now))
+    query_payload = {'pc_name': 'PC-00000', 'last_seq': 1000, 'metrics': single.rows("PC-00000")}
+    fleet = {pc_name: store.rows(pc_name) for pc_name in store.hosts()}
+
+    print(f"📦 ingest: 1000-sample batch ({len(batch_body) / 1024:.0f} KiB)")
+    print("📦 query:  1000-row response")
+    print(f"📦 fleet:  {hosts} hosts x {rows_per_host} rows\n")
+    print(f"{'codec':<8} {'ingest ms':>10} {'query ms':>9} {'fleet ms':>9} {'stream ms':>10} "
+          f"{'fleet peak KiB':>15} {'stream peak KiB':>16}")
+
+    for name, loads, dumps in codecs():
+        def ingest():
+            for sample in loads(batch_body):
+                decode_sample(sample)
+
+        def fleet_whole():
+            return dumps(fleet)
+
+        def fleet_stream():
+            # Mirrors app.stream_metrics_object: rows built and dropped per PC
+            written = 0
+            for pc_name in store.hosts():
+                written += len(dumps(pc_name) + b':' + dumps(store.rows(pc_name)))
+            return written
+
+        def fleet_whole_from_store():
+            return dumps({pc_name: store.rows(pc_name) for pc_name in store.hosts()})
+
+        print(f"{name:<8} {best_of(ingest):>10.2f} {best_of(lambda: dumps(query_payload)):>9.2f} "
+              f"{best_of(fleet_whole, 3):>9.1f} {best_of(fleet_stream, 3):>10.1f} "
+              f"{peak_kib(fleet_whole_from_store):>15.0f} {peak_kib(fleet_stream):>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Cost of each agent collector against its budget.
+
+Runs every collector from client/monitor_client.py a few times and prints
+the best and worst wall time next to its ``budget_ms``. With ``--spawn N``
+(POSIX only) N idle ``sleep`` processes are started first, to see how the
+procs collector behaves on a busy host.
+
+    python benchmarks/bench_collectors.py --spawn 2000
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'client'))
+
+from monitor_client import COLLECTORS, CollectorRegistry  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Agent collector cost benchmark')
+    parser.add_argument('--spawn', type=int, default=0, help='Idle processes to start first')
+    parser.add_argument('--runs', type=int, default=5, help='Runs per collector')
+    parser.add_argument('--top-n', type=int, default=5, help='Processes reported by procs')
+    args = parser.parse_args()
+
+    children = []
+    try:
+        for _ in range(args.spawn):
+            children.append(subprocess.Popen(['sleep', '600']))
+        registry = CollectorRegistry.from_names(tuple(COLLECTORS), args.top_n)
+        time.sleep(1)  # Let the rate collectors' baselines age
+
+        print(f"{'collector':<10} {'best ms':>8} {'worst ms':>9} {'budget ms':>10}  keys")
+        for collector in registry.collectors:
+            times = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                result = collector.collect(time.time())
+                times.append((time.perf_counter() - start) * 1000)
+            flag = "✅" if max(times) <= collector.budget_ms else "❌"
+            print(f"{collector.name:<10} {min(times):>8.2f} {max(times):>9.2f} "
+                  f"{collector.budget_ms:>10} {flag} {', '.join(result)}")
+            if 'process_count' in result:
+                print(f"{'':<10} ({result['process_count']} processes)")
+    finally:
+        for child in children:
+            child.kill()
+        for child in children:
+            child.wait()
+
+
+if __name__ == "__main__":
+    main()
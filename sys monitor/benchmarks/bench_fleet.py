@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Fleet aggregate cost: ingest update, top-K and summary for many hosts.
+
+Fills FleetAggregates with ``rounds`` samples per host (5 s apart) and
+times the per-sample update (percentages jump around, totals stay put and
+counters climb, as on real hosts), then /api/fleet/topk and /api/fleet/summary
+queries against it. The summary is compared with numpy percentiles over
+the same latest values.
+
+Usage: python benchmarks/bench_fleet.py [hosts] [rounds]
+"""
+
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from fleet import FleetAggregates  # noqa: E402
+from metrics_store import NUMERIC_FIELDS  # noqa: E402
+
+
+def timed(fn, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+    fleet = FleetAggregates()
+    names = [f'PC-{i:05d}' for i in range(hosts)]
+    now = time.time() - rounds * 5
+
+    values = {name: [random.uniform(0, 100) for _ in NUMERIC_FIELDS] for name in names}
+    samples = 0
+    update_time = 0.0
+    for round_ in range(rounds):
+        entries = []
+        for name in names:
+            row = values[name] = list(values[name])
+            for i, field in enumerate(NUMERIC_FIELDS):
+                if field.endswith('_percent') or field.endswith('used_gb'):
+                    row[i] = random.uniform(0, 100)
+                elif not field.endswith('total_gb'):
+                    row[i] += random.uniform(0, 10)  # Counters only grow
+            entries.append((name, now + round_ * 5, row, {}))
+        start = time.perf_counter()
+        for i in range(0, len(entries), 100):  # As batches of 100 samples arrive
+            fleet.update(entries[i:i + 100])
+        update_time += time.perf_counter() - start
+        samples += len(entries)
+
+    print(f"{hosts} hosts, {samples} samples")
+    print(f"update        {update_time / samples * 1e6:8.2f} us/sample")
+    ms, top = timed(lambda: fleet.topk('cpu_percent', 10))
+    print(f"topk k=10     {ms:8.3f} ms")
+    ms, summary = timed(lambda: fleet.summary(('cpu_percent',), window=0))
+    print(f"summary now   {ms:8.3f} ms")
+    ms, summary = timed(lambda: fleet.summary(NUMERIC_FIELDS, window=300))
+    print(f"summary 5 min {ms:8.3f} ms (all fields, sketches)")
+
+    latest = np.array([host['value'] for host in fleet.topk('cpu_percent', hosts)])
+    exact = np.percentile(latest, 95, method='nearest')
+    print(f"p95 cpu now   {summary['current']['cpu_percent']['p95']:.3f} (numpy {exact:.3f})")
+    print(f"p95 cpu 5 min {summary['window']['fields']['cpu_percent']['p95']:.3f} "
+          f"(±{fleet.alpha:.0%} relative)")
+
+
+if __name__ == "__main__":
+    main()
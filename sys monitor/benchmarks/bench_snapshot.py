@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Warm restart cost: snapshot write and load against a reload from segments.
+
+Fills a MetricsStore with ``hosts`` PCs of ``samples`` samples each, times
+snapshot.write and snapshot.load plus MetricsStore.restore (what a restart
+does), and checks the restored rows against the originals. For comparison
+the old restart path (read_recent from the segment files, then refill the
+store and rollups) is timed on ``sample_hosts`` PCs and scaled up.
+
+Usage: python benchmarks/bench_snapshot.py [hosts] [samples] [sample_hosts]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+import snapshot  # noqa: E402
+from metrics_store import NUMERIC_FIELDS, MetricsStore  # noqa: E402
+from rollups import RollupStore  # noqa: E402
+from segment_store import SegmentStore  # noqa: E402
+
+
+def fill(store, names, samples):
+    now = time.time() - samples * 5
+    timestamps = array('d', (now + i * 5 for i in range(samples)))
+    base = [array('d', (random.uniform(0, 100) for _ in range(samples))) for _ in NUMERIC_FIELDS]
+    for seq, name in enumerate(names, 1):
+        shift = seq % samples  # Rotate so PCs differ without generating new data
+        columns = [array('d', timestamps)] + [column[shift:] + column[:shift] for column in base]
+        store.restore(name, samples + seq, columns, {'os_info': 'Linux 6.1'})
+
+
+def main():
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    samples = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    sample_hosts = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    names = [f'PC-{i:05d}' for i in range(hosts)]
+    store = MetricsStore(capacity=samples)
+    fill(store, names, samples)
+
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'snapshot.bin')
+        start = time.perf_counter()
+        snapshot.write(path, ((
+            {'pc_name': name, 'seq': seq, 'unordered_seq': unordered, 'static': static}, columns)
+            for name in names
+            for seq, unordered, static, columns in [store.export(name)]))
+        write_time = time.perf_counter() - start
+        size = os.path.getsize(path)
+
+        start = time.perf_counter()
+        meta, loaded = snapshot.load(path)
+        restored = MetricsStore(capacity=samples)
+        for info, columns in loaded:
+            restored.restore(info['pc_name'], info['seq'], columns, info['static'], info['unordered_seq'])
+        load_time = time.perf_counter() - start
+
+        for name in random.sample(names, min(20, hosts)):
+            assert restored.rows(name) == store.rows(name), name
+            assert restored.get(name).seq == store.get(name).seq, name
+
+        segments = SegmentStore(os.path.join(root, 'data'))
+        subset = names[:sample_hosts]
+        for name in subset:
+            _, _, static, columns = store.export(name)
+            segments.extend((name, columns[0][i], [column[i] for column in columns[1:]], static)
+                            for i in range(samples))
+        segments.close()
+        start = time.perf_counter()
+        reloaded = MetricsStore(capacity=samples)
+        rollups = RollupStore()
+        for name in subset:
+            records = segments.read_recent(name, samples)
+            static = segments.static(name)
+            reloaded.extend([(name, ts, values, static) for ts, values in records])
+            rollups.extend((name, ts, values) for ts, values in records)
+        segment_time = (time.perf_counter() - start) / len(subset) * hosts
+
+    print(f"{hosts} PCs x {samples} samples, snapshot {size / 1e6:.1f} MB")
+    print(f"snapshot write           {write_time * 1000:9.1f} ms")
+    print(f"snapshot load + restore  {load_time * 1000:9.1f} ms")
+    print(f"reload from segments     {segment_time * 1000:9.1f} ms (scaled from {len(subset)} PCs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Memory-per-host benchmark for the metrics store.
+
+Compares the old layout (deque of {'timestamp': datetime, 'data': dict})
+with the columnar HostSeries ring buffer in server/metrics_store.py.
+
+Usage: python benchmarks/bench_store_memory.py [hosts] [samples_per_host]
+"""
+
+import gc
+import os
+import random
+import sys
+import tracemalloc
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from metrics_store import MetricsStore  # noqa: E402
+
+
+def make_sample(pc_name, when):
+    """Build a sample shaped like SystemMonitor.get_system_metrics()"""
+    return {
+        "pc_name": pc_name,
+        "timestamp": when.isoformat(),
+        "cpu_percent": round(random.uniform(0, 100), 2),
+        "memory_percent": round(random.uniform(0, 100), 2),
+        "memory_used_gb": round(random.uniform(1, 64), 2),
+        "memory_total_gb": 64.0,
+        "disk_percent": round(random.uniform(0, 100), 2),
+        "disk_used_gb": round(random.uniform(10, 1000), 2),
+        "disk_total_gb": 1000.0,
+        "network_sent_mb": round(random.uniform(0, 1e6), 2),
+        "network_recv_mb": round(random.uniform(0, 1e6), 2),
+        "uptime_seconds": random.randint(0, 10**7),
+        "os_info": "Windows 10",
+    }
+
+
+def measure(build):
+    """Return bytes allocated (and still alive) by ``build()``"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del store
+    return after - before
+
+
+def build_deque_store(hosts, samples):
+    store = defaultdict(lambda: deque(maxlen=1000))
+    start = datetime.now()
+    for h in range(hosts):
+        pc_name = f"PC-{h:05d}"
+        for i in range(samples):
+            when = start + timedelta(seconds=5 * i)
+            # Client JSON is decoded to a fresh dict per request
+            data = make_sample(pc_name, when)
+            store[pc_name].append({'timestamp': when, 'data': data})
+    return store
+
+
+def build_columnar_store(hosts, samples):
+    store = MetricsStore(capacity=1000)
+    start = datetime.now()
+    for h in range(hosts):
+        pc_name = f"PC-{h:05d}"
+        for i in range(samples):
+            when = start + timedelta(seconds=5 * i)
+            store.append(pc_name, when.timestamp(), make_sample(pc_name, when))
+    return store
+
+
+def main():
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    samples = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    print("📦 Metrics store memory benchmark")
+    print("=" * 40)
+    print(f"Hosts: {hosts}, samples per host: {samples}")
+    print()
+
+    random.seed(0)
+    deque_bytes = measure(lambda: build_deque_store(hosts, samples))
+    random.seed(0)
+    columnar_bytes = measure(lambda: build_columnar_store(hosts, samples))
+
+    print(f"deque of dicts : {deque_bytes / hosts / 1024:10.1f} KiB per host")
+    print(f"columnar store : {columnar_bytes / hosts / 1024:10.1f} KiB per host")
+    if columnar_bytes:
+        print(f"ratio          : {deque_bytes / columnar_bytes:10.1f}x smaller")
+
+
+if __name__ == "__main__":
+    main()
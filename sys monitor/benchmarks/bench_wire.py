@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Wire format benchmark: bytes on the wire and server-side parse time.
+
+Compares a JSON sample (as sent today), a JSON batch, and the binary
+formats from server/wire.py (packed struct frames and, when msgpack is
+installed, MessagePack arrays), each raw and gzip-compressed.
+
+Usage: python benchmarks/bench_wire.py [batch_size] [samples]
+"""
+
+import gzip
+import json
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+import codec  # noqa: E402
+from metrics_store import NUMERIC_FIELDS, decode_sample  # noqa: E402
+from wire import FRAME_MIMETYPE, MSGPACK_MIMETYPE, WireRegistry, encode_frame, msgpack  # noqa: E402
+
+
+def make_sample(pc_name, when):
+    """Build a sample shaped like SystemMonitor.get_system_metrics()"""
+    return {
+        "pc_name": pc_name,
+        "timestamp": when.isoformat(),
+        "cpu_percent": round(random.uniform(0, 100), 2),
+        "memory_percent": round(random.uniform(0, 100), 2),
+        "memory_used_gb": round(random.uniform(1, 32), 2),
+        "memory_total_gb": 31.87,
+        "disk_percent": round(random.uniform(0, 100), 2),
+        "disk_used_gb": round(random.uniform(10, 500), 2),
+        "disk_total_gb": 476.34,
+        "network_sent_mb": round(random.uniform(0, 1e5), 2),
+        "network_recv_mb": round(random.uniform(0, 1e5), 2),
+        "uptime_seconds": random.randint(0, 10**7),
+        "os_info": "Windows 10",
+    }
+
+
+def to_record(sample):
+    record = [datetime.fromisoformat(sample["timestamp"]).timestamp()]
+    record.extend(math.nan if sample.get(f) is None else float(sample[f]) for f in NUMERIC_FIELDS)
+    return record
+
+
+def best_of(func, repeat=5):
+    """Fastest of ``repeat`` runs, in milliseconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main():
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    total = int(sys.argv[2]) if len(sys.argv) > 2 else 6000
+
+    now = datetime.now()
+    samples = [make_sample("WORKSTATION-042", now + timedelta(seconds=5 * i)) for i in range(total)]
+    batches = [samples[i:i + batch_size] for i in range(0, total, batch_size)]
+
+    registry = WireRegistry()
+    host_id, schema_id = registry.register("WORKSTATION-042", samples[0])
+
+    def json_single():
+        return [json.dumps(s).encode() for s in samples]
+
+    def json_batch():
+        return [json.dumps({'samples': b}).encode() for b in batches]
+
+    def frames():
+        return [encode_frame(host_id, schema_id, [to_record(s) for s in b]) for b in batches]
+
+    def parse_json(bodies):
+        def run():
+            for body in bodies:
+                data = codec.loads(body)
+                for sample in data['samples'] if isinstance(data, dict) and 'samples' in data else [data]:
+                    decode_sample(sample)
+        return run
+
+    def parse_binary(mimetype, bodies):
+        return lambda: [registry.decode(mimetype, body) for body in bodies]
+
+    formats = [
+        ('json (1/request)', json_single(), parse_json),
+        (f'json (batch {batch_size})', json_batch(), parse_json),
+        (f'frame (batch {batch_size})', frames(), lambda b: parse_binary(FRAME_MIMETYPE, b)),
+    ]
+    if msgpack is not None:
+        packed = [msgpack.packb([host_id, schema_id, [to_record(s) for s in b]]) for b in batches]
+        formats.append((f'msgpack (batch {batch_size})', packed,
+                        lambda b: parse_binary(MSGPACK_MIMETYPE, b)))
+    else:
+        print("ℹ️  msgpack not installed; skipping MessagePack\n")
+
+    print(f"{total} samples, JSON codec: {codec.CODEC}\n")
+    print(f"{'format':<20} {'B/sample':>9} {'gzip B/sample':>14} {'parse µs/sample':>16}")
+    for name, bodies, parser in formats:
+        raw = sum(len(b) for b in bodies) / total
+        zipped = sum(len(gzip.compress(b)) for b in bodies) / total
+        parse_us = best_of(parser(bodies)) * 1000 / total
+        print(f"{name:<20} {raw:>9.1f} {zipped:>14.1f} {parse_us:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,632 @@
+#!/usr/bin/env python3
+"""
+Synthetic fleet benchmark: agents, dashboard readers and live subscribers.
+
+Simulates a whole deployment against one server and reports, as JSON:
+
+- ingest: samples/sec achieved against offered, and p50/p99 latency from
+  each upload's *scheduled* time (time spent queued behind a slow server
+  counts, see loadtest.py);
+- reads: dashboard readers polling ``/api/metrics/<pc>`` with the
+  ``since_seq`` cursor the way the dashboard does;
+- fan-out: Socket.IO subscribers to the ``all`` group, with the lag from
+  a sample's timestamp to its arrival in a ``metrics_frame``;
+- server: RSS (start, peak, end) and CPU of the server process and its
+  children (shards), sampled with psutil.
+
+Agents are asyncio tasks (thousands of them in one process) that share a
+pool of keep-alive HTTP/1.1 connections, written on asyncio streams so no
+extra HTTP library is needed. Each agent keeps a random walk of CPU and
+memory, growing disk and network counters, per-core CPU, load average and
+a few labels, and reports every ``--interval`` seconds with ``--jitter``.
+Subscribers use the python-socketio client in threads.
+
+By default a fresh server is started on a free port with an empty data
+directory and stopped afterwards:
+
+    python benchmarks/fleet_sim.py --agents 2000 --duration 60 --output run.json
+    python benchmarks/fleet_sim.py --server http://localhost:5000   # already running
+    python benchmarks/fleet_sim.py --shards 4 --route               # serve.py --shards 4
+
+``--baseline old.json`` compares against an earlier run and exits with
+status 1 when a headline number got worse by more than ``--tolerance``.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import quote, urlencode, urlsplit
+from urllib.request import urlopen
+
+import psutil
+
+try:
+    import socketio
+except ImportError:  # Fan-out is skipped without the Socket.IO client
+    socketio = None
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server')
+READ_FIELDS = 'cpu_percent,memory_percent,disk_percent'
+REQUEST_TIMEOUT = 10
+REQUEST_ERRORS = (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError)
+
+# Headline numbers compared with --baseline: (path, higher is better)
+HEADLINES = (
+    (('ingest', 'samples_per_sec'), True),
+    (('ingest', 'p99_ms'), False),
+    (('reads', 'p99_ms'), False),
+    (('fanout', 'p99_ms'), False),
+    (('server', 'cpu_percent'), False),
+    (('server', 'rss_mb_peak'), False),
+)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def latency_stats(seconds):
+    values = sorted(seconds)
+    stats = {'count': len(values)}
+    for name, pct in (('p50_ms', 50), ('p99_ms', 99), ('max_ms', 100)):
+        value = percentile(values, pct)
+        stats[name] = None if value is None else round(value * 1000, 2)
+    return stats
+
+
+class HttpConnection:
+    """One keep-alive HTTP/1.1 connection on asyncio streams"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=b'', headers=None):
+        """Send a request; return ``(status, body bytes)``"""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}',
+                 f'Content-Length: {len(body)}']
+        lines.extend(f'{name}: {value}' for name, value in (headers or {}).items())
+        try:
+            self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+            await self.writer.drain()
+            status_line = await self.reader.readline()
+            if not status_line:
+                raise ConnectionError('Server closed the connection')
+            status = int(status_line.split()[1])
+            response_headers = {}
+            while True:
+                line = await self.reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                response_headers[name.strip().lower()] = value.strip()
+            if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+                chunks = []
+                while True:
+                    size = int((await self.reader.readline()).split(b';')[0], 16)
+                    if size == 0:
+                        await self.reader.readline()
+                        break
+                    chunks.append(await self.reader.readexactly(size))
+                    await self.reader.readline()
+                data = b''.join(chunks)
+            elif 'content-length' in response_headers:
+                data = await self.reader.readexactly(int(response_headers['content-length']))
+            else:
+                data = await self.reader.read()
+                response_headers['connection'] = 'close'
+            if response_headers.get('connection', '').lower() == 'close':
+                self.close()
+            return status, data
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class ConnectionPool:
+    """At most ``size`` connections to one server, shared by many tasks"""
+
+    def __init__(self, host, port, size):
+        self._idle = asyncio.Queue()
+        for _ in range(size):
+            self._idle.put_nowait(HttpConnection(host, port))
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        conn = await self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put_nowait(conn)
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+
+class Agent:
+    """Synthetic PC whose readings drift like a real machine's"""
+
+    def __init__(self, index, rng, extended=True):
+        self.pc_name = f'SIM-{index:05d}'
+        self.rng = rng
+        self.extended = extended
+        self.cores = rng.choice((4, 8, 16))
+        self.cpu = rng.uniform(5, 40)
+        self.memory_total = rng.choice((8.0, 16.0, 32.0, 64.0))
+        self.memory = rng.uniform(30, 70)
+        self.disk_total = rng.choice((256.0, 512.0, 1024.0))
+        self.disk_used = self.disk_total * rng.uniform(0.2, 0.8)
+        self.sent = rng.uniform(0, 1e5)
+        self.received = rng.uniform(0, 1e5)
+        self.uptime = rng.randint(600, 30 * 86400)
+        self.labels = {'rack': f'r{index % 40:02d}', 'role': rng.choice(('web', 'db', 'batch', 'desktop'))}
+        self.os_info = rng.choice(('Windows 10', 'Windows 11', 'Linux 6.8.0'))
+
+    def sample(self, timestamp, interval):
+        rng = self.rng
+        self.cpu = min(100.0, max(0.0, self.cpu + rng.gauss(0, 4)))
+        self.memory = min(99.0, max(5.0, self.memory + rng.gauss(0, 0.5)))
+        self.disk_used = min(self.disk_total, self.disk_used + rng.uniform(0, 0.01))
+        self.sent += rng.expovariate(1.0) * interval * 0.2
+        self.received += rng.expovariate(1.0) * interval * 0.5
+        self.uptime += interval
+        sample = {
+            'pc_name': self.pc_name,
+            'timestamp': datetime.fromtimestamp(timestamp).isoformat(),
+            'cpu_percent': round(self.cpu, 2),
+            'memory_percent': round(self.memory, 2),
+            'memory_used_gb': round(self.memory_total * self.memory / 100, 2),
+            'memory_total_gb': self.memory_total,
+            'disk_percent': round(100 * self.disk_used / self.disk_total, 2),
+            'disk_used_gb': round(self.disk_used, 2),
+            'disk_total_gb': self.disk_total,
+            'network_sent_mb': round(self.sent, 2),
+            'network_recv_mb': round(self.received, 2),
+            'uptime_seconds': int(self.uptime),
+            'os_info': self.os_info,
+            'labels': self.labels,
+        }
+        if self.extended:
+            sample['cpu_per_core'] = [round(min(100.0, max(0.0, rng.gauss(self.cpu, 10))), 1)
+                                      for _ in range(self.cores)]
+            load = self.cpu * self.cores / 100
+            sample['load_avg'] = [round(load, 2), round(load * 0.9, 2), round(load * 0.8, 2)]
+        return sample
+
+
+class Recorder:
+    """Measurements of one run; only what happens after the warmup counts"""
+
+    def __init__(self, warmup_until):
+        self.warmup_until = warmup_until
+        self.ingest = []
+        self.ingest_samples = 0
+        self.ingest_errors = 0
+        self.reads = []
+        self.read_errors = 0
+        self.fanout = []
+        self.frames = 0
+        self.lock = threading.Lock()
+
+    def recording(self, now=None):
+        return (time.time() if now is None else now) >= self.warmup_until
+
+
+async def run_agent(agent, pool, path, args, recorder, deadline):
+    rng = agent.rng
+    scheduled = time.time() + rng.uniform(0, args.interval)  # Agents start spread out
+    pending = []
+    while True:
+        if scheduled >= deadline:
+            return
+        delay = scheduled - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        pending.append(agent.sample(scheduled, args.interval))
+        if len(pending) >= args.batch_size:
+            if args.batch_size > 1:
+                body = json.dumps({'samples': pending}).encode('utf-8')
+            else:
+                body = json.dumps(pending[0]).encode('utf-8')
+            count = len(pending)
+            pending = []
+            error = False
+            try:
+                async with pool.connection() as conn:
+                    status, _ = await asyncio.wait_for(conn.request('POST', path, body, {
+                        'Content-Type': 'application/json', 'X-Sysmon-Host': agent.pc_name}),
+                        REQUEST_TIMEOUT)
+                error = status != 200
+            except REQUEST_ERRORS:
+                error = True
+            if recorder.recording(scheduled):
+                recorder.ingest.append(time.time() - scheduled)
+                recorder.ingest_samples += 0 if error else count
+                recorder.ingest_errors += error
+        scheduled += args.interval * (1 + rng.uniform(-args.jitter, args.jitter))
+
+
+async def run_reader(pool, agents, args, recorder, deadline, rng):
+    """Poll one PC at a time like a dashboard: full window once, then the cursor"""
+    cursors = {}
+    while time.time() < deadline:
+        pc_name = rng.choice(agents).pc_name
+        params = {'fields': READ_FIELDS}
+        if pc_name in cursors:
+            params['since_seq'] = cursors[pc_name]
+        else:
+            params['limit'] = 60
+        path = f'/api/metrics/{quote(pc_name, safe="")}?{urlencode(params)}'
+        started = time.time()
+        error = False
+        try:
+            async with pool.connection() as conn:
+                status, body = await asyncio.wait_for(conn.request('GET', path), REQUEST_TIMEOUT)
+            if status == 200:
+                last_seq = json.loads(body).get('last_seq')
+                if last_seq is not None:
+                    cursors[pc_name] = last_seq
+            error = status not in (200, 404)  # 404: that PC has not reported yet
+        except REQUEST_ERRORS:
+            error = True
+        if recorder.recording(started):
+            recorder.reads.append(time.time() - started)
+            recorder.read_errors += error
+        await asyncio.sleep(args.read_interval * rng.uniform(0.5, 1.5))
+
+
+def subscriber_urls(url):
+    """Socket.IO URLs a dashboard connects to: every shard of a sharded server, else ``url``"""
+    try:
+        with urlopen(f'{url}/api/shards', timeout=REQUEST_TIMEOUT) as response:
+            return [shard['url'] for shard in json.load(response)['shards']]
+    except (OSError, ValueError, KeyError):
+        return [url]  # A single server has no /api/shards
+
+
+def run_subscriber(url, recorder, stop):
+    """Thread: one Socket.IO connection subscribed to every PC"""
+    client = socketio.Client(reconnection=True)
+
+    @client.on('metrics_frame')
+    def on_frame(frame):
+        now = time.time()
+        client.emit('frame_ack', {'frame': frame.get('frame'), 'tick': frame.get('tick')})
+        if not recorder.recording(now):
+            return
+        lags = []
+        for update in frame.get('metrics', []):
+            stamp = update.get('metrics', {}).get('timestamp')
+            if stamp:
+                lags.append(now - datetime.fromisoformat(stamp).timestamp())
+        with recorder.lock:
+            recorder.frames += 1
+            recorder.fanout.extend(lags)
+
+    @client.on('connect')
+    def on_connect():
+        client.emit('subscribe', {'groups': ['all']})
+
+    try:
+        client.connect(url, wait_timeout=10)
+    except Exception as e:
+        print(f"⚠️  Subscriber could not connect to {url}: {e}", file=sys.stderr)
+        return
+    stop.wait()
+    client.disconnect()
+
+
+class ResourceSampler:
+    """RSS and CPU of the server process and its children, sampled in a thread"""
+
+    def __init__(self, pid, period=0.5):
+        self.process = psutil.Process(pid) if pid else None
+        self.period = period
+        self.samples = []
+        self._stop = threading.Event()
+
+    def _processes(self):
+        try:
+            return [self.process] + self.process.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+
+    def _measure(self):
+        rss = cpu = 0.0
+        for process in self._processes():
+            try:
+                rss += process.memory_info().rss
+                times = process.cpu_times()
+                cpu += times.user + times.system
+            except psutil.NoSuchProcess:
+                pass
+        return time.time(), rss, cpu
+
+    def run(self):
+        while not self._stop.is_set():
+            self.samples.append(self._measure())
+            self._stop.wait(self.period)
+        self.samples.append(self._measure())
+
+    def start(self):
+        if self.process is not None:
+            threading.Thread(target=self.run, daemon=True, name='resource-sampler').start()
+
+    def stop(self, since):
+        self._stop.set()
+        time.sleep(self.period * 1.5)
+        window = [sample for sample in self.samples if sample[0] >= since]
+        if len(window) < 2:
+            return None
+        (t0, _, cpu0), (t1, _, cpu1) = window[0], window[-1]
+        mb = 1024 * 1024
+        return {
+            'pid': self.process.pid,
+            'processes': len(self._processes()),
+            'rss_mb_start': round(window[0][1] / mb, 1),
+            'rss_mb_peak': round(max(sample[1] for sample in window) / mb, 1),
+            'rss_mb_end': round(window[-1][1] / mb, 1),
+            'cpu_seconds': round(cpu1 - cpu0, 2),
+            'cpu_percent': round(100 * (cpu1 - cpu0) / (t1 - t0), 1),
+        }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args):
+    """Start serve.py on a free port with an empty data directory; return (url, process)"""
+    port = free_port()
+    command = [sys.executable, os.path.join(SERVER_DIR, 'serve.py'), '--host', '127.0.0.1',
+               '--port', str(port), '--worker', args.worker, '--log-level', 'warning']
+    if args.shards > 1:
+        command += ['--shards', str(args.shards), '--shard-base-port', str(free_port())]
+    env = dict(os.environ, SYSMON_DATA_DIR=tempfile.mkdtemp(prefix='sysmon-sim-'))
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(120):
+        time.sleep(0.25)
+        if process.poll() is not None:
+            raise SystemExit(f"❌ Server exited with {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                pass
+            if args.shards > 1:
+                time.sleep(2)  # The front is up; give the shards a moment too
+            return url, process
+        except OSError:
+            continue
+    process.terminate()
+    raise SystemExit("❌ Server did not start within 30 s")
+
+
+def find_server_pid(url):
+    """PID listening on the URL's port (needs privileges on some systems)"""
+    port = urlsplit(url).port or 80
+    try:
+        for conn in psutil.net_connections(kind='tcp'):
+            if conn.status == psutil.CONN_LISTEN and conn.laddr.port == port and conn.pid:
+                return conn.pid
+    except psutil.AccessDenied:
+        pass
+    return None
+
+
+async def route_agents(base_url, agents, connections):
+    """``{pc_name: (host, port)}`` of the shard that owns each agent (or the server)"""
+    parts = urlsplit(base_url)
+    pool = ConnectionPool(parts.hostname, parts.port or 80, connections)
+    targets = {}
+
+    async def lookup(agent):
+        async with pool.connection() as conn:
+            status, body = await conn.request('GET', f'/api/route?{urlencode({"pc_name": agent.pc_name})}')
+        url = urlsplit(json.loads(body)['url']) if status == 200 else parts
+        targets[agent.pc_name] = (url.hostname, url.port or 80)
+
+    await asyncio.gather(*(lookup(agent) for agent in agents))
+    pool.close()
+    return targets
+
+
+async def simulate(args, url, recorder, deadline):
+    rng = random.Random(args.seed)
+    agents = [Agent(index, random.Random(rng.random()), args.extended) for index in range(args.agents)]
+    parts = urlsplit(url)
+    if args.route:
+        targets = await route_agents(url, agents, args.connections)
+    else:
+        targets = dict.fromkeys((agent.pc_name for agent in agents), (parts.hostname, parts.port or 80))
+    pools = {target: ConnectionPool(*target, args.connections) for target in set(targets.values())}
+    read_pool = ConnectionPool(parts.hostname, parts.port or 80, max(1, args.readers))
+    path = '/api/metrics/batch' if args.batch_size > 1 else '/api/metrics'
+
+    tasks = [run_agent(agent, pools[targets[agent.pc_name]], path, args, recorder, deadline)
+             for agent in agents]
+    tasks += [run_reader(read_pool, agents, args, recorder, deadline, random.Random(rng.random()))
+              for _ in range(args.readers)]
+    await asyncio.gather(*tasks)
+    for pool in list(pools.values()) + [read_pool]:
+        pool.close()
+
+
+def compare(result, baseline, tolerance):
+    """Headline numbers that got worse than ``baseline`` by more than ``tolerance``"""
+    regressions = []
+    for path, higher_is_better in HEADLINES:
+        current, previous = result, baseline
+        for key in path:
+            current = (current or {}).get(key)
+            previous = (previous or {}).get(key)
+        if not isinstance(current, (int, float)) or not isinstance(previous, (int, float)) or previous == 0:
+            continue
+        change = (current - previous) / abs(previous)
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append({'metric': '.'.join(path), 'baseline': previous, 'current': current,
+                                'change_percent': round(change * 100, 1)})
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVER_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='System Monitor synthetic fleet benchmark')
+    parser.add_argument('--server', default=None,
+                        help='URL of a running server (default: start a fresh one)')
+    parser.add_argument('--server-pid', type=int, default=None,
+                        help='PID of --server for RSS/CPU (default: whoever listens on its port)')
+    parser.add_argument('--worker', choices=['eventlet', 'gevent', 'threading'], default='threading',
+                        help='Worker model of the server this starts (default: threading)')
+    parser.add_argument('--shards', type=int, default=1, help='Shards of the server this starts (default: 1)')
+    parser.add_argument('--route', action='store_true',
+                        help='Agents upload straight to their shard (sharded servers)')
+    parser.add_argument('--agents', type=int, default=1000, help='Simulated PCs (default: 1000)')
+    parser.add_argument('--interval', type=float, default=5, help='Seconds between samples per PC (default: 5)')
+    parser.add_argument('--jitter', type=float, default=0.1,
+                        help='Relative jitter of the interval, e.g. 0.1 for +-10%% (default: 0.1)')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='Samples per upload; >1 uses /api/metrics/batch (default: 1)')
+    parser.add_argument('--no-extended', dest='extended', action='store_false',
+                        help='Send only the core fields (no per-core CPU or load average)')
+    parser.add_argument('--connections', type=int, default=32,
+                        help='Keep-alive connections the agents share, per server (default: 32)')
+    parser.add_argument('--readers', type=int, default=10, help='Dashboard readers polling PCs (default: 10)')
+    parser.add_argument('--read-interval', type=float, default=2,
+                        help='Seconds between a reader\'s polls (default: 2)')
+    parser.add_argument('--subscribers', type=int, default=3,
+                        help='Socket.IO subscribers to every PC (default: 3)')
+    parser.add_argument('--duration', type=float, default=30, help='Measured seconds (default: 30)')
+    parser.add_argument('--warmup', type=float, default=5, help='Unmeasured seconds first (default: 5)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed of the fleet (default: 1)')
+    parser.add_argument('--output', default=None, help='Also write the JSON result to this file')
+    parser.add_argument('--baseline', default=None, help='Earlier JSON result to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed relative regression against --baseline (default: 0.2)')
+    args = parser.parse_args()
+
+    process = None
+    if args.server:
+        url = args.server.rstrip('/')
+        pid = args.server_pid or find_server_pid(url)
+    else:
+        url, process = start_server(args)
+        pid = process.pid
+    print(f"⏳ {args.agents} agents, {args.readers} readers, {args.subscribers} subscribers "
+          f"against {url} for {args.warmup:g}+{args.duration:g}s ...", file=sys.stderr)
+
+    sampler = ResourceSampler(pid)
+    sampler.start()
+    started = time.time()
+    measured_from = started + args.warmup
+    deadline = measured_from + args.duration
+    recorder = Recorder(measured_from)
+
+    stop = threading.Event()
+    subscribers = []
+    if socketio is not None:
+        # One connection per shard per simulated dashboard
+        subscribers = [threading.Thread(target=run_subscriber, args=(shard_url, recorder, stop), daemon=True)
+                       for _ in range(args.subscribers) for shard_url in subscriber_urls(url)]
+        for thread in subscribers:
+            thread.start()
+
+    try:
+        asyncio.run(simulate(args, url, recorder, deadline))
+        elapsed = deadline - measured_from  # Requests are counted by their scheduled time
+        stop.set()
+        for thread in subscribers:
+            thread.join(timeout=10)
+        server = sampler.stop(measured_from)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=15)
+
+    ingest = latency_stats(recorder.ingest)
+    reads = latency_stats(recorder.reads)
+    result = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'commit': git_commit(),
+        },
+        'config': {key: value for key, value in vars(args).items()
+                   if key not in ('output', 'baseline', 'server_pid')},
+        'ingest': {
+            'offered_samples_per_sec': round(args.agents / args.interval, 1),
+            'samples_per_sec': round(recorder.ingest_samples / elapsed, 1),
+            'requests': ingest['count'],
+            'errors': recorder.ingest_errors,
+            'p50_ms': ingest['p50_ms'], 'p99_ms': ingest['p99_ms'], 'max_ms': ingest['max_ms'],
+        },
+        'reads': {
+            'requests': reads['count'],
+            'per_sec': round(reads['count'] / elapsed, 1),
+            'errors': recorder.read_errors,
+            'p50_ms': reads['p50_ms'], 'p99_ms': reads['p99_ms'], 'max_ms': reads['max_ms'],
+        },
+        'fanout': None,
+        'server': server,
+    }
+    if socketio is not None and args.subscribers:
+        lag = latency_stats(recorder.fanout)
+        result['fanout'] = {'subscribers': args.subscribers, 'frames': recorder.frames,
+                            'samples': lag['count'], 'p50_ms': lag['p50_ms'],
+                            'p99_ms': lag['p99_ms'], 'max_ms': lag['max_ms']}
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        result['regressions'] = compare(result, baseline, args.tolerance)
+        # Numbers from different fleet shapes are not comparable; say so
+        result['baseline_config_differs'] = sorted(
+            key for key, value in result['config'].items()
+            if key != 'server' and baseline.get('config', {}).get(key) != value)
+        status = 1 if result['regressions'] else 0
+
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Ingest load test for the System Monitor server.
+
+Simulates N agents that each POST one sample to /api/metrics every
+``--interval`` seconds, spread evenly over the interval. It reports the
+sustained requests/sec and p50/p99 latency for every fleet size.
+
+Latency is measured from when a request was scheduled, not from when a
+sender thread got around to it. When the server falls behind, the
+queueing delay shows up in p99 instead of being hidden by the senders
+slowing down (coordinated omission). ``service_p99_ms`` is the plain
+request time, and ``unsent`` counts scheduled requests that never went
+out before the deadline.
+
+Start the server in production mode first, e.g.:
+
+    python server/serve.py --worker eventlet --log-level warning
+    python benchmarks/loadtest.py --agents 1000,5000,10000 --duration 30
+
+Against a sharded server (serve.py --shards N), ``--route`` makes every
+agent look up its shard at /api/route and post there directly, as the real
+agent does. One load generator is itself a single Python process; run
+several side by side to saturate more than a few shards.
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def make_sample(pc_name):
+    return {
+        "pc_name": pc_name,
+        "timestamp": datetime.now().isoformat(),
+        "cpu_percent": round(random.uniform(0, 100), 2),
+        "memory_percent": round(random.uniform(0, 100), 2),
+        "memory_used_gb": round(random.uniform(1, 64), 2),
+        "memory_total_gb": 64.0,
+        "disk_percent": round(random.uniform(0, 100), 2),
+        "disk_used_gb": round(random.uniform(10, 1000), 2),
+        "disk_total_gb": 1000.0,
+        "network_sent_mb": round(random.uniform(0, 1e6), 2),
+        "network_recv_mb": round(random.uniform(0, 1e6), 2),
+        "uptime_seconds": random.randint(0, 10**7),
+        "os_info": "Windows 10",
+    }
+
+
+def route(server_url, agents):
+    """``{pc_name: base URL}``: the owning shard of each agent, or server_url"""
+    session = requests.Session()
+    urls = {}
+    for pc_name in agents:
+        response = session.get(f"{server_url}/api/route", params={'pc_name': pc_name}, timeout=10)
+        urls[pc_name] = response.json()['url'] if response.status_code == 200 else server_url
+    return urls
+
+
+def worker(urls, agents, interval, deadline, latencies, service, errors, missed, lock):
+    """Send samples for a slice of agents on a fixed schedule"""
+    session = requests.Session()
+    endpoints = [f"{urls[pc_name]}/api/metrics" for pc_name in agents]
+    local_latencies = []
+    local_service = []
+    local_errors = 0
+    step = interval / max(1, len(agents))
+    next_send = time.time()
+    i = 0
+    while True:
+        now = time.time()
+        if now >= deadline:
+            break
+        if next_send > now:
+            time.sleep(next_send - now)
+        start = time.perf_counter()
+        try:
+            response = session.post(endpoints[i], json=make_sample(agents[i]), timeout=10)
+            if response.status_code != 200:
+                local_errors += 1
+        except requests.RequestException:
+            local_errors += 1
+        local_service.append(time.perf_counter() - start)
+        # From the scheduled send time, so time spent waiting behind a slow request counts
+        local_latencies.append(time.time() - next_send)
+        i = (i + 1) % len(agents)
+        next_send += step
+    unsent = int((deadline - next_send) / step) + 1 if next_send < deadline else 0
+
+    with lock:
+        latencies.extend(local_latencies)
+        service.extend(local_service)
+        errors.append(local_errors)
+        missed.append(unsent)
+
+
+def run_level(server_url, agent_count, interval, duration, threads, routed=False):
+    agents = [f"LOADTEST-{n:05d}" for n in range(agent_count)]
+    urls = route(server_url, agents) if routed else dict.fromkeys(agents, server_url)
+    threads = min(threads, agent_count)
+    latencies = []
+    service = []
+    errors = []
+    missed = []
+    lock = threading.Lock()
+    deadline = time.time() + duration
+    pool = [
+        threading.Thread(target=worker, args=(urls, agents[k::threads], interval,
+                                              deadline, latencies, service, errors, missed, lock))
+        for k in range(threads)
+    ]
+    started = time.time()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.time() - started
+
+    latencies.sort()
+    service.sort()
+    return {
+        'agents': agent_count,
+        'offered_rps': round(agent_count / interval, 1),
+        'achieved_rps': round(len(latencies) / elapsed, 1),
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'unsent': sum(missed),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round((latencies[-1] if latencies else 0) * 1000, 2),
+        'service_p99_ms': round(percentile(service, 99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='System Monitor ingest load test')
+    parser.add_argument('--server', default='http://localhost:5000', help='Server URL')
+    parser.add_argument('--agents', default='1000,5000,10000',
+                        help='Comma-separated fleet sizes to simulate (default: 1000,5000,10000)')
+    parser.add_argument('--interval', type=float, default=5, help='Seconds between samples per agent')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds per fleet size')
+    parser.add_argument('--threads', type=int, default=64, help='Concurrent sender threads')
+    parser.add_argument('--route', action='store_true',
+                        help='Post each agent straight to its shard (serve.py --shards N)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    try:
+        requests.get(f"{args.server}/test", timeout=5)
+    except requests.RequestException:
+        print(f"❌ Cannot reach {args.server}. Start the server first.")
+        sys.exit(1)
+
+    results = []
+    for count in [int(n) for n in args.agents.split(',')]:
+        if not args.json:
+            print(f"⏳ {count} agents for {args.duration:.0f}s ...")
+        results.append(run_level(args.server, count, args.interval, args.duration, args.threads,
+                                 routed=args.route))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print()
+    print(f"{'agents':>8} {'offered/s':>10} {'achieved/s':>11} {'errors':>7} {'unsent':>7} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'svc p99':>8}")
+    for r in results:
+        print(f"{r['agents']:>8} {r['offered_rps']:>10} {r['achieved_rps']:>11} {r['errors']:>7} {r['unsent']:>7} "
+              f"{r['p50_ms']:>8} {r['p99_ms']:>8} {r['max_ms']:>8} {r['service_p99_ms']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Concurrency stress test for the server's in-memory state.
+
+Runs the Flask app in-process and hammers it from many threads at once:
+writers POST single samples and batches, readers list clients, query
+cursors and ranges, dump all metrics, and an expiry thread evicts hosts
+the way the cleanup task does. At the end it checks that no request
+failed and that every PC's ``last_seq`` equals the number of samples
+posted for it, then prints ingest and read throughput.
+
+    python benchmarks/stress_concurrency.py --writers 16 --readers 8 --hosts 200
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+
+def make_sample(pc_name, when):
+    return {
+        "pc_name": pc_name,
+        "timestamp": when.isoformat(),
+        "cpu_percent": round(random.uniform(0, 100), 2),
+        "memory_percent": round(random.uniform(0, 100), 2),
+        "memory_used_gb": 8.0,
+        "memory_total_gb": 16.0,
+        "disk_percent": 50.0,
+        "disk_used_gb": 250.0,
+        "disk_total_gb": 500.0,
+        "network_sent_mb": 1.0,
+        "network_recv_mb": 2.0,
+        "uptime_seconds": 3600,
+        "os_info": "Linux 6.1",
+    }
+
+
+def writer(server, hosts, samples, batch_size, sent, failures):
+    client = server.app.test_client()
+    counts = {}
+    done = 0
+    while done < samples:
+        pc_name = random.choice(hosts)
+        if batch_size > 1:
+            batch = [make_sample(pc_name, datetime.now()) for _ in range(batch_size)]
+            response = client.post('/api/metrics/batch', json=batch)
+            added = len(batch)
+        else:
+            response = client.post('/api/metrics', json=make_sample(pc_name, datetime.now()))
+            added = 1
+        if response.status_code != 200:
+            failures.append(('POST', response.status_code, response.get_data(as_text=True)))
+        else:
+            counts[pc_name] = counts.get(pc_name, 0) + added
+        done += added
+    sent.append(counts)
+
+
+def reader(server, hosts, stop, reads, failures):
+    client = server.app.test_client()
+    count = 0
+    while not stop.is_set():
+        pc_name = random.choice(hosts)
+        for url in ('/api/clients',
+                    f'/api/metrics/{pc_name}?since_seq=0&fields=cpu_percent',
+                    f'/api/metrics/{pc_name}?limit=50',
+                    f'/api/metrics/{pc_name}?max_points=20'):
+            response = client.get(url)
+            # 404 is fine: the PC may not have reported yet or was just evicted
+            if response.status_code not in (200, 404):
+                failures.append(('GET', url, response.status_code))
+            count += 1
+        if random.random() < 0.05:
+            response = client.get('/api/metrics')
+            if response.status_code != 200:
+                failures.append(('GET', '/api/metrics', response.status_code))
+            count += 1
+    reads.append(count)
+
+
+def expirer(server, stop, failures):
+    """Mimic cleanup_inactive_clients running flat out"""
+    while not stop.is_set():
+        try:
+            # Registry only; memory stays intact so the seq check below is exact
+            server.client_registry.advance(time.time() + server.OFFLINE_AFTER)
+            server.client_registry.pop_offline()
+            server.client_registry.snapshot()
+            server.metrics_store.items()
+        except Exception as e:
+            failures.append(('expire', repr(e)))
+        time.sleep(0.001)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='System Monitor concurrency stress test')
+    parser.add_argument('--writers', type=int, default=16, help='Concurrent ingest threads')
+    parser.add_argument('--readers', type=int, default=8, help='Concurrent query threads')
+    parser.add_argument('--hosts', type=int, default=200, help='Distinct PCs')
+    parser.add_argument('--samples', type=int, default=2000, help='Samples per writer')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='Samples per POST; >1 uses /api/metrics/batch')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='sysmon-stress-')
+    os.environ['SYSMON_DATA_DIR'] = data_dir
+    os.environ['SYSMON_DEBUG'] = '0'
+    import app as server
+
+    hosts = [f'STRESS-{n:04d}' for n in range(args.hosts)]
+    sent, reads, failures = [], [], []
+    stop = threading.Event()
+
+    writers = [threading.Thread(target=writer, args=(server, hosts, args.samples, args.batch_size,
+                                                     sent, failures))
+               for _ in range(args.writers)]
+    others = [threading.Thread(target=reader, args=(server, hosts, stop, reads, failures))
+              for _ in range(args.readers)]
+    others.append(threading.Thread(target=expirer, args=(server, stop, failures)))
+
+    started = time.time()
+    for t in writers + others:
+        t.start()
+    for t in writers:
+        t.join()
+    elapsed = time.time() - started
+    stop.set()
+    for t in others:
+        t.join()
+
+    expected = {}
+    for counts in sent:
+        for pc_name, count in counts.items():
+            expected[pc_name] = expected.get(pc_name, 0) + count
+    capacity = server.metrics_store.capacity
+    mismatched = []
+    for pc_name, count in expected.items():
+        result = server.metrics_store.query(pc_name, limit=1)
+        seq = result['last_seq'] if result else None
+        buffered = len(server.metrics_store.rows(pc_name) or [])
+        if seq != count or buffered != min(count, capacity):
+            mismatched.append({'pc_name': pc_name, 'posted': count, 'last_seq': seq,
+                               'buffered': buffered})
+
+    total = sum(expected.values())
+    results = {
+        'writers': args.writers,
+        'readers': args.readers,
+        'hosts': args.hosts,
+        'samples': total,
+        'seconds': round(elapsed, 2),
+        'ingest_per_sec': round(total / elapsed, 1),
+        'reads_per_sec': round(sum(reads) / elapsed, 1),
+        'failures': len(failures),
+        'seq_mismatches': len(mismatched),
+    }
+    server.segment_store.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for key, value in results.items():
+            print(f"{key:>15}: {value}")
+        for failure in failures[:5]:
+            print(f"❌ {failure}")
+        for mismatch in mismatched[:5]:
+            print(f"❌ {mismatch}")
+        if not failures and not mismatched:
+            print("✅ No lost updates or failed requests")
+    sys.exit(1 if failures or mismatched else 0)
+
+
+if __name__ == "__main__":
+    main()
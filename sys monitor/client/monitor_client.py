@@ -1,23 +1,570 @@
 import psutil
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import time
 import socket
 import platform
+import gzip
+import heapq
+import math
+import os
+import random
+import re
+import struct
+from collections import deque
 from datetime import datetime
 import sys
 
+try:
+    import zstandard
+except ImportError:  # zstd is optional; gzip is always available
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:  # MessagePack is optional; frames need only struct
+    msgpack = None
+
+try:
+    import socketio
+except ImportError:  # Only needed for --upstream socketio
+    socketio = None
+
+# Binary wire formats (see server/wire.py): field order sent at hello time
+WIRE_FIELDS = (
+    "cpu_percent", "memory_percent", "memory_used_gb", "memory_total_gb",
+    "disk_percent", "disk_used_gb", "disk_total_gb",
+    "network_sent_mb", "network_recv_mb", "uptime_seconds",
+)
+FRAME_MIMETYPE = "application/x-sysmon-frame"
+MSGPACK_MIMETYPE = "application/x-msgpack"
+FRAME_HEADER = struct.Struct("<2sBBIHH")  # magic, version, flags, host_id, schema_id, count
+FRAME_DETAIL = 0x01  # Flag: a length-prefixed JSON detail trailer follows the records
+MAX_WIRE_FIELDS = 256
+
+# Extended collector output that binary uploads carry as flattened series
+# (same names as server/extended_store.py) or as the JSON detail trailer
+EXTENDED_SCALARS = ("network_recv_mb_s", "network_sent_mb_s", "process_count")
+DETAIL_FIELDS = ("top_cpu", "top_memory")
+
+# A sharded server (serve.py --shards N) names the shard that owns this PC
+# at /api/route; uploads go there directly and the route is checked again
+# after this many seconds
+ROUTE_TTL = 300
+
+# Label rules of server/labels.py; one bad label would get every batch rejected
+MAX_LABELS = 32
+MAX_LABEL_VALUE_LENGTH = 128
+LABEL_KEY = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.\-/]{0,62}$")
+LABEL_VALUE = re.compile(r"^[A-Za-z0-9_.\-/:]*$")
+
+
+def parse_labels(pairs, path=None):
+    """Labels from KEY=VALUE strings and/or a file of KEY=VALUE lines
+
+    The file is read first, so --label flags override it. Raises
+    ValueError for a line or flag without '=', or a name or value the
+    server would reject.
+    """
+    lines = []
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = [line.strip() for line in f]
+    labels = {}
+    for pair in lines + list(pairs or ()):
+        if not pair or pair.startswith("#"):
+            continue
+        key, sep, value = pair.partition("=")
+        if not sep or not key.strip():
+            raise ValueError(f"expected KEY=VALUE, got {pair!r}")
+        key, value = key.strip(), value.strip()
+        if not LABEL_KEY.match(key):
+            raise ValueError(f"invalid label name {key!r} (letters, digits, _ . - /; at most 63)")
+        if len(value) > MAX_LABEL_VALUE_LENGTH or not LABEL_VALUE.match(value):
+            raise ValueError(f"invalid value for label {key}: {value!r} "
+                             f"(letters, digits, _ . - / :; at most {MAX_LABEL_VALUE_LENGTH})")
+        labels[key] = value
+    if len(labels) > MAX_LABELS:
+        raise ValueError(f"at most {MAX_LABELS} labels")
+    return labels
+
+
+def flatten_extended(sample):
+    """Numeric collector output as {series: value}, e.g. {"net.eth0.rx_mb_s": 0.2}"""
+    flat = {}
+    for index, value in enumerate(sample.get("cpu_per_core") or ()):
+        flat[f"cpu_core.{index}"] = value
+    for window, value in zip(("1m", "5m", "15m"), sample.get("load_avg") or ()):
+        flat[f"load.{window}"] = value
+    for disk in sample.get("disks") or ():
+        for metric in ("percent", "used_gb", "total_gb"):
+            flat[f"disk.{disk['mount']}.{metric}"] = disk[metric]
+    for field, prefix in (("disk_io", "disk_io"), ("net_rates", "net")):
+        for device, rates in (sample.get(field) or {}).items():
+            for metric, value in rates.items():
+                flat[f"{prefix}.{device}.{metric}"] = value
+    for field in EXTENDED_SCALARS:
+        if sample.get(field) is not None:
+            flat[field] = sample[field]
+    return {key: float(value) for key, value in flat.items() if len(key) <= 128}
+
+
+class MetricsJournal:
+    """Append-only on-disk journal for samples the server could not take"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, samples):
+        """Write samples to the end of the journal, one JSON object per line"""
+        if not samples:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for sample in samples:
+                f.write(json.dumps(sample) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read(self):
+        """Return all journaled samples, oldest first"""
+        if not os.path.exists(self.path):
+            return []
+        samples = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    samples.append(json.loads(line))
+                except ValueError:
+                    # Skip a torn last line from an interrupted write
+                    continue
+        return samples
+
+    def replace(self, samples):
+        """Atomically rewrite the journal with the given remaining samples"""
+        if not samples:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for sample in samples:
+                f.write(json.dumps(sample) + "\n")
+        os.replace(tmp_path, self.path)
+
+
+class TickScheduler:
+    """Fixed-rate scheduler aligned to wall-clock multiples of the interval
+
+    Ticks fire at k * interval seconds since the epoch, so hosts sharing an
+    interval sample at the same instants. Work that overruns a tick does
+    not push later ticks back; missed ticks are skipped instead.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_tick = (int(time.time() // interval) + 1) * interval
+
+    def wait(self):
+        """Sleep until the next tick and return its scheduled epoch time"""
+        delay = self.next_tick - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        tick = self.next_tick
+        self.next_tick += self.interval
+
+        # Fell behind by more than a whole period: skip to the next boundary
+        now = time.time()
+        if self.next_tick <= now:
+            missed = int((now - self.next_tick) // self.interval) + 1
+            self.next_tick += missed * self.interval
+        return tick
+
+
+class Collector:
+    """One group of extra metrics, gathered on its own cadence
+
+    Subclasses set ``name``, ``interval`` (seconds between runs) and
+    ``budget_ms`` and implement ``collect(now)``, returning a dict merged
+    into the sample. Rate collectors diff against their previous run, so
+    their first run only takes the baseline and returns nothing.
+    """
+
+    name = ""
+    interval = 5
+    budget_ms = 10
+
+    def collect(self, now):
+        raise NotImplementedError
+
+
+class CpuCoresCollector(Collector):
+    """Per-core CPU usage since the previous run"""
+
+    name = "cpu_cores"
+
+    def __init__(self):
+        psutil.cpu_percent(interval=None, percpu=True)
+
+    def collect(self, now):
+        return {"cpu_per_core": psutil.cpu_percent(interval=None, percpu=True)}
+
+
+class LoadAverageCollector(Collector):
+    """1/5/15 minute load average (emulated by psutil on Windows)"""
+
+    name = "load"
+
+    def __init__(self):
+        psutil.getloadavg()
+
+    def collect(self, now):
+        return {"load_avg": [round(value, 2) for value in psutil.getloadavg()]}
+
+
+class DiskUsageCollector(Collector):
+    """Usage of every mounted filesystem; changes slowly, so runs every minute"""
+
+    name = "disks"
+    interval = 60
+    budget_ms = 50
+
+    def collect(self, now):
+        disks = []
+        for partition in psutil.disk_partitions(all=False):
+            try:
+                usage = psutil.disk_usage(partition.mountpoint)
+            except (PermissionError, OSError):
+                continue  # e.g. an empty card reader or a stale network mount
+            disks.append({
+                "mount": partition.mountpoint,
+                "percent": usage.percent,
+                "used_gb": round(usage.used / (1024**3), 2),
+                "total_gb": round(usage.total / (1024**3), 2),
+            })
+        return {"disks": disks}
+
+
+class RateCollector(Collector):
+    """Per-device rates from the deltas of cumulative psutil counters"""
+
+    def __init__(self):
+        self.last = None
+        self.last_time = None
+
+    def counters(self):
+        raise NotImplementedError
+
+    def rates(self, previous, current, elapsed):
+        raise NotImplementedError
+
+    def collect(self, now):
+        current = self.counters()
+        previous, elapsed = self.last, (now - self.last_time) if self.last_time else 0
+        self.last, self.last_time = current, now
+        if previous is None or elapsed <= 0:
+            return {}
+        return self.rates(previous, current, elapsed)
+
+
+class DiskIOCollector(RateCollector):
+    """Per-disk IOPS and throughput"""
+
+    name = "disk_io"
+
+    def counters(self):
+        return psutil.disk_io_counters(perdisk=True) or {}
+
+    def rates(self, previous, current, elapsed):
+        disk_io = {}
+        for disk, io in current.items():
+            before = previous.get(disk)
+            if before is None:
+                continue
+            disk_io[disk] = {
+                "read_iops": round(max(0, io.read_count - before.read_count) / elapsed, 2),
+                "write_iops": round(max(0, io.write_count - before.write_count) / elapsed, 2),
+                "read_mb_s": round(max(0, io.read_bytes - before.read_bytes) / elapsed / (1024**2), 3),
+                "write_mb_s": round(max(0, io.write_bytes - before.write_bytes) / elapsed / (1024**2), 3),
+            }
+        return {"disk_io": disk_io}
+
+
+class NetworkRateCollector(RateCollector):
+    """Per-NIC receive/transmit rates, plus the host-wide totals"""
+
+    name = "net"
+
+    def counters(self):
+        return psutil.net_io_counters(pernic=True) or {}
+
+    def rates(self, previous, current, elapsed):
+        nics = {}
+        total_rx = total_tx = 0.0
+        for nic, io in current.items():
+            before = previous.get(nic)
+            if before is None:
+                continue
+            # Counters can reset (interface restart); never report negative rates
+            rx = max(0, io.bytes_recv - before.bytes_recv) / elapsed / (1024**2)
+            tx = max(0, io.bytes_sent - before.bytes_sent) / elapsed / (1024**2)
+            nics[nic] = {"rx_mb_s": round(rx, 3), "tx_mb_s": round(tx, 3)}
+            total_rx += rx
+            total_tx += tx
+        return {"net_rates": nics,
+                "network_recv_mb_s": round(total_rx, 3),
+                "network_sent_mb_s": round(total_tx, 3)}
+
+
+class TopProcessesCollector(Collector):
+    """Top-N processes by CPU and by resident memory
+
+    On Linux every process costs a single read of /proc/<pid>/stat, which
+    has the name, CPU ticks and RSS together (psutil would open two to
+    three files per process). Elsewhere ``process_iter`` fetches only the
+    few attributes we need and keeps the Process objects between calls, so
+    per-process CPU is a cheap delta there too.
+    """
+
+    name = "procs"
+    interval = 15
+    budget_ms = 50
+    ATTRS = ["pid", "name", "cpu_percent", "memory_info"]
+    PROC = "/proc"
+
+    def __init__(self, top_n=5):
+        self.top_n = top_n
+        self.use_proc = sys.platform.startswith("linux") and os.path.exists(f"{self.PROC}/self/stat")
+        if self.use_proc:
+            self.clock_ticks = os.sysconf("SC_CLK_TCK")
+            self.page_size = os.sysconf("SC_PAGE_SIZE")
+            self.ticks = {}
+            self.ticks_time = None
+        self.processes(time.time())  # Baseline for the per-process CPU deltas
+
+    def processes(self, now):
+        """(cpu_percent, rss bytes, pid, name) of every process"""
+        if not self.use_proc:
+            procs = []
+            for proc in psutil.process_iter(self.ATTRS, ad_value=None):
+                info = proc.info
+                memory = info["memory_info"]
+                procs.append((info["cpu_percent"] or 0.0, memory.rss if memory else 0,
+                              info["pid"], info["name"] or ""))
+            return procs
+
+        elapsed = (now - self.ticks_time) * self.clock_ticks if self.ticks_time else 0
+        previous, ticks, procs = self.ticks, {}, []
+        for entry in os.listdir(self.PROC):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"{self.PROC}/{entry}/stat", "rb") as f:
+                    stat = f.read()
+            except OSError:
+                continue  # Exited since listdir
+            # "pid (comm) state ..."; comm may itself contain spaces and parentheses
+            close = stat.rfind(b")")
+            fields = stat[close + 2:].split()
+            pid = int(entry)
+            used = int(fields[11]) + int(fields[12])  # utime + stime
+            ticks[pid] = used
+            before = previous.get(pid)
+            cpu = (used - before) * 100.0 / elapsed if before is not None and elapsed > 0 else 0.0
+            name = stat[stat.find(b"(") + 1:close].decode("utf-8", "replace")
+            procs.append((max(cpu, 0.0), int(fields[21]) * self.page_size, pid, name))
+        self.ticks, self.ticks_time = ticks, now
+        return procs
+
+    def collect(self, now):
+        procs = self.processes(now)
+
+        def entry(proc):
+            cpu, rss, pid, name = proc
+            return {"pid": pid, "name": name, "cpu_percent": round(cpu, 1),
+                    "rss_mb": round(rss / (1024**2), 1)}
+
+        by_cpu = heapq.nlargest(self.top_n, procs, key=lambda proc: proc[0])
+        by_rss = heapq.nlargest(self.top_n, procs, key=lambda proc: proc[1])
+        return {"top_cpu": [entry(proc) for proc in by_cpu],
+                "top_memory": [entry(proc) for proc in by_rss],
+                "process_count": len(procs)}
+
+
+COLLECTORS = {
+    cls.name: cls for cls in (CpuCoresCollector, LoadAverageCollector, DiskUsageCollector,
+                              DiskIOCollector, NetworkRateCollector, TopProcessesCollector)
+}
+
+
+class CollectorRegistry:
+    """Runs each collector when it is due and keeps it within its cost budget
+
+    A collector that takes longer than its ``budget_ms`` has its interval
+    doubled (up to 8x); once it is comfortably under budget again the
+    interval steps back down. A collector that raises is logged and
+    skipped for that tick.
+    """
+
+    MAX_SLOWDOWN = 8
+
+    def __init__(self, collectors):
+        self.collectors = list(collectors)
+        self.slowdown = {c.name: 1 for c in self.collectors}
+        self.next_run = {c.name: 0.0 for c in self.collectors}
+        self.last_cost_ms = {}
+
+    @classmethod
+    def from_names(cls, names, top_n=5):
+        collectors = []
+        for name in names:
+            if name not in COLLECTORS:
+                raise ValueError(f"Unknown collector: {name}")
+            if name == "procs":
+                collectors.append(TopProcessesCollector(top_n))
+            else:
+                collectors.append(COLLECTORS[name]())
+        return cls(collectors)
+
+    def collect(self, now):
+        """Run every due collector and merge their results"""
+        extra = {}
+        for collector in self.collectors:
+            name = collector.name
+            if now < self.next_run[name]:
+                continue
+            start = time.perf_counter()
+            try:
+                extra.update(collector.collect(now))
+            except Exception as e:
+                print(f"⚠️  Collector {name} failed: {e}")
+            cost_ms = (time.perf_counter() - start) * 1000
+            self.last_cost_ms[name] = round(cost_ms, 2)
+
+            slowdown = self.slowdown[name]
+            if cost_ms > collector.budget_ms and slowdown < self.MAX_SLOWDOWN:
+                slowdown *= 2
+                print(f"⚠️  Collector {name} took {cost_ms:.0f} ms (budget {collector.budget_ms} ms), "
+                      f"running it every {collector.interval * slowdown:g}s")
+            elif cost_ms < collector.budget_ms / 2 and slowdown > 1:
+                slowdown //= 2
+            self.slowdown[name] = slowdown
+            # Small tolerance so a collector due "now" on the next tick is not skipped
+            self.next_run[name] = now + collector.interval * slowdown - 0.001
+        return extra
+
+
+def make_session():
+    """Keep-alive HTTP session with a small connection pool
+
+    A pooled connection the server has closed is replaced transparently:
+    connect errors are retried once, which is safe for POSTs because the
+    request was never sent. Read errors and 5xx are left to the caller's
+    backoff.
+    """
+    session = requests.Session()
+    retry = Retry(total=1, connect=1, read=0, redirect=0, status=0, other=0)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
 class SystemMonitor:
-    def __init__(self, server_url="http://localhost:5000"):
+    def __init__(self, server_url="http://localhost:5000", batch_size=6,
+                 max_batch_age=15, max_queue=1000, compression="auto",
+                 journal_path=None, wire="json", upstream="http",
+                 collectors=tuple(COLLECTORS), top_n=5, labels=None):
         self.server_url = server_url
         self.pc_name = socket.gethostname()
-        self.api_endpoint = f"{server_url}/api/metrics"
+        # Where this PC sits (rack, row, role, ...), for the server's label selectors
+        self.labels = dict(labels or {})
+        self.session = make_session()
+        if self.pc_name.isascii():
+            # Lets a sharded front route our uploads without parsing them
+            self.session.headers["X-Sysmon-Host"] = self.pc_name
+
+        # Local buffering: flush when batch_size samples are queued or the
+        # oldest queued sample is max_batch_age seconds old
+        self.batch_size = max(1, batch_size)
+        self.max_batch_age = max_batch_age
+        self.queue = deque()
+        self.max_queue = max_queue
+        self.batch_supported = True
+
+        # Request body compression: "zstd", "gzip", "none" or "auto"
+        if compression == "auto":
+            compression = "zstd" if zstandard is not None else "gzip"
+        if compression == "zstd" and zstandard is None:
+            print("⚠️  zstandard not installed, falling back to gzip")
+            compression = "gzip"
+        self.compression = compression
+
+        # Upload format: "json", "frame" (packed float64 records) or "msgpack";
+        # binary formats register pc_name/os_info once via the hello handshake
+        if wire == "msgpack" and msgpack is None:
+            print("⚠️  msgpack not installed, falling back to frames")
+            wire = "frame"
+        self.wire = wire
+        self.host_id = None
+        self.schema_id = None
+        self.frame_record = None
+        # Extended series in the binary schema; grows (with a new hello)
+        # when a collector reports a new core, disk or NIC
+        self.extended_keys = []
+        self.wire_extended = True
+
+        # Upstream channel: "http" (pooled keep-alive POSTs) or "socketio"
+        # (one long-lived connection, batches pushed as 'ingest' events)
+        if upstream == "socketio" and socketio is None:
+            print("⚠️  python-socketio not installed, using HTTP")
+            upstream = "http"
+        self.upstream = upstream
+        self.sio = socketio.Client(reconnection=True) if upstream == "socketio" else None
+        self.sio_acked = False  # Server has answered an 'ingest' event at least once
+
+        # Where uploads go: server_url, or the shard that owns this PC
+        self.upload_url = None
+        self.route_at = 0.0
+        self.set_upload_url(server_url)
+
+        # Exponential backoff state for 5xx / connection errors
+        self.retry_base = 1.0
+        self.retry_max = 60.0
+        self.failures = 0
+        self.retry_at = 0.0
+
+        if journal_path is None:
+            journal_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                        f"{self.pc_name}.journal")
+        self.journal = MetricsJournal(journal_path)
+
+        # Values that do not change while the agent runs
+        self.boot_time = psutil.boot_time()
+        self.os_info = platform.system() + " " + platform.release()
+        self.prime_counters()
+
+        # Extra metrics (per-core CPU, per-mount disk, rates, top processes),
+        # each on its own cadence; see CollectorRegistry
+        self.collectors = CollectorRegistry.from_names(collectors, top_n)
+
+    def prime_counters(self):
+        """Take the baseline CPU snapshot that later non-blocking calls diff against"""
+        psutil.cpu_percent(interval=None)
         
-    def get_system_metrics(self):
-        """Collect current system metrics"""
+    def get_system_metrics(self, timestamp=None):
+        """Collect current system metrics without blocking
+
+        CPU usage is the delta since the previous call (primed in __init__),
+        so collection costs a few milliseconds instead of a 1 s sample.
+        """
         try:
-            # CPU usage
-            cpu_percent = psutil.cpu_percent(interval=1)
+            # CPU usage since the previous tick
+            cpu_percent = psutil.cpu_percent(interval=None)
             
             # Memory usage
             memory = psutil.virtual_memory()
@@ -37,12 +584,13 @@ class SystemMonitor:
             network_recv_mb = network.bytes_recv / (1024**2)
             
             # System info
-            boot_time = psutil.boot_time()
-            uptime_seconds = time.time() - boot_time
+            if timestamp is None:
+                timestamp = time.time()
+            uptime_seconds = timestamp - self.boot_time
             
             metrics = {
                 "pc_name": self.pc_name,
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": datetime.fromtimestamp(timestamp).isoformat(),
                 "cpu_percent": round(cpu_percent, 2),
                 "memory_percent": round(memory_percent, 2),
                 "memory_used_gb": round(memory_used_gb, 2),
@@ -53,8 +601,10 @@ class SystemMonitor:
                 "network_sent_mb": round(network_sent_mb, 2),
                 "network_recv_mb": round(network_recv_mb, 2),
                 "uptime_seconds": int(uptime_seconds),
-                "os_info": platform.system() + " " + platform.release()
+                "os_info": self.os_info,
+                "labels": self.labels
             }
+            metrics.update(self.collectors.collect(timestamp))
             
             return metrics
             
@@ -62,10 +612,167 @@ class SystemMonitor:
             print(f"Error collecting metrics: {e}")
             return None
     
+    def set_upload_url(self, url):
+        """Send uploads (and the hello) to ``url`` from now on"""
+        if url == self.upload_url:
+            return
+        self.upload_url = url
+        self.api_endpoint = f"{url}/api/metrics"
+        self.batch_endpoint = f"{url}/api/metrics/batch"
+        self.hello_endpoint = f"{url}/api/agents/hello"
+        self.host_id = None  # Binary host ids belong to one server process
+        if self.sio is not None and self.sio.connected:
+            self.sio.disconnect()  # The next push connects to the new URL
+
+    def route_uploads(self, now=None):
+        """Ask the server which shard owns this PC, at most every ROUTE_TTL seconds
+
+        A single server has no /api/route, so uploads stay on server_url.
+        """
+        now = time.time() if now is None else now
+        if now < self.route_at:
+            return
+        self.route_at = now + ROUTE_TTL
+        url = self.server_url
+        try:
+            response = self.session.get(f"{self.server_url}/api/route",
+                                        params={"pc_name": self.pc_name}, timeout=5)
+            if response.status_code == 200:
+                url = response.json().get("url") or url
+        except (requests.exceptions.RequestException, ValueError):
+            pass
+        if url != self.upload_url:
+            print(f"🔀 Uploading to {url}")
+        self.set_upload_url(url)
+
+    def unreachable(self):
+        """Connection failed: retry through server_url if we were talking to a shard"""
+        if self.upload_url != self.server_url:
+            print("⚠️  Shard unreachable, uploading through the server URL")
+            self.set_upload_url(self.server_url)
+            return "retry"
+        print("✗ Cannot connect to server. Make sure the server is running.")
+        return "unreachable"
+
+    def hello(self):
+        """Register static attributes and field order for binary uploads
+
+        Returns "ok" (registered, or fell back to JSON on an older server),
+        "unreachable" or "retry", like send_batch.
+        """
+        fields = list(WIRE_FIELDS) + self.extended_keys
+        payload = {"pc_name": self.pc_name, "os_info": self.os_info, "fields": fields,
+                   "labels": self.labels}
+        try:
+            response = self.session.post(self.hello_endpoint, json=payload, timeout=5)
+        except requests.exceptions.ConnectionError:
+            return self.unreachable()
+        except requests.exceptions.RequestException as e:
+            print(f"✗ Handshake failed: {e}")
+            return "retry"
+        if response.status_code == 200:
+            reply = response.json()
+            self.host_id = reply["host_id"]
+            self.schema_id = reply["schema_id"]
+            self.frame_record = struct.Struct("<%dd" % (1 + len(fields)))
+            if self.wire == "msgpack" and MSGPACK_MIMETYPE not in reply.get("formats", []):
+                print("⚠️  Server cannot read msgpack, using frames")
+                self.wire = "frame"
+            return "ok"
+        if response.status_code in (404, 405):
+            # Older server without binary ingest
+            print("⚠️  Server has no binary ingest, sending JSON")
+            self.wire = "json"
+            return "ok"
+        if response.status_code == 400 and self.wire_extended:
+            # Older server that only knows the core fields
+            print("⚠️  Server cannot take extended metrics in binary uploads, sending core fields only")
+            self.wire_extended = False
+            self.extended_keys = []
+            return self.hello()
+        if response.status_code == 421:
+            return self.misrouted()
+        print(f"✗ Handshake rejected. Status: {response.status_code}")
+        return "retry"
+
+    def learn_extended_keys(self, samples):
+        """Add newly reported extended series to the binary schema
+
+        Returns True when the schema grew, so a new hello is needed.
+        """
+        if not self.wire_extended:
+            return False
+        known = set(self.extended_keys)
+        new = set()
+        for sample in samples:
+            new.update(key for key in flatten_extended(sample) if key not in known)
+        room = MAX_WIRE_FIELDS - len(WIRE_FIELDS) - len(known)
+        if not new or room <= 0:
+            return False
+        self.extended_keys += sorted(new)[:room]
+        return True
+
+    def wire_records(self, samples):
+        """Samples as (timestamp, values...) tuples in schema order"""
+        records = []
+        for sample in samples:
+            record = [datetime.fromisoformat(sample["timestamp"]).timestamp()]
+            for field in WIRE_FIELDS:
+                value = sample.get(field)
+                record.append(math.nan if value is None else float(value))
+            if self.extended_keys:
+                flat = flatten_extended(sample)
+                record.extend(flat.get(key, math.nan) for key in self.extended_keys)
+            records.append(record)
+        return records
+
+    def wire_detail(self, samples):
+        """Top-process lists of the newest sample that has them, or None"""
+        if not self.wire_extended:
+            return None
+        for sample in reversed(samples):
+            detail = {field: sample[field] for field in DETAIL_FIELDS if field in sample}
+            if detail:
+                detail["timestamp"] = datetime.fromisoformat(sample["timestamp"]).timestamp()
+                return detail
+        return None
+
+    def wire_body(self, samples):
+        """Serialize a batch in the wire format; return (body, content type)"""
+        if self.wire == "frame":
+            records = self.wire_records(samples)
+            detail = self.wire_detail(samples)
+            header = FRAME_HEADER.pack(b"SM", 1, FRAME_DETAIL if detail else 0,
+                                       self.host_id, self.schema_id, len(records))
+            body = header + b"".join(self.frame_record.pack(*record) for record in records)
+            if detail:
+                trailer = json.dumps(detail).encode('utf-8')
+                body += struct.pack("<I", len(trailer)) + trailer
+            return body, FRAME_MIMETYPE
+        if self.wire == "msgpack":
+            message = [self.host_id, self.schema_id, self.wire_records(samples)]
+            detail = self.wire_detail(samples)
+            if detail:
+                message.append(detail)
+            return msgpack.packb(message), MSGPACK_MIMETYPE
+        return json.dumps({'samples': samples}).encode('utf-8'), 'application/json'
+
+    def encode_body(self, samples):
+        """Serialize a batch in the wire format and compress it; return (body, headers)"""
+        body, content_type = self.wire_body(samples)
+        headers = {'Content-Type': content_type}
+        if self.compression == "zstd":
+            body = zstandard.ZstdCompressor().compress(body)
+            headers['Content-Encoding'] = 'zstd'
+        elif self.compression == "gzip":
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
+        return body, headers
+
     def send_metrics(self, metrics):
-        """Send metrics to the server"""
+        """Send a single sample to the server (unbatched)"""
         try:
-            response = requests.post(
+            response = self.session.post(
                 self.api_endpoint,
                 json=metrics,
                 headers={'Content-Type': 'application/json'},
@@ -74,8 +781,10 @@ class SystemMonitor:
             
             if response.status_code == 200:
                 print(f"✓ Metrics sent successfully - CPU: {metrics['cpu_percent']}%, RAM: {metrics['memory_percent']}%")
+                return True
             else:
                 print(f"✗ Failed to send metrics. Status: {response.status_code}")
+                return False
                 
         except requests.exceptions.ConnectionError:
             print("✗ Cannot connect to server. Make sure the server is running.")
@@ -83,6 +792,183 @@ class SystemMonitor:
             print("✗ Request timeout. Server might be overloaded.")
         except Exception as e:
             print(f"✗ Error sending metrics: {e}")
+        return False
+
+    def send_batch(self, samples):
+        """POST a batch of samples and classify the outcome
+
+        Returns "ok", "retry" (5xx/timeout), "unreachable" (connection
+        error) or "rejected" (4xx, retrying will not help).
+        """
+        if not self.batch_supported:
+            for sample in samples:
+                if not self.send_metrics(sample):
+                    return "retry"
+            return "ok"
+
+        self.route_uploads()
+        if self.wire != "json" and self.learn_extended_keys(samples):
+            self.host_id = None  # Register the wider schema
+        if self.wire != "json" and self.host_id is None:
+            status = self.hello()
+            if status != "ok":
+                return status
+        if self.sio is not None:
+            return self.push_batch(samples)
+
+        body, headers = self.encode_body(samples)
+        try:
+            response = self.session.post(self.batch_endpoint, data=body,
+                                         headers=headers, timeout=10)
+        except requests.exceptions.ConnectionError:
+            return self.unreachable()
+        except requests.exceptions.Timeout:
+            print("✗ Request timeout. Server might be overloaded.")
+            return "retry"
+        except Exception as e:
+            print(f"✗ Error sending metrics: {e}")
+            return "retry"
+
+        if response.status_code == 404:
+            # Older server without the batch endpoint
+            print("⚠️  Server has no batch endpoint, sending samples one by one")
+            self.batch_supported = False
+            return self.send_batch(samples)
+        return self.batch_outcome(response.status_code, samples, len(body))
+
+    def push_batch(self, samples):
+        """Send a batch as an 'ingest' event on the Socket.IO upstream
+
+        The connection is opened on first use and kept; python-socketio
+        reconnects it in the background after drops. A server without the
+        'ingest' handler never acks, so if the first event after connecting
+        times out the agent switches to HTTP for good.
+        """
+        try:
+            if not self.sio.connected:
+                self.sio.connect(self.upload_url, wait_timeout=5)
+            if self.wire == "json":
+                payload = {'samples': samples}
+            else:
+                body, content_type = self.wire_body(samples)
+                payload = {'mimetype': content_type, 'body': body}
+            reply = self.sio.call('ingest', payload, timeout=10)
+        except socketio.exceptions.ConnectionError:
+            return self.unreachable()
+        except socketio.exceptions.TimeoutError:
+            if not self.sio_acked:
+                return self.fall_back_to_http(samples)
+            print("✗ Request timeout. Server might be overloaded.")
+            return "retry"
+        except Exception as e:
+            print(f"✗ Error sending metrics: {e}")
+            return "retry"
+        if not isinstance(reply, dict):
+            return self.fall_back_to_http(samples)
+        self.sio_acked = True
+        return self.batch_outcome(reply.get('status', 500), samples)
+
+    def fall_back_to_http(self, samples):
+        """Older server without the 'ingest' event: upload over HTTP from now on"""
+        print("⚠️  Server has no Socket.IO ingest, using HTTP")
+        self.sio.disconnect()
+        self.sio = None
+        self.upstream = "http"
+        return self.send_batch(samples)
+
+    def batch_outcome(self, status_code, samples, size=None):
+        """Classify a batch reply (HTTP status code) like send_batch does"""
+        if status_code == 200:
+            latest = samples[-1]
+            sent = f"{len(samples)} samples" + (f" ({size} bytes)" if size is not None else "")
+            print(f"✓ Sent {sent} - CPU: {latest['cpu_percent']}%, RAM: {latest['memory_percent']}%")
+            return "ok"
+        if status_code == 409 and self.wire != "json":
+            # Server restarted and forgot our host_id: say hello again
+            print("⚠️  Server lost our registration, repeating handshake")
+            self.host_id = None
+            return "retry"
+        if status_code == 421:
+            return self.misrouted()
+        if status_code >= 500:
+            print(f"✗ Server error {status_code}, will retry")
+            return "retry"
+        print(f"✗ Batch rejected. Status: {status_code}")
+        return "rejected"
+
+    def misrouted(self):
+        """421: the sharded server was resized and this PC moved to another shard"""
+        print("⚠️  Wrong shard for this PC, asking the server for its route")
+        self.route_at = 0.0
+        return "retry"
+
+    def enqueue(self, metrics, now=None):
+        """Add a sample to the local queue, spilling the oldest to disk when full"""
+        now = time.time() if now is None else now
+        self.queue.append((now, metrics))
+        if len(self.queue) > self.max_queue:
+            overflow = [self.queue.popleft()[1] for _ in range(len(self.queue) - self.max_queue)]
+            self.journal.append(overflow)
+
+    def spill(self):
+        """Move everything still queued in memory to the on-disk journal"""
+        self.journal.append([metrics for _, metrics in self.queue])
+        self.queue.clear()
+
+    def should_flush(self, now):
+        if not self.queue or now < self.retry_at:
+            return False
+        if len(self.queue) >= self.batch_size:
+            return True
+        queued_at = self.queue[0][0]
+        return now - queued_at >= self.max_batch_age
+
+    def backoff(self, now):
+        """Schedule the next attempt with exponential backoff and jitter"""
+        self.failures += 1
+        delay = min(self.retry_max, self.retry_base * (2 ** (self.failures - 1)))
+        self.retry_at = now + delay * random.uniform(0.5, 1.0)
+
+    def flush(self, now=None):
+        """Send queued samples in batches, then replay the on-disk journal"""
+        now = time.time() if now is None else now
+        while self.queue:
+            count = min(self.batch_size, len(self.queue))
+            batch = [self.queue[i][1] for i in range(count)]
+            status = self.send_batch(batch)
+            if status == "retry":
+                self.backoff(now)
+                return False
+            if status == "unreachable":
+                # Keep nothing in memory that the disk can hold
+                self.spill()
+                self.backoff(now)
+                return False
+            # "ok" or "rejected": either way these samples are done
+            for _ in range(count):
+                self.queue.popleft()
+
+        self.failures = 0
+        self.retry_at = 0.0
+        return self.replay_journal(now)
+
+    def replay_journal(self, now):
+        """Resend journaled samples after the server becomes reachable"""
+        pending = self.journal.read()
+        if not pending:
+            return True
+        print(f"📼 Replaying {len(pending)} journaled samples")
+        sent = 0
+        while sent < len(pending):
+            batch = pending[sent:sent + self.batch_size * 10]
+            status = self.send_batch(batch)
+            if status in ("retry", "unreachable"):
+                self.journal.replace(pending[sent:])
+                self.backoff(now)
+                return False
+            sent += len(batch)
+        self.journal.replace([])
+        return True
     
     def run(self, interval=5):
         """Run the monitoring loop"""
@@ -90,18 +976,27 @@ class SystemMonitor:
         print(f"📊 PC Name: {self.pc_name}")
         print(f"🌐 Server URL: {self.server_url}")
         print(f"⏱️  Update Interval: {interval} seconds")
+        print(f"📦 Batching: {self.batch_size} samples / {self.max_batch_age}s, compression: {self.compression}, wire: {self.wire}, upstream: {self.upstream}")
+        print(f"🧩 Collectors: {', '.join(c.name for c in self.collectors.collectors) or 'none'}")
         print(f"📈 Press Ctrl+C to stop monitoring\n")
         
+        scheduler = TickScheduler(interval)
         try:
             while True:
-                metrics = self.get_system_metrics()
+                tick = scheduler.wait()
+                metrics = self.get_system_metrics(timestamp=tick)
                 if metrics:
-                    self.send_metrics(metrics)
-                
-                time.sleep(interval)
+                    self.enqueue(metrics)
+
+                if self.should_flush(time.time()):
+                    self.flush()
                 
         except KeyboardInterrupt:
             print("\n🛑 Monitoring stopped by user")
+            # Do not lose what is still buffered
+            self.spill()
+            if self.sio is not None and self.sio.connected:
+                self.sio.disconnect()
         except Exception as e:
             print(f"❌ Unexpected error: {e}")
 
@@ -111,12 +1006,56 @@ def main():
     parser = argparse.ArgumentParser(description='System Monitor Client')
     parser.add_argument('--server', default='http://localhost:5000', 
                        help='Server URL (default: http://localhost:5000)')
-    parser.add_argument('--interval', type=int, default=5,
-                       help='Update interval in seconds (default: 5)')
+    parser.add_argument('--interval', type=float, default=5,
+                       help='Update interval in seconds, sub-second allowed e.g. 0.25 (default: 5)')
+    parser.add_argument('--batch-size', type=int, default=6,
+                       help='Samples per upload batch (default: 6)')
+    parser.add_argument('--max-batch-age', type=float, default=15,
+                       help='Flush when the oldest queued sample is this many seconds old (default: 15)')
+    parser.add_argument('--max-queue', type=int, default=1000,
+                       help='Samples kept in memory before spilling to the journal (default: 1000)')
+    parser.add_argument('--compression', choices=['auto', 'zstd', 'gzip', 'none'], default='auto',
+                       help='Request body compression (default: zstd if installed, else gzip)')
+    parser.add_argument('--journal', default=None,
+                       help='Path of the on-disk journal for unsent samples')
+    parser.add_argument('--wire', choices=['json', 'frame', 'msgpack'], default='json',
+                       help='Upload format; frame/msgpack send packed numbers after a handshake (default: json)')
+    parser.add_argument('--collectors', default='all',
+                       help=f"Extra collectors, comma-separated, 'all' or 'none' ({','.join(COLLECTORS)}; default: all)")
+    parser.add_argument('--top-n', type=int, default=5,
+                       help='Processes reported by the procs collector (default: 5)')
+    parser.add_argument('--upstream', choices=['http', 'socketio'], default='http',
+                       help='Upload channel: keep-alive HTTP, or one long-lived Socket.IO connection (default: http)')
+    parser.add_argument('--label', action='append', default=[], metavar='KEY=VALUE',
+                       help='Label for this PC, e.g. --label rack=r12 --label role=db (repeatable)')
+    parser.add_argument('--labels-file', default=None,
+                       help='File of KEY=VALUE lines with this PC\'s labels (--label overrides it)')
     
     args = parser.parse_args()
+    try:
+        labels = parse_labels(args.label, args.labels_file)
+    except (OSError, ValueError) as e:
+        parser.error(f"labels: {e}")
+    if args.collectors == 'all':
+        collectors = tuple(COLLECTORS)
+    elif args.collectors == 'none':
+        collectors = ()
+    else:
+        collectors = [name.strip() for name in args.collectors.split(',') if name.strip()]
+        unknown = [name for name in collectors if name not in COLLECTORS]
+        if unknown:
+            parser.error(f"unknown collectors: {', '.join(unknown)}")
     
-    monitor = SystemMonitor(args.server)
+    monitor = SystemMonitor(args.server, batch_size=args.batch_size,
+                            max_batch_age=args.max_batch_age,
+                            max_queue=args.max_queue,
+                            compression=args.compression,
+                            journal_path=args.journal,
+                            wire=args.wire,
+                            upstream=args.upstream,
+                            collectors=collectors,
+                            top_n=args.top_n,
+                            labels=labels)
     monitor.run(args.interval)
 
 if __name__ == "__main__":
@@ -0,0 +1,291 @@
+"""
+Streaming alert rules, evaluated on every ingested sample.
+
+Rules are loaded from a JSON file (``alert_rules.json`` next to this
+module, or ``SYSMON_ALERT_RULES``)::
+
+    {
+      "rules": [
+        {"name": "cpu_high",  "expr": "cpu_percent > 90 for 2m", "severity": "warning"},
+        {"name": "disk_full", "expr": "disk_percent >= 95", "severity": "critical"},
+        {"name": "disk_filling", "expr": "rate(disk_used_gb) > 0.01 over 10m for 5m"}
+      ],
+      "webhook": "http://127.0.0.1:9000/alerts"
+    }
+
+An expression is ``<field> <op> <threshold>``, where ``<field>`` is a
+NUMERIC_FIELDS column or an extended series such as ``load.1m``. The
+threshold may be followed by ``for <duration>`` (the condition must hold
+that long before the alert fires). ``rate(<field>)`` compares the change
+per second instead, smoothed over ``over <duration>`` (default 1m).
+Durations take an ``s``, ``m`` or ``h`` suffix.
+
+Every rule keeps a fixed handful of numbers per host (state, since,
+previous value, smoothed rate), updated from each new sample. Evaluation
+never looks back at stored history, so its cost per sample depends only
+on the number of rules. Transitions (``firing`` and ``resolved``) are
+returned to the caller, which pushes them to dashboards and the webhook
+sink.
+"""
+
+import json
+import logging
+import math
+import queue
+import re
+import threading
+import urllib.request
+
+from metrics_store import DEFAULT_STRIPES, NUMERIC_FIELDS, StripedLock, format_timestamp
+
+logger = logging.getLogger('sysmon.alerts')
+
+FIRING = 'firing'
+RESOLVED = 'resolved'
+
+# Per-rule, per-host state values
+_INACTIVE, _PENDING, _FIRING = 0, 1, 2
+
+DEFAULT_RATE_WINDOW = 60.0
+
+OPERATORS = {
+    '>': lambda value, threshold: value > threshold,
+    '>=': lambda value, threshold: value >= threshold,
+    '<': lambda value, threshold: value < threshold,
+    '<=': lambda value, threshold: value <= threshold,
+    '==': lambda value, threshold: value == threshold,
+    '!=': lambda value, threshold: value != threshold,
+}
+
+_DURATION = r'\d+(?:\.\d+)?[smh]?'
+_EXPR = re.compile(
+    r'^\s*(?:rate\(\s*(?P<rate>[^\s()]+)\s*\)|(?P<field>[^\s()<>=!]+))'
+    r'\s*(?P<op>>=|<=|==|!=|>|<)\s*(?P<threshold>-?\d+(?:\.\d+)?)'
+    rf'(?:\s+over\s+(?P<over>{_DURATION}))?'
+    rf'(?:\s+for\s+(?P<hold>{_DURATION}))?\s*$')
+
+
+def parse_duration(value):
+    """'90', '30s', '2m' or '1h' to seconds"""
+    value = str(value).strip()
+    scale = {'s': 1, 'm': 60, 'h': 3600}.get(value[-1:], None)
+    if scale is None:
+        return float(value)
+    return float(value[:-1]) * scale
+
+
+class Rule:
+    """One parsed alert rule"""
+
+    __slots__ = ('name', 'expr', 'field', 'slot', 'op', 'compare', 'threshold',
+                 'rate', 'over', 'hold', 'severity')
+
+    def __init__(self, name, expr, severity='warning'):
+        match = _EXPR.match(expr or '')
+        if match is None:
+            raise ValueError(f'Cannot parse alert expression {expr!r}')
+        self.name = name
+        self.expr = expr
+        self.rate = match.group('rate') is not None
+        self.field = match.group('rate') or match.group('field')
+        # Column index for NUMERIC_FIELDS, None for an extended series
+        self.slot = NUMERIC_FIELDS.index(self.field) if self.field in NUMERIC_FIELDS else None
+        self.op = match.group('op')
+        self.compare = OPERATORS[self.op]
+        self.threshold = float(match.group('threshold'))
+        over = match.group('over')
+        if over is not None and not self.rate:
+            raise ValueError(f"'over' only applies to rate(): {expr!r}")
+        self.over = parse_duration(over) if over else DEFAULT_RATE_WINDOW
+        self.hold = parse_duration(match.group('hold')) if match.group('hold') else 0.0
+        self.severity = severity
+
+    def describe(self):
+        return {'name': self.name, 'expr': self.expr, 'severity': self.severity}
+
+
+def load_rules(path):
+    """Read ``(rules, webhook URL)`` from a JSON rules file
+
+    A missing file means no rules. Malformed rules raise ValueError.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return [], None
+    rules = []
+    names = set()
+    for index, spec in enumerate(config.get('rules') or []):
+        name = spec.get('name') or f'rule{index + 1}'
+        if name in names:
+            raise ValueError(f'Duplicate alert rule name {name!r}')
+        names.add(name)
+        rules.append(Rule(name, spec.get('expr'), spec.get('severity', 'warning')))
+    return rules, config.get('webhook')
+
+
+class _RuleState:
+    """Running state of one rule for one host (O(1), whatever the history)"""
+
+    __slots__ = ('state', 'since', 'value', 'last_ts', 'last_value', 'rate')
+
+    def __init__(self):
+        self.state = _INACTIVE
+        self.since = None       # When the condition started holding
+        self.value = None       # Value (or rate) the condition last saw
+        self.last_ts = None     # Previous sample, for rate rules
+        self.last_value = None
+        self.rate = None        # Smoothed change per second
+
+
+class AlertEngine:
+    """Evaluates every rule against each new sample of every host"""
+
+    def __init__(self, rules=(), stripes=DEFAULT_STRIPES):
+        self.rules = list(rules)
+        self._hosts = {}    # pc_name -> (newest evaluated timestamp, [_RuleState per rule])
+        self._lock = StripedLock(stripes)
+        self._firing = {}   # (pc_name, rule name) -> firing event
+        self._firing_lock = threading.Lock()
+
+    def evaluate(self, entries, extended=None):
+        """Feed decoded entries (and parallel extended pairs); return transitions
+
+        Samples older than the newest one already evaluated for their host
+        (journal replays) are skipped: alert state only moves forward.
+        """
+        if not self.rules:
+            return []
+        by_host = {}
+        for index, entry in enumerate(entries):
+            by_host.setdefault(entry[0], []).append(index)
+        events = []
+        for pc_name, indexes in by_host.items():
+            with self._lock(pc_name):
+                host = self._hosts.get(pc_name)
+                if host is None:
+                    host = self._hosts[pc_name] = [None, [_RuleState() for _ in self.rules]]
+                for index in sorted(indexes, key=lambda i: entries[i][1]):
+                    _, timestamp, values, _ = entries[index]
+                    if host[0] is not None and timestamp <= host[0]:
+                        continue
+                    host[0] = timestamp
+                    scalars = extended[index][0] if extended is not None else None
+                    self._step(pc_name, timestamp, values, scalars, host[1], events)
+        if events:
+            with self._firing_lock:
+                for event in events:
+                    key = (event['pc_name'], event['rule'])
+                    if event['state'] == FIRING:
+                        self._firing[key] = event
+                    else:
+                        self._firing.pop(key, None)
+        return events
+
+    def _step(self, pc_name, timestamp, values, scalars, states, events):
+        for rule, st in zip(self.rules, states):
+            if rule.slot is not None:
+                value = values[rule.slot]
+            elif scalars is not None:
+                value = scalars.get(rule.field, math.nan)
+            else:
+                continue
+            if math.isnan(value):
+                continue
+
+            if rule.rate:
+                previous_ts, previous = st.last_ts, st.last_value
+                st.last_ts, st.last_value = timestamp, value
+                if previous_ts is None or timestamp <= previous_ts:
+                    continue
+                elapsed = timestamp - previous_ts
+                instant = (value - previous) / elapsed
+                # Exponentially weighted over ``over`` seconds: O(1) running window
+                alpha = 1.0 - math.exp(-elapsed / rule.over)
+                st.rate = instant if st.rate is None else st.rate + alpha * (instant - st.rate)
+                value = st.rate
+
+            st.value = value
+            if rule.compare(value, rule.threshold):
+                if st.state == _INACTIVE:
+                    st.state = _PENDING
+                    st.since = timestamp
+                if st.state == _PENDING and timestamp - st.since >= rule.hold:
+                    st.state = _FIRING
+                    events.append(self._event(pc_name, rule, FIRING, value, st.since, timestamp))
+            else:
+                if st.state == _FIRING:
+                    events.append(self._event(pc_name, rule, RESOLVED, value, st.since, timestamp))
+                st.state = _INACTIVE
+                st.since = None
+
+    def _event(self, pc_name, rule, state, value, since, timestamp):
+        return {
+            'pc_name': pc_name,
+            'rule': rule.name,
+            'state': state,
+            'severity': rule.severity,
+            'expr': rule.expr,
+            'value': round(value, 4),
+            'threshold': rule.threshold,
+            'since': format_timestamp(since),
+            'timestamp': format_timestamp(timestamp),
+        }
+
+    def remove(self, pc_name):
+        """Forget a host (it went offline); returns ``resolved`` events for its firing alerts"""
+        with self._lock(pc_name):
+            self._hosts.pop(pc_name, None)
+        events = []
+        with self._firing_lock:
+            for key in [key for key in self._firing if key[0] == pc_name]:
+                event = dict(self._firing.pop(key), state=RESOLVED, reason='offline')
+                events.append(event)
+        return events
+
+    def firing(self):
+        """Currently firing alerts, oldest first"""
+        with self._firing_lock:
+            events = list(self._firing.values())
+        return sorted(events, key=lambda event: event['since'])
+
+
+class WebhookSink:
+    """POSTs alert transitions as JSON to a URL from a background thread
+
+    Ingest only enqueues. When the queue is full (the receiver is down or
+    slow) new events are dropped and counted rather than blocking.
+    """
+
+    def __init__(self, url, max_queue=1000, timeout=5):
+        self.url = url
+        self.timeout = timeout
+        self.dropped = 0
+        self.sent = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+
+    def send(self, events):
+        for event in events:
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                self.dropped += 1
+
+    def run(self):
+        """Background thread: deliver queued events one request each"""
+        while True:
+            event = self._queue.get()
+            request = urllib.request.Request(
+                self.url, data=json.dumps(event).encode('utf-8'),
+                headers={'Content-Type': 'application/json'}, method='POST')
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    response.read()
+                self.sent += 1
+            except Exception as e:
+                self.dropped += 1
+                logger.warning("Alert webhook %s failed: %s", self.url, e)
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True, name='alert-webhook').start()
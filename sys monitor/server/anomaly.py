@@ -0,0 +1,248 @@
+"""
+Anomaly detection over the whole fleet with vectorized rolling statistics.
+
+Ingest only adds each sample to a per-host running sum (one row of a
+NumPy matrix per PC). Every ``interval`` seconds ``run()`` turns those
+sums into one observation per host and, for all hosts at once as matrix
+operations:
+
+- scores it against the host's exponentially weighted mean and variance
+  (a rolling window of roughly ``window`` observations), giving a z-score;
+- scores it against the host's baseline for the same hour of the day
+  (``seasons`` slots, each with its own weighted mean and variance over
+  about a week), so a nightly backup or a morning peak that happens every
+  day is not flagged once the slot has seen a full day;
+- updates both baselines and a short EWMA of the level. Observations are
+  clipped to ``threshold`` standard deviations first, so one outlier does
+  not blow up the variance; a lasting level shift is still absorbed over
+  about ``window`` observations.
+
+A host/field is flagged when its z-score is beyond ``threshold`` and so
+is its seasonal z-score (or the seasonal baseline is still warming up).
+Start and end of a flag are returned as events shaped like alert events
+(``rule`` is ``anomaly:<field>``), so dashboards show them the same way.
+"""
+
+import logging
+import threading
+import time
+
+import numpy as np
+
+from metrics_store import NUMERIC_FIELDS, format_timestamp
+
+logger = logging.getLogger('sysmon.anomaly')
+
+# Gauges worth scoring; counters (network totals, uptime) only ever grow
+DEFAULT_FIELDS = ('cpu_percent', 'memory_percent', 'disk_percent')
+DEFAULT_WINDOW = 60      # Observations the rolling baseline roughly spans
+DEFAULT_SEASONS = 24     # Hour-of-day slots
+DEFAULT_THRESHOLD = 4.0  # |z| beyond this is an outlier
+DEFAULT_WARMUP = 30      # Observations before a host is scored at all
+SEASON_DAYS = 7          # Days the seasonal baselines roughly span
+MIN_STD = 1.0            # Floor for the std (in field units): flat series are not noisy
+
+FIRING = 'firing'
+RESOLVED = 'resolved'
+
+
+class AnomalyDetector:
+    """Per-host rolling baselines, scored for all hosts in one vectorized pass"""
+
+    def __init__(self, fields=DEFAULT_FIELDS, interval=5.0, window=DEFAULT_WINDOW,
+                 seasons=DEFAULT_SEASONS, threshold=DEFAULT_THRESHOLD, warmup=DEFAULT_WARMUP,
+                 capacity=1024):
+        self.fields = tuple(fields)
+        self.columns = [NUMERIC_FIELDS.index(field) for field in self.fields]
+        self.interval = interval
+        self.alpha = 2.0 / (window + 1)        # Rolling baseline weight
+        self.fast_alpha = 2.0 / (5 + 1)        # Short EWMA of the level
+        # A slot gets this many observations a day (one run per ``interval``)
+        self.season_day = max(1, round(86400 / seasons / interval))
+        self.season_alpha = 2.0 / (SEASON_DAYS * self.season_day + 1)
+        self.seasons = seasons
+        self.threshold = threshold
+        self.warmup = warmup
+        self.last_run = None
+        self.last_duration = 0.0
+        self.last_scored = 0
+        self._lock = threading.Lock()
+        self._rows = {}   # pc_name -> row
+        self._names = []  # row -> pc_name (None when free)
+        self._free = []
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        shape = (capacity, len(self.fields))
+        seasonal = (capacity, self.seasons, len(self.fields))
+        old = getattr(self, '_pending_sum', None)
+        arrays = {
+            '_pending_sum': np.zeros(shape), '_pending_count': np.zeros(shape),
+            '_count': np.zeros(shape), '_mean': np.zeros(shape), '_var': np.zeros(shape),
+            '_ewma': np.zeros(shape), '_season_count': np.zeros(seasonal),
+            '_season_mean': np.zeros(seasonal), '_season_var': np.zeros(seasonal),
+            '_flagged': np.zeros(shape, dtype=bool), '_since': np.zeros(shape),
+        }
+        for name, array in arrays.items():
+            if old is not None:
+                current = getattr(self, name)
+                array[:len(current)] = current
+            setattr(self, name, array)
+        size = len(self._names)
+        self._names.extend([None] * (capacity - size))
+        self._free.extend(range(capacity - 1, size - 1, -1))  # Lowest rows handed out first
+
+    def _row(self, pc_name):
+        row = self._rows.get(pc_name)
+        if row is None:
+            if not self._free:
+                self._allocate(2 * len(self._names))
+            row = self._rows[pc_name] = self._free.pop()
+            self._names[row] = pc_name
+        return row
+
+    def __len__(self):
+        return len(self._rows)
+
+    def observe(self, entries):
+        """Add decoded ``(pc_name, epoch, values, static)`` entries to the running sums"""
+        if not entries:
+            return
+        columns = self.columns
+        values = np.array([[entry[2][i] for i in columns] for entry in entries])
+        present = ~np.isnan(values)
+        values[~present] = 0.0
+        with self._lock:
+            rows = [self._row(entry[0]) for entry in entries]
+            np.add.at(self._pending_sum, rows, values)
+            np.add.at(self._pending_count, rows, present)
+
+    def remove(self, pc_name):
+        """Forget a host; returns ``resolved`` events for its open flags"""
+        with self._lock:
+            row = self._rows.pop(pc_name, None)
+            if row is None:
+                return []
+            events = [self._event(pc_name, j, RESOLVED, np.nan, np.nan, np.nan, time.time())
+                      for j in np.flatnonzero(self._flagged[row])]
+            for name in ('_pending_sum', '_pending_count', '_count', '_mean', '_var', '_ewma',
+                         '_season_count', '_season_mean', '_season_var', '_flagged', '_since'):
+                getattr(self, name)[row] = 0
+            self._names[row] = None
+            self._free.append(row)
+        return events
+
+    def run(self, now=None):
+        """Score the observations gathered since the last run; return flag transitions"""
+        now = time.time() if now is None else now
+        started = time.perf_counter()
+        slot = time.localtime(now).tm_hour * self.seasons // 24
+        with self._lock:
+            counts = self._pending_count
+            seen = counts > 0
+            rows = np.flatnonzero(seen.any(axis=1))
+            events = []
+            if len(rows):
+                events = self._score(rows, seen[rows], slot, now)
+            self._pending_sum[rows] = 0
+            self._pending_count[rows] = 0
+        self.last_run = now
+        self.last_scored = len(rows)
+        self.last_duration = time.perf_counter() - started
+        return events
+
+    def _score(self, rows, seen, slot, now):
+        obs = self._pending_sum[rows] / np.maximum(self._pending_count[rows], 1)
+        mean = self._mean[rows]
+        var = self._var[rows]
+        count = self._count[rows]
+        season_mean = self._season_mean[rows, slot]
+        season_var = self._season_var[rows, slot]
+        season_count = self._season_count[rows, slot]
+
+        # Score against the baselines as they were before this observation;
+        # a young weighted variance is biased low, so it is scaled up by
+        # 1 / (1 - (1 - alpha)^n) as for any EWMA started from nothing
+        with np.errstate(invalid='ignore', divide='ignore'):
+            var_hat = var / -np.expm1(count * np.log1p(-self.alpha))
+            season_var_hat = season_var / -np.expm1(season_count * np.log1p(-self.season_alpha))
+        std = np.sqrt(np.fmax(var_hat, MIN_STD ** 2))
+        season_std = np.sqrt(np.fmax(season_var_hat, MIN_STD ** 2))
+        z = (obs - mean) / std
+        season_z = (obs - season_mean) / season_std
+        warm = (count >= self.warmup) & seen
+        season_warm = season_count >= self.season_day
+        outlier = warm & (np.abs(z) > self.threshold) & (
+            ~season_warm | (np.abs(season_z) > self.threshold))
+        # A field with no new sample keeps its current state
+        flagged = np.where(seen, outlier, self._flagged[rows])
+
+        # Update the baselines (first observation of a host seeds them) with
+        # the observation clipped to the threshold once the host is warm
+        first = count == 0
+        limit = np.where(warm, self.threshold * std, np.inf)
+        delta = np.clip(obs - mean, -limit, limit)
+        new_mean = np.where(first, obs, mean + self.alpha * delta)
+        new_var = np.where(first, 0.0, (1 - self.alpha) * (var + self.alpha * delta ** 2))
+        self._mean[rows] = np.where(seen, new_mean, mean)
+        self._var[rows] = np.where(seen, new_var, var)
+        ewma = self._ewma[rows]
+        self._ewma[rows] = np.where(seen, np.where(first, obs, ewma + self.fast_alpha * (obs - ewma)), ewma)
+        self._count[rows] = count + seen
+
+        season_first = season_count == 0
+        season_limit = np.where(season_warm, self.threshold * season_std, np.inf)
+        season_delta = np.clip(obs - season_mean, -season_limit, season_limit)
+        new_season_mean = np.where(season_first, obs, season_mean + self.season_alpha * season_delta)
+        new_season_var = np.where(season_first, 0.0,
+                                  (1 - self.season_alpha) * (season_var + self.season_alpha * season_delta ** 2))
+        self._season_mean[rows, slot] = np.where(seen, new_season_mean, season_mean)
+        self._season_var[rows, slot] = np.where(seen, new_season_var, season_var)
+        self._season_count[rows, slot] = season_count + seen
+
+        # Transitions only; steady flags stay quiet
+        changed = flagged != self._flagged[rows]
+        events = []
+        for i, j in zip(*np.nonzero(changed)):
+            row = rows[i]
+            if flagged[i, j]:
+                self._since[row, j] = now
+            events.append(self._event(self._names[row], j, FIRING if flagged[i, j] else RESOLVED,
+                                      obs[i, j], mean[i, j], z[i, j], now, self._since[row, j]))
+        self._flagged[rows] = flagged
+        return events
+
+    def _event(self, pc_name, j, state, value, mean, z, now, since=None):
+        field = self.fields[j]
+        return {
+            'pc_name': pc_name,
+            'rule': f'anomaly:{field}',
+            'state': state,
+            'severity': 'anomaly',
+            'expr': f'{field} |z| > {self.threshold:g}',
+            'value': None if np.isnan(value) else round(float(value), 4),
+            'mean': None if np.isnan(mean) else round(float(mean), 4),
+            'z': None if np.isnan(z) else round(float(z), 2),
+            'since': format_timestamp(since or now),
+            'timestamp': format_timestamp(now),
+        }
+
+    def flagged(self):
+        """Open flags, as ``firing`` events with the current baseline"""
+        with self._lock:
+            events = []
+            for row, j in zip(*np.nonzero(self._flagged)):
+                pc_name = self._names[row]
+                if pc_name is None:
+                    continue
+                var = self._var[row, j] / -np.expm1(self._count[row, j] * np.log1p(-self.alpha))
+                std = np.sqrt(max(var, MIN_STD ** 2))
+                z = (self._ewma[row, j] - self._mean[row, j]) / std
+                events.append(self._event(pc_name, j, FIRING, self._ewma[row, j], self._mean[row, j],
+                                          z, self.last_run or time.time(), self._since[row, j]))
+        return sorted(events, key=lambda event: event['since'])
+
+    def nbytes(self):
+        return sum(array.nbytes for array in (
+            self._pending_sum, self._pending_count, self._count, self._mean, self._var, self._ewma,
+            self._season_count, self._season_mean, self._season_var, self._flagged, self._since))
@@ -1,23 +1,217 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit
-import json
-from datetime import datetime, timedelta
+from flask_socketio import SocketIO, emit, join_room, leave_room
+import atexit
+import logging
+import os
+from datetime import datetime
 import threading
 import time
-from collections import defaultdict, deque
 import traceback
+from werkzeug.exceptions import BadRequest, HTTPException, UnsupportedMediaType
+
+import codec
+import export
+import snapshot
+import wire
+from alerts import AlertEngine, WebhookSink, load_rules
+from fleet import FleetAggregates, parse_quantiles
+from instrumentation import CONTENT_TYPE, PASS_BUCKETS, Registry
+from sharding import current_shard, shard_for
+try:
+    from anomaly import AnomalyDetector
+except ImportError:  # numpy is optional; anomaly detection is off without it
+    AnomalyDetector = None
+from labels import LabelIndex, format_selector, parse_labels, parse_selector, selector_matches
+from broadcaster import ALL_GROUP, Broadcaster, group_room, host_room
+from extended_store import ExtendedStore, split_extended
+from metrics_store import (NUMERIC_FIELDS, QUERYABLE_FIELDS, MetricsStore, build_row,
+                           decode_sample, format_timestamp, parse_timestamp, valid_pc_name)
+from registry import HostRegistry
+from rollups import RollupStore, downsample, pick_width, points
+from segment_store import SegmentStore
+from wire import UnknownHost, WireError, WireRegistry
+
+logger = logging.getLogger('sysmon.server')
+
+# Sharded mode (serve.py --shards N): this process owns only the PCs that
+# hash to SHARD_INDEX; the front dispatcher routes and merges (sharding.py)
+SHARD_INDEX, SHARD_COUNT = current_shard()
+
+def owns(pc_name):
+    return SHARD_COUNT == 1 or shard_for(pc_name, SHARD_COUNT) == SHARD_INDEX
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['DEBUG'] = True  # Enable debug mode
+app.config['DEBUG'] = os.environ.get('SYSMON_DEBUG', '1') == '1'  # serve.py turns this off
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
+# threading (default), eventlet or gevent; serve.py selects and monkey-patches
+socketio = SocketIO(app, cors_allowed_origins="*",
+                    async_mode=os.environ.get('SYSMON_ASYNC_MODE') or None)
+
+def run_blocking(func, *args):
+    """``func(*args)`` in a real OS thread under eventlet or gevent, else directly
+
+    Their background tasks are green threads sharing the event loop, so a
+    long blocking file call (snapshot writes, retention deletes) would
+    otherwise freeze ingest and Socket.IO until it returns.
+    """
+    if socketio.async_mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(func, *args)
+    if socketio.async_mode == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(func, args)
+    return func(*args)
+
+# In-memory storage for recent metrics
+metrics_store = MetricsStore(capacity=1000)  # Keep last 1000 data points per PC
+
+# Per-core/per-disk/per-NIC series and top processes (memory only)
+extended_store = ExtendedStore(capacity=int(os.environ.get('SYSMON_EXTENDED_CAPACITY', '360')))
+
+# Persistent history on disk (append-only hourly segments per PC)
+DATA_DIR = os.environ.get('SYSMON_DATA_DIR',
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+RETENTION_DAYS = float(os.environ.get('SYSMON_RETENTION_DAYS', '7'))
+# Open segment writers; 0 sizes the cache from the descriptor limit
+MAX_OPEN_FILES = int(os.environ.get('SYSMON_MAX_OPEN_FILES', '0'))
+segment_store = SegmentStore(DATA_DIR, retention_seconds=RETENTION_DAYS * 24 * 3600,
+                             max_open_files=MAX_OPEN_FILES or None,
+                             owns=owns if SHARD_COUNT > 1 else None)
+
+# Live fan-out: per-room coalescing, one frame per room per tick
+EMIT_INTERVAL = float(os.environ.get('SYSMON_EMIT_INTERVAL', '1.0'))
+broadcaster = Broadcaster(socketio, interval=EMIT_INTERVAL)
+
+# Binary image of the in-memory metrics, rewritten every SNAPSHOT_INTERVAL
+# seconds and at shutdown, so a restart does not re-read every segment
+SNAPSHOT_INTERVAL = float(os.environ.get('SYSMON_SNAPSHOT_INTERVAL', '60'))  # 0 disables
+SNAPSHOT_PATH = os.path.join(DATA_DIR, 'snapshot.bin' if SHARD_COUNT == 1
+                             else f'snapshot-{SHARD_INDEX}of{SHARD_COUNT}.bin')
+snapshot_lock = threading.Lock()  # Periodic and shutdown snapshots never overlap
+
+# Downsampled tiers (10 s, 1 min, 5 min, 1 h buckets) maintained on ingest
+rollup_store = RollupStore()
 
-# In-memory storage for metrics (in production, use a database)
-metrics_store = defaultdict(lambda: deque(maxlen=1000))  # Keep last 1000 data points per PC
-active_clients = set()
-last_seen = {}
+# Liveness: online, stale after STALE_AFTER s of silence, dropped (memory
+# included) after OFFLINE_AFTER s
+STALE_AFTER = float(os.environ.get('SYSMON_STALE_AFTER', '30'))
+OFFLINE_AFTER = float(os.environ.get('SYSMON_OFFLINE_AFTER', '300'))
+client_registry = HostRegistry(stale_after=STALE_AFTER, offline_after=OFFLINE_AFTER)
+CLEANUP_INTERVAL = 10  # Seconds between liveness/eviction passes
+
+# Agent labels (rack, role, ...) and the inverted index behind ?selector=
+label_index = LabelIndex()
+
+# Label selectors dashboards subscribed to (group name -> parsed selector);
+# the broadcaster asks which of them a PC matches when it publishes
+watched_selectors = {}
+watched_selectors_lock = threading.Lock()
+
+def selector_groups(pc_name):
+    """Broadcaster group resolver: the watched selectors pc_name matches"""
+    labels = label_index.labels(pc_name)
+    return [name for name, selector in list(watched_selectors.items())
+            if selector_matches(selector, labels)]
+
+broadcaster.group_resolver = selector_groups
+
+# Fleet-wide top-K and quantile sketches, updated on every ingest
+fleet = FleetAggregates()
+MAX_TOPK = 1000
+
+# Rolling per-host baselines scored for the whole fleet every interval
+ANOMALY_INTERVAL = float(os.environ.get('SYSMON_ANOMALY_INTERVAL', '5'))  # 0 disables
+anomaly_detector = (AnomalyDetector(interval=ANOMALY_INTERVAL)
+                    if AnomalyDetector is not None and ANOMALY_INTERVAL > 0 else None)
+
+# Alert rules evaluated on every ingested sample; transitions go to the
+# dashboards (Socket.IO room ALERTS_ROOM) and an optional webhook
+ALERT_RULES_PATH = os.environ.get('SYSMON_ALERT_RULES',
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alert_rules.json'))
+alert_rules, alert_webhook = load_rules(ALERT_RULES_PATH)
+alert_engine = AlertEngine(alert_rules)
+ALERT_WEBHOOK = os.environ.get('SYSMON_ALERT_WEBHOOK') or alert_webhook
+webhook_sink = WebhookSink(ALERT_WEBHOOK) if ALERT_WEBHOOK else None
+ALERTS_ROOM = 'alerts'
+
+# host_id/schema_id handed out by /api/agents/hello for binary ingest
+wire_registry = WireRegistry(offset=SHARD_INDEX, stride=SHARD_COUNT)
+
+MAX_BATCH_SAMPLES = 10000  # Upper bound for POST /api/metrics/batch
+
+# Self-instrumentation scraped at /internal/metrics; hot paths record into
+# these pre-created children, everything else is read at scrape time
+self_metrics = Registry({'shard': str(SHARD_INDEX)} if SHARD_COUNT > 1 else None)
+INGEST_HELP = 'Time spent in each phase of an ingest request'
+parse_seconds = self_metrics.histogram('sysmon_ingest_seconds', INGEST_HELP, phase='parse')
+store_seconds = self_metrics.histogram('sysmon_ingest_seconds', INGEST_HELP, phase='store')
+publish_seconds = self_metrics.histogram('sysmon_ingest_seconds', INGEST_HELP, phase='publish')
+ingested_samples = self_metrics.counter('sysmon_ingested_samples_total', 'Samples stored')
+duplicate_samples = self_metrics.counter('sysmon_duplicate_samples_total',
+                                         'Samples skipped because their PC already held that timestamp')
+cleanup_seconds = self_metrics.histogram('sysmon_cleanup_seconds', 'Runtime of a liveness/eviction pass',
+                                         PASS_BUCKETS)
+anomaly_seconds = self_metrics.histogram('sysmon_anomaly_pass_seconds', 'Runtime of an anomaly scoring pass',
+                                         PASS_BUCKETS)
+snapshot_seconds = self_metrics.histogram('sysmon_snapshot_seconds', 'Time taken to write a snapshot',
+                                          PASS_BUCKETS)
+broadcaster.flush_timer = self_metrics.histogram('sysmon_socketio_flush_seconds',
+                                                 'Runtime of a Socket.IO fan-out tick')
+self_metrics.callback('sysmon_socketio_frames_sent_total', 'metrics_frame emits',
+                      lambda: broadcaster.frames_sent, kind='counter')
+self_metrics.callback('sysmon_socketio_frames_dropped_total', 'Frames skipped for slow dashboards',
+                      lambda: broadcaster.frames_dropped, kind='counter')
+self_metrics.callback('sysmon_socketio_pending_updates', 'Host updates queued for the next fan-out tick',
+                      broadcaster.pending_updates)
+self_metrics.callback('sysmon_socketio_unacked_frames', 'Fan-out ticks not yet acknowledged, summed over dashboards',
+                      broadcaster.unacked_frames)
+self_metrics.callback('sysmon_dashboards_connected', 'Subscribed Socket.IO clients',
+                      broadcaster.watcher_count)
+self_metrics.callback('sysmon_clients', 'Reporting PCs by state',
+                      lambda: [({'state': state}, count)
+                               for state, count in client_registry.snapshot()['counts'].items()])
+self_metrics.callback('sysmon_host_samples', 'Samples held in memory per PC',
+                      lambda: [({'pc_name': pc_name}, len(series)) for pc_name, series in metrics_store.items()])
+self_metrics.callback('sysmon_store_bytes', 'Memory held by the in-memory stores',
+                      lambda: [({'store': 'metrics'}, metrics_store.nbytes()),
+                               ({'store': 'extended'}, extended_store.nbytes()),
+                               ({'store': 'anomaly'}, anomaly_detector.nbytes() if anomaly_detector else 0)])
+self_metrics.callback('sysmon_segment_writers_reopened_total',
+                      'Segment files closed to stay under max_open_files (reopened on the next write)',
+                      lambda: segment_store.reopened, kind='counter')
+
+def get_request_body():
+    """Raw request body with gzip/zstd Content-Encoding undone"""
+    return codec.decode_content(request.get_data(), request.headers.get('Content-Encoding'))
+
+def get_request_json():
+    """Parse the JSON request body, undoing gzip/zstd Content-Encoding"""
+    if not request.is_json and not request.headers.get('Content-Encoding'):
+        raise UnsupportedMediaType("Content-Type must be 'application/json'")
+    raw = get_request_body()
+    try:
+        return codec.loads(raw)
+    except ValueError as e:
+        raise BadRequest(f'Invalid JSON: {e}')
+
+def misrouted(pc_names):
+    """An error naming the first PC another shard owns, or None
+
+    Answered with 421 so the agent asks the front for its route again.
+    """
+    if SHARD_COUNT == 1:
+        return None
+    for pc_name in set(pc_names):
+        if not owns(pc_name):
+            shard = shard_for(pc_name, SHARD_COUNT)
+            return {'error': f'{pc_name} belongs to shard {shard} of {SHARD_COUNT}', 'shard': shard}
+    return None
+
+def json_response(payload, status=200):
+    """Like jsonify, but serialized with the fast codec"""
+    return Response(codec.dumps(payload), status=status, mimetype='application/json')
 
 @app.route('/test')
 def test():
@@ -39,174 +233,981 @@ def dashboard():
     try:
         return render_template('dashboard.html')
     except Exception as e:
-        print(f"Error rendering dashboard: {e}")
-        print(traceback.format_exc())
+        logger.exception("Error rendering dashboard: %s", e)
         return f"Error: {str(e)}", 500
 
+def store_entries(entries, samples=None, extended=None):
+    """Store decoded entries everywhere, mark their PCs live and publish them
+
+    ``samples`` are the original dicts (parallel to ``entries``) to publish;
+    without them the newest entry per PC is published in API row shape.
+    ``extended`` holds the parallel ``(scalars, detail)`` pairs of binary
+    uploads; for JSON they are taken from ``samples``.
+    """
+    started = time.perf_counter()
+    seqs, stored = metrics_store.extend_new(entries)
+    if len(stored) < len(entries):
+        # Samples this server already holds (a retried batch) are not stored twice
+        duplicate_samples.inc(len(entries) - len(stored))
+        entries = [entries[i] for i in stored]
+        if samples is not None:
+            samples = [samples[i] for i in stored]
+        if extended is not None:
+            extended = [extended[i] for i in stored]
+        if not entries:
+            return
+    segment_store.extend(entries)
+    rollup_store.extend((pc_name, timestamp, values)
+                        for pc_name, timestamp, values, _ in entries)
+    if extended is None and samples is not None:
+        extended = [split_extended(sample) for sample in samples]
+    if extended is not None:
+        extended_store.extend((entry[0], entry[1], scalars, detail)
+                              for entry, (scalars, detail) in zip(entries, extended)
+                              if scalars or detail)
+    fleet.update(entries)
+    if anomaly_detector is not None:
+        anomaly_detector.observe(entries)
+    publish_alerts(alert_engine.evaluate(entries, extended))
+
+    # Update active clients, keeping the newest sample per PC
+    latest = {}
+    for index, (pc_name, timestamp, _, _) in enumerate(entries):
+        current = latest.get(pc_name)
+        if current is None or timestamp >= current[0]:
+            latest[pc_name] = (timestamp, index)
+    client_registry.touch_many(latest)
+
+    # Labels ride along with JSON samples (validated in validate_sample)
+    if samples is not None:
+        for pc_name, (_, index) in latest.items():
+            labels = samples[index].get('labels')
+            if labels is not None:
+                label_index.set(pc_name, labels)
+    stored = time.perf_counter()
+    store_seconds.observe(stored - started)
+
+    # Only the newest sample per PC goes to the watching rooms
+    for pc_name, (timestamp, index) in latest.items():
+        if samples is not None:
+            sample = samples[index]
+        else:
+            _, _, values, static = entries[index]
+            sample = build_row(pc_name, timestamp, values, static)['data']
+            if extended is not None:
+                sample.update(extended[index][0])
+                sample.update(extended[index][1])
+        broadcaster.publish(pc_name, seqs[pc_name], sample)
+    publish_seconds.observe(time.perf_counter() - stored)
+    ingested_samples.inc(len(entries))
+
+def publish_alerts(events):
+    """Push alert transitions to dashboards and the webhook sink"""
+    if not events:
+        return
+    for event in events:
+        logger.info("Alert %s %s on %s (%s)", event['rule'], event['state'], event['pc_name'], event['value'])
+        socketio.emit('alert', event, to=ALERTS_ROOM)
+    if webhook_sink is not None:
+        webhook_sink.send(events)
+
+def publish_anomalies(events):
+    """Push anomaly flag transitions to dashboards"""
+    for event in events:
+        logger.info("Anomaly %s %s on %s (z=%s)", event['rule'], event['state'], event['pc_name'], event['z'])
+        socketio.emit('anomaly', event, to=ALERTS_ROOM)
+
+def run_anomaly_detection():
+    """Background task: score every host's new observations each interval"""
+    while True:
+        socketio.sleep(ANOMALY_INTERVAL)
+        try:
+            publish_anomalies(anomaly_detector.run())
+            anomaly_seconds.observe(anomaly_detector.last_duration)
+            if anomaly_detector.last_duration > ANOMALY_INTERVAL / 2:
+                logger.warning("Anomaly pass over %d hosts took %.0f ms", anomaly_detector.last_scored,
+                               anomaly_detector.last_duration * 1000)
+        except Exception as e:
+            logger.exception("Error in anomaly detection: %s", e)
+
+@app.route('/api/agents/hello', methods=['POST'])
+def agent_hello():
+    """Register an agent's static attributes and field order for binary ingest"""
+    try:
+        data = get_request_json()
+        if not isinstance(data, dict) or not valid_pc_name(data.get('pc_name')):
+            return jsonify({'error': 'Invalid data format'}), 400
+        error = misrouted([data['pc_name']])
+        if error is not None:
+            return jsonify(error), 421
+        try:
+            labels = parse_labels(data['labels']) if 'labels' in data else None
+            host_id, schema_id = wire_registry.register(
+                data['pc_name'], data, data.get('fields') or NUMERIC_FIELDS)
+        except ValueError as e:  # Includes WireError
+            return jsonify({'error': str(e)}), 400
+        if labels is not None:
+            label_index.set(data['pc_name'], labels)
+        return jsonify({
+            'host_id': host_id,
+            'schema_id': schema_id,
+            'fields': list(data.get('fields') or NUMERIC_FIELDS),
+            'formats': wire.formats(),
+        }), 200
+    except HTTPException as e:
+        return jsonify({'error': e.description}), e.code
+    except Exception as e:
+        logger.exception("Error registering agent: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+def receive_binary():
+    """Ingest a frame or MessagePack body (see wire.py)"""
+    started = time.perf_counter()
+    try:
+        entries, extended = wire_registry.decode(request.mimetype, get_request_body())
+    except UnknownHost as e:
+        return jsonify({'error': f'{e}; repeat /api/agents/hello'}), 409
+    except WireError as e:
+        return jsonify({'error': str(e)}), 400
+    if len(entries) > MAX_BATCH_SAMPLES:
+        return jsonify({'error': f'Batch too large (max {MAX_BATCH_SAMPLES} samples)'}), 413
+    parse_seconds.observe(time.perf_counter() - started)
+    store_entries(entries, extended=extended)
+    return jsonify({'status': 'success', 'accepted': len(entries)}), 200
+
 @app.route('/api/metrics', methods=['POST'])
 def receive_metrics():
-    """Receive metrics from client PCs"""
+    """Receive metrics from client PCs
+
+    JSON by default; a binary Content-Type from wire.py is decoded against
+    the agent's hello registration instead.
+    """
     try:
-        data = request.get_json()
-        
-        if not data or 'pc_name' not in data:
-            return jsonify({'error': 'Invalid data format'}), 400
-        
-        pc_name = data['pc_name']
-        timestamp = datetime.fromisoformat(data['timestamp'])
-        
-        # Store metrics
-        metrics_store[pc_name].append({
-            'timestamp': timestamp,
-            'data': data
-        })
+        if request.mimetype in wire.BINARY_MIMETYPES:
+            return receive_binary()
+        started = time.perf_counter()
+        data = get_request_json()
         
-        # Update active clients
-        active_clients.add(pc_name)
-        last_seen[pc_name] = datetime.now()
+        entry, error = validate_sample(data)
+        if error is not None:
+            return jsonify({'error': error}), 400
+        parse_seconds.observe(time.perf_counter() - started)
+        wrong_shard = misrouted([entry[0]])
+        if wrong_shard is not None:
+            return jsonify(wrong_shard), 421
         
-        # Emit to connected dashboard clients
-        socketio.emit('new_metrics', {
-            'pc_name': pc_name,
-            'metrics': data
-        })
+        # Store metrics, mark the PC active and queue it for watching rooms
+        store_entries([entry], [data])
         
         return jsonify({'status': 'success'}), 200
         
+    except HTTPException as e:
+        return jsonify({'error': e.description}), e.code
     except Exception as e:
-        print(f"Error receiving metrics: {e}")
-        print(traceback.format_exc())
+        logger.exception("Error receiving metrics: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+def validate_sample(sample):
+    """Validate and decode one JSON sample; return (entry, None) or (None, error)
+
+    Valid ``labels`` are normalized in place for store_entries.
+    """
+    if not isinstance(sample, dict) or 'pc_name' not in sample:
+        return None, 'Invalid data format'
+    if not valid_pc_name(sample['pc_name']):
+        return None, 'pc_name must be a non-empty string'
+    if 'labels' in sample:
+        try:
+            sample['labels'] = parse_labels(sample['labels'])
+        except ValueError as e:
+            return None, f'Invalid labels: {e}'
+    try:
+        return decode_sample(sample), None
+    except (KeyError, TypeError, ValueError) as e:
+        return None, f'Invalid timestamp: {e}'
+
+def validate_batch(samples):
+    """Validate and decode a list of samples; return (entries, errors)"""
+    entries = []
+    errors = []
+    for index, sample in enumerate(samples):
+        entry, error = validate_sample(sample)
+        if error is not None:
+            errors.append({'index': index, 'error': error})
+        else:
+            entries.append(entry)
+    return entries, errors
+
+@app.route('/api/metrics/batch', methods=['POST'])
+def receive_metrics_batch():
+    """Receive many samples (from one or more PCs) in a single request"""
+    try:
+        if request.mimetype in wire.BINARY_MIMETYPES:
+            return receive_binary()
+        started = time.perf_counter()
+        data = get_request_json()
+
+        # Accept either a bare list or {"samples": [...]}
+        samples = data.get('samples') if isinstance(data, dict) else data
+        if not isinstance(samples, list):
+            return jsonify({'error': 'Invalid data format'}), 400
+        if len(samples) > MAX_BATCH_SAMPLES:
+            return jsonify({'error': f'Batch too large (max {MAX_BATCH_SAMPLES} samples)'}), 413
+
+        # Validate everything before storing anything
+        entries, errors = validate_batch(samples)
+        if errors:
+            return jsonify({'error': 'Invalid samples in batch', 'details': errors}), 400
+        parse_seconds.observe(time.perf_counter() - started)
+        error = misrouted(entry[0] for entry in entries)
+        if error is not None:
+            return jsonify(error), 421
+
+        store_entries(entries, samples)
+
+        return jsonify({'status': 'success', 'accepted': len(entries)}), 200
+
+    except HTTPException as e:
+        return jsonify({'error': e.description}), e.code
+    except Exception as e:
+        logger.exception("Error receiving metrics batch: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/clients')
 def get_clients():
-    """Get list of active clients"""
-    try:
-        # Remove clients that haven't sent data in the last 30 seconds
-        current_time = datetime.now()
-        inactive_clients = [
-            pc for pc, last_time in last_seen.items()
-            if (current_time - last_time) > timedelta(seconds=30)
-        ]
-        
-        for pc in inactive_clients:
-            active_clients.discard(pc)
-            if pc in last_seen:
-                del last_seen[pc]
-        
-        result = {
-            'active_clients': list(active_clients),
-            'last_seen': {pc: time.isoformat() for pc, time in last_seen.items()}
-        }
+    """Get list of active (online or stale) clients with their status
+
+    ``?selector=rack=r1,role=db`` keeps only PCs whose labels match.
+    """
+    try:
+        try:
+            selector = parse_selector_arg()
+        except ValueError as e:
+            return jsonify({'error': str(e), 'active_clients': [], 'last_seen': {}}), 400
+        # Only hosts that crossed a threshold are touched; offline ones are
+        # left for the cleanup thread to evict
+        client_registry.advance()
+        result = client_registry.snapshot()
+        if selector is not None:
+            selected = label_index.select(selector, result['status'])
+            status = {pc: state for pc, state in result['status'].items() if pc in selected}
+            result = {
+                'active_clients': [pc for pc in result['active_clients'] if pc in selected],
+                'last_seen': {pc: seen for pc, seen in result['last_seen'].items() if pc in selected},
+                'status': status,
+                'counts': {state: list(status.values()).count(state) for state in result['counts']},
+            }
+        result = dict(result, labels={pc: label_index.labels(pc) for pc in result['active_clients']
+                                      if label_index.labels(pc)})
         
-        print(f"API /api/clients called - returning: {result}")
-        return jsonify(result)
+        logger.debug("API /api/clients called - returning %d clients", len(result['active_clients']))
+        return json_response(result)
         
     except Exception as e:
-        print(f"Error getting clients: {e}")
-        print(traceback.format_exc())
+        logger.exception("Error getting clients: %s", e)
         return jsonify({'error': str(e), 'active_clients': [], 'last_seen': {}}), 500
 
+@app.route('/api/alerts')
+def get_alerts():
+    """Get the loaded alert rules and the alerts currently firing"""
+    try:
+        return json_response({
+            'rules': [rule.describe() for rule in alert_engine.rules],
+            'firing': alert_engine.firing(),
+        })
+    except Exception as e:
+        logger.exception("Error getting alerts: %s", e)
+        return jsonify({'error': str(e), 'firing': []}), 500
+
+@app.route('/api/anomalies')
+def get_anomalies():
+    """Get the host/field pairs currently flagged as anomalous"""
+    try:
+        if anomaly_detector is None:
+            return json_response({'enabled': False, 'flagged': []})
+        return json_response({
+            'enabled': True,
+            'fields': list(anomaly_detector.fields),
+            'threshold': anomaly_detector.threshold,
+            'flagged': anomaly_detector.flagged(),
+            'last_run': format_timestamp(anomaly_detector.last_run) if anomaly_detector.last_run else None,
+            'last_duration_ms': round(anomaly_detector.last_duration * 1000, 2),
+            'hosts_scored': anomaly_detector.last_scored,
+        })
+    except Exception as e:
+        logger.exception("Error getting anomalies: %s", e)
+        return jsonify({'error': str(e), 'flagged': []}), 500
+
+@app.route('/api/fleet/summary')
+def get_fleet_summary():
+    """Aggregates of a numeric field across all live PCs
+
+    Query parameters (all optional):
+      fields     comma-separated numeric fields (default all)
+      quantiles  comma-separated, e.g. 0.5,0.99 (default 0.5,0.9,0.95,0.99)
+      window     seconds of recent samples to summarize as well (default 300, 0 for none)
+      selector   only PCs whose labels match, e.g. rack=r1 (``current`` only)
+
+    ``current`` is computed exactly from each PC's latest sample;
+    ``window`` comes from per-minute quantile sketches of the whole fleet
+    (see fleet.py).
+    """
+    try:
+        try:
+            fields = parse_numeric_fields(request.args.get('fields'))
+            quantiles = parse_quantiles(request.args.get('quantiles'))
+            selector = parse_selector_arg()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        window = request.args.get('window', 300, type=float)
+        window = min(max(window, 0), fleet.bucket_width * fleet.buckets)
+        hosts = label_index.select(selector, fleet) if selector is not None else None
+        result = fleet.summary(fields, quantiles, window, hosts=hosts)
+        if selector is not None:
+            result['selector'] = format_selector(selector)
+        return json_response(result)
+    except Exception as e:
+        logger.exception("Error getting fleet summary: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/fleet/topk')
+def get_fleet_topk():
+    """The k PCs with the highest latest value of a field
+
+    Query parameters:
+      field  numeric field to rank by, e.g. cpu_percent (required)
+      k         number of PCs (default 10, at most 1000)
+      order     desc (default, highest first) or asc
+      selector  only PCs whose labels match, e.g. rack=r1,role=db
+    """
+    try:
+        try:
+            selector = parse_selector_arg()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        field = request.args.get('field')
+        if field not in NUMERIC_FIELDS:
+            return jsonify({'error': f'field must be one of: {", ".join(NUMERIC_FIELDS)}'}), 400
+        k = request.args.get('k', 10, type=int)
+        if k < 1 or k > MAX_TOPK:
+            return jsonify({'error': f'k must be between 1 and {MAX_TOPK}'}), 400
+        order = request.args.get('order', 'desc')
+        if order not in ('asc', 'desc'):
+            return jsonify({'error': 'order must be asc or desc'}), 400
+        return json_response({
+            'field': field,
+            'order': order,
+            'hosts': fleet.topk(field, k, ascending=order == 'asc',
+                                hosts=label_index.select(selector, fleet) if selector is not None else None),
+        })
+    except Exception as e:
+        logger.exception("Error getting fleet top-k: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/internal/fleet/partial')
+def get_fleet_partial():
+    """This shard's share of /api/fleet/summary, merged by the front dispatcher
+
+    Takes the fields, window and selector parameters of /api/fleet/summary.
+    """
+    try:
+        try:
+            fields = parse_numeric_fields(request.args.get('fields'))
+            selector = parse_selector_arg()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        window = request.args.get('window', 300, type=float)
+        window = min(max(window, 0), fleet.bucket_width * fleet.buckets)
+        hosts = label_index.select(selector, fleet) if selector is not None else None
+        return json_response(fleet.partial(fields, window, hosts=hosts))
+    except Exception as e:
+        logger.exception("Error getting fleet partial summary: %s", e)
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/metrics/<pc_name>')
 def get_metrics(pc_name):
-    """Get metrics for a specific PC"""
+    """Get metrics for a specific PC
+
+    Query parameters (all optional):
+      start, end  ISO timestamps or epoch seconds, as [start, end)
+      fields      comma-separated columns to return, e.g. cpu_percent,memory_percent
+      limit       keep only the most recent N samples
+      since_seq   only samples newer than this cursor (see ``last_seq``); a
+                  cursor the PC has not reached yet (its series restarted)
+                  returns everything with ``reset`` and ``truncated`` set
+      max_points  return rollup buckets from the finest tier that fits;
+                  ``truncated`` is set when even the coarsest has more
+
+    Ranges inside the in-memory buffer are served by binary search over it;
+    older ranges are read from the on-disk history.
+    """
     try:
-        if pc_name not in metrics_store:
-            print(f"PC {pc_name} not found in metrics_store")
+        try:
+            start = parse_query_time(request.args.get('start'))
+            end = parse_query_time(request.args.get('end'))
+        except ValueError as e:
+            return jsonify({'error': f'Invalid time range: {e}', 'pc_name': pc_name, 'metrics': []}), 400
+        try:
+            fields = parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({'error': str(e), 'pc_name': pc_name, 'metrics': []}), 400
+        max_points = request.args.get('max_points', type=int)
+        limit = request.args.get('limit', type=int)
+        since_seq = request.args.get('since_seq', type=int)
+
+        result = {'pc_name': pc_name}
+
+        if max_points and max_points > 0:
+            metrics_list, result['resolution'], truncated = read_downsampled(
+                pc_name, start, end, max_points, fields)
+            if truncated:
+                result['truncated'] = True  # Only the newest max_points buckets
+        else:
+            # Served from memory when possible: binary search + projection of the requested columns
+            buffered = metrics_store.query(pc_name, start, end, since_seq, limit, fields)
+            if buffered is not None:
+                metrics_list = buffered.pop('metrics')
+                result.update(buffered)
+            elif start is None and end is None:
+                # Evicted from memory: read the newest samples from disk
+                metrics_list = read_history(pc_name, count=limit or metrics_store.capacity, fields=fields)
+            else:
+                # Older than the in-memory buffer: read the range from disk
+                metrics_list = read_history(pc_name, start, end, fields=fields)
+                if limit is not None:
+                    metrics_list = metrics_list[-limit:] if limit > 0 else []
+
+        if not metrics_list and pc_name not in metrics_store and not segment_store.has_host(pc_name):
+            logger.debug("PC %s not found in metrics_store", pc_name)
             return jsonify({'error': 'PC not found', 'pc_name': pc_name, 'metrics': []}), 404
+
+        result['metrics'] = metrics_list
         
-        # Convert deque to list for JSON serialization
-        metrics_list = list(metrics_store[pc_name])
-        
-        # Convert datetime objects to ISO strings (only if they're datetime objects)
-        for metric in metrics_list:
-            if hasattr(metric['timestamp'], 'isoformat'):
-                # It's a datetime object
-                metric['timestamp'] = metric['timestamp'].isoformat()
-            # If it's already a string, leave it as is
-        
-        result = {
-            'pc_name': pc_name,
-            'metrics': metrics_list
-        }
-        
-        print(f"API /api/metrics/{pc_name} called - returning {len(metrics_list)} metrics")
-        return jsonify(result)
+        logger.debug("API /api/metrics/%s called - returning %d metrics", pc_name, len(metrics_list))
+        return json_response(result)
         
     except Exception as e:
-        print(f"Error getting metrics for {pc_name}: {e}")
-        print(traceback.format_exc())
+        logger.exception("Error getting metrics for %s: %s", pc_name, e)
         return jsonify({'error': str(e), 'pc_name': pc_name, 'metrics': []}), 500
 
+@app.route('/api/metrics/<pc_name>/extended')
+def get_extended_metrics(pc_name):
+    """Get the extended series (per core, disk, NIC...) and top processes of a PC
+
+    Query parameters (all optional):
+      keys        comma-separated series, e.g. cpu_core.0,net.eth0.rx_mb_s
+      prefix      only series starting with this, e.g. net.
+      start, end  ISO timestamps or epoch seconds, as [start, end)
+      limit       keep only the most recent N samples
+
+    Served from memory only; see extended_store.py.
+    """
+    try:
+        try:
+            start = parse_query_time(request.args.get('start'))
+            end = parse_query_time(request.args.get('end'))
+        except ValueError as e:
+            return jsonify({'error': f'Invalid time range: {e}', 'pc_name': pc_name, 'metrics': []}), 400
+        keys = request.args.get('keys')
+        keys = frozenset(k.strip() for k in keys.split(',') if k.strip()) if keys else None
+        result = extended_store.query(pc_name, keys, request.args.get('prefix'), start, end,
+                                      request.args.get('limit', type=int))
+        if result is None:
+            return jsonify({'error': 'PC not found', 'pc_name': pc_name, 'metrics': []}), 404
+        result['pc_name'] = pc_name
+        return json_response(result)
+    except Exception as e:
+        logger.exception("Error getting extended metrics for %s: %s", pc_name, e)
+        return jsonify({'error': str(e), 'pc_name': pc_name, 'metrics': []}), 500
+
+def parse_fields(value):
+    """Parse ?fields=a,b into a frozenset, or None for all fields"""
+    if not value:
+        return None
+    fields = frozenset(f.strip() for f in value.split(',') if f.strip())
+    unknown = fields - QUERYABLE_FIELDS
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return fields
+
+def parse_selector_arg():
+    """Parsed ``?selector=`` label selector of this request, or None"""
+    text = request.args.get('selector')
+    return parse_selector(text) if text else None
+
+def parse_numeric_fields(value):
+    """Parse ?fields=a,b into NUMERIC_FIELDS order, or all of them"""
+    fields = parse_fields(value)
+    if fields is None:
+        return NUMERIC_FIELDS
+    if fields - set(NUMERIC_FIELDS):
+        raise ValueError(f"Not numeric: {', '.join(sorted(fields - set(NUMERIC_FIELDS)))}")
+    return tuple(field for field in NUMERIC_FIELDS if field in fields)
+
+def parse_query_time(value):
+    """Parse an optional ISO timestamp or epoch-seconds query parameter"""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return parse_timestamp(value)
+
+def read_history(pc_name, start=None, end=None, count=None, fields=None):
+    """Read samples for pc_name from the segment store in API row shape"""
+    if count is not None:
+        records = segment_store.read_recent(pc_name, count)
+    else:
+        records = segment_store.read_range(pc_name, start, end)
+    static = segment_store.static(pc_name)
+    return [build_row(pc_name, ts, values, static, fields) for ts, values in records]
+
+def read_downsampled(pc_name, start, end, max_points, fields=None):
+    """Return (points, bucket width, truncated) for a range, at most max_points long
+
+    Raw samples are returned (width 0) when they already fit. Otherwise the
+    finest in-memory rollup tier that covers the range is used, and ranges
+    older than the in-memory tiers are rolled up from disk on the fly.
+    ``truncated`` is True when even the coarsest tier needed more than
+    ``max_points`` buckets, so only the newest ones are returned.
+    """
+    if start is None and end is None:
+        rows = metrics_store.rows(pc_name, fields, max_count=max_points)
+        if rows is not None:
+            return rows, 0, False
+
+    fields = fields or NUMERIC_FIELDS
+    found = rollup_store.query(pc_name, start, end, max_points, fields)
+    if found is not None:
+        return found
+
+    records = segment_store.read_range(pc_name, start, end)
+    if not records:
+        return [], None, False
+    width = pick_width(records[0][0], records[-1][0], max_points, rollup_store.tier_spec)
+    tier = downsample(records, width)
+    found, truncated = points(tier, pc_name, start, end, max_points, fields)
+    return found, tier.width, truncated
+
 @app.route('/api/metrics')
 def get_all_metrics():
-    """Get metrics for all PCs"""
+    """Get metrics for all PCs, streamed one PC at a time
+
+    The default body is the ``{pc_name: [rows]}`` object. With
+    ``?format=ndjson`` (or ``Accept: application/x-ndjson``) it is one
+    ``{"pc_name": ..., "metrics": [rows]}`` line per PC instead.
+    """
     try:
-        all_metrics = {}
-        
-        for pc_name, metrics_deque in metrics_store.items():
-            metrics_list = list(metrics_deque)
-            for metric in metrics_list:
-                if hasattr(metric['timestamp'], 'isoformat'):
-                    # It's a datetime object
-                    metric['timestamp'] = metric['timestamp'].isoformat()
-                # If it's already a string, leave it as is
-            all_metrics[pc_name] = metrics_list
-        
-        return jsonify(all_metrics)
+        ndjson = (request.args.get('format') == 'ndjson'
+                  or request.accept_mimetypes.best == codec.NDJSON_MIMETYPE)
+        hosts = metrics_store.hosts()
+        if ndjson:
+            lines = codec.ndjson_lines({'pc_name': pc_name, 'metrics': rows}
+                                       for pc_name, rows in iter_host_rows(hosts))
+            return Response(lines, mimetype=codec.NDJSON_MIMETYPE)
+        return Response(stream_metrics_object(hosts), mimetype='application/json')
     except Exception as e:
-        print(f"Error getting all metrics: {e}")
-        print(traceback.format_exc())
+        logger.exception("Error getting all metrics: %s", e)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/export')
+def export_history():
+    """Stream stored history as CSV, NDJSON or Parquet, one segment at a time
+
+    ``?format=csv|ndjson|parquet&hosts=a,b&selector=&start=&end=&fields=``;
+    see export.py for the formats.
+    """
+    try:
+        fmt = request.args.get('format', 'csv')
+        if fmt not in export.available_formats():
+            hint = ' (pyarrow is not installed)' if fmt == 'parquet' else ''
+            return jsonify({'error': f'Unsupported format: {fmt}{hint}',
+                            'formats': export.available_formats()}), 400
+        try:
+            fields = parse_numeric_fields(request.args.get('fields'))
+            start = parse_query_time(request.args.get('start'))
+            end = parse_query_time(request.args.get('end'))
+            selector = parse_selector_arg()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        on_disk = set(segment_store.hosts())  # Only this shard's PCs
+        if request.args.get('hosts'):
+            hosts = list(dict.fromkeys(pc for pc in request.args['hosts'].split(',') if pc in on_disk))
+        else:
+            hosts = sorted(on_disk)
+        if selector is not None:
+            selected = label_index.select(selector, on_disk)
+            hosts = [pc for pc in hosts if pc in selected]
+
+        chunks = export.host_chunks(segment_store, hosts, start, end)
+        return Response(export.encode(fmt, chunks, fields), mimetype=export.MIMETYPES[fmt],
+                        headers={'Content-Disposition': f'attachment; filename="sysmon-export.{fmt}"'})
+    except Exception as e:
+        logger.exception("Error exporting history: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+def iter_host_rows(hosts):
+    """Yield (pc_name, rows) for every PC in ``hosts`` still in memory"""
+    for pc_name in hosts:
+        rows = metrics_store.rows(pc_name)
+        if rows is not None:  # Skip PCs evicted while we were streaming
+            yield pc_name, rows
+
+def stream_metrics_object(hosts):
+    """Write ``{pc_name: [rows], ...}`` one PC per chunk"""
+    yield b'{'
+    separator = b''
+    for pc_name, rows in iter_host_rows(hosts):
+        yield separator + codec.dumps(pc_name) + b':' + codec.dumps(rows)
+        separator = b','
+    yield b'}'
+
+def subscription_rooms(data):
+    """Rooms named by a subscribe/unsubscribe payload {hosts: [...], groups: [...]}
+
+    A group other than 'all' is a label selector such as ``rack=r1,role=db``.
+    Returns (rooms, {group name: parsed selector}); raises ValueError for
+    a malformed selector.
+    """
+    data = data if isinstance(data, dict) else {}
+    rooms = [host_room(str(pc)) for pc in data.get('hosts') or []]
+    selectors = {}
+    for group in data.get('groups') or []:
+        if group == ALL_GROUP:
+            rooms.append(group_room(ALL_GROUP))
+            continue
+        selector = parse_selector(str(group))
+        name = format_selector(selector)
+        selectors[name] = selector
+        rooms.append(group_room(name))
+    return rooms, selectors
+
+def forget_unwatched_selectors():
+    """Drop selectors no dashboard is subscribed to any more"""
+    with watched_selectors_lock:
+        for name in [name for name in watched_selectors
+                     if not broadcaster.is_watched(group_room(name))]:
+            del watched_selectors[name]
+
+@socketio.on('subscribe')
+def on_subscribe(data):
+    """Dashboard asks for live frames of some hosts and/or label groups"""
+    try:
+        rooms, selectors = subscription_rooms(data)
+    except ValueError as e:
+        return {'error': str(e), 'rooms': []}
+    rooms = rooms or [group_room(ALL_GROUP)]
+    for room in rooms:
+        join_room(room)
+    join_room(ALERTS_ROOM)  # Every dashboard hears alert transitions
+    with watched_selectors_lock:
+        broadcaster.subscribe(request.sid, rooms)
+        watched_selectors.update(selectors)
+    return {'rooms': rooms}
+
+@socketio.on('unsubscribe')
+def on_unsubscribe(data):
+    try:
+        rooms, _ = subscription_rooms(data)
+    except ValueError:
+        return
+    for room in rooms:
+        leave_room(room)
+    broadcaster.unsubscribe(request.sid, rooms)
+    forget_unwatched_selectors()
+
+@socketio.on('frame_ack')
+def on_frame_ack(data=None):
+    broadcaster.ack(request.sid, data.get('tick') if isinstance(data, dict) else None)
+
+@socketio.on('disconnect')
+def on_disconnect():
+    broadcaster.disconnect(request.sid)
+    forget_unwatched_selectors()
+
+@socketio.on('ingest')
+def on_ingest(data):
+    """Agent upstream: a batch pushed over a long-lived Socket.IO connection
+
+    ``{'samples': [...]}`` as in POST /api/metrics/batch, or
+    ``{'mimetype': <wire.py type>, 'body': bytes}`` after a hello. The ack
+    carries the HTTP status the same batch would have received.
+    """
+    try:
+        started = time.perf_counter()
+        data = data if isinstance(data, dict) else {'samples': data}
+        if data.get('mimetype') in wire.BINARY_MIMETYPES:
+            samples = None
+            entries, extended = wire_registry.decode(data['mimetype'], bytes(data.get('body') or b''))
+        else:
+            samples, extended = data.get('samples'), None
+            if not isinstance(samples, list):
+                return {'status': 400, 'error': 'Invalid data format'}
+            if len(samples) > MAX_BATCH_SAMPLES:
+                return {'status': 413, 'error': f'Batch too large (max {MAX_BATCH_SAMPLES} samples)'}
+            entries, errors = validate_batch(samples)
+            if errors:
+                return {'status': 400, 'error': 'Invalid samples in batch', 'details': errors}
+            error = misrouted(entry[0] for entry in entries)
+            if error is not None:
+                return dict(error, status=421)
+        if len(entries) > MAX_BATCH_SAMPLES:
+            return {'status': 413, 'error': f'Batch too large (max {MAX_BATCH_SAMPLES} samples)'}
+        parse_seconds.observe(time.perf_counter() - started)
+        store_entries(entries, samples, extended)
+        return {'status': 200, 'accepted': len(entries)}
+    except UnknownHost as e:
+        return {'status': 409, 'error': f'{e}; repeat /api/agents/hello'}
+    except WireError as e:
+        return {'status': 400, 'error': str(e)}
+    except Exception as e:
+        logger.exception("Error receiving metrics over Socket.IO: %s", e)
+        return {'status': 500, 'error': str(e)}
+
 @app.errorhandler(500)
 def internal_error(error):
-    print(f"Internal Server Error: {error}")
-    print(traceback.format_exc())
+    logger.exception("Internal Server Error: %s", error)
     return jsonify({'error': 'Internal Server Error', 'details': str(error)}), 500
 
 @app.errorhandler(404)
 def not_found_error(error):
     return jsonify({'error': 'Not Found'}), 404
 
+@app.route('/internal/metrics')
+def get_internal_metrics():
+    """The server's own metrics in the Prometheus text format"""
+    try:
+        return Response(self_metrics.render(), content_type=CONTENT_TYPE)
+    except Exception as e:
+        logger.exception("Error rendering internal metrics: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+# Requests per endpoint and status class, created for every route up front
+REQUESTS_HELP = 'HTTP requests handled, by endpoint and status class'
+request_counters = {
+    endpoint: [self_metrics.counter('sysmon_http_requests_total', REQUESTS_HELP,
+                                    endpoint=endpoint or 'unmatched', code=f'{status}xx')
+               for status in range(2, 6)]
+    for endpoint in list(app.view_functions) + [None]
+}
+
+@app.after_request
+def count_request(response):
+    counters = request_counters.get(request.endpoint)
+    if counters is not None and 200 <= response.status_code < 600:
+        counters[response.status_code // 100 - 2].inc()
+    return response
+
+def load_history():
+    """Refill the in-memory buffers from disk so a restart is not blank"""
+    for pc_name in segment_store.hosts():
+        records = segment_store.read_recent(pc_name, metrics_store.capacity)
+        if not records:
+            continue
+        static = segment_store.static(pc_name)
+        metrics_store.extend([(pc_name, ts, values, static) for ts, values in records])
+        rollup_store.extend((pc_name, ts, values) for ts, values in records)
+    logger.info("Loaded history for %d PCs from %s", len(metrics_store), DATA_DIR)
+
+def snapshot_hosts():
+    """``(info, columns)`` of every PC in memory, copied one PC at a time"""
+    for pc_name in metrics_store.hosts():
+        exported = metrics_store.export(pc_name)
+        if exported is None:
+            continue  # Evicted meanwhile
+        seq, unordered_seq, static, columns = exported
+        info = {'pc_name': pc_name, 'seq': seq, 'unordered_seq': unordered_seq, 'static': static}
+        labels = label_index.labels(pc_name)
+        if labels:
+            info['labels'] = labels
+        last_seen = client_registry.last_seen(pc_name)
+        if last_seen is not None:
+            info['last_seen'] = last_seen
+        yield info, columns
+
+def take_snapshot(offload=run_blocking):
+    """Write SNAPSHOT_PATH; ingest only waits for the copy of one PC at a time
+
+    The file writes and fsync go through ``offload`` (run_blocking: a real
+    OS thread under eventlet or gevent), so the event loop keeps serving.
+    """
+    with snapshot_lock:
+        started = time.perf_counter()
+        count = snapshot.write(SNAPSHOT_PATH, snapshot_hosts(), offload=offload)
+        snapshot_seconds.observe(time.perf_counter() - started)
+    return count
+
+def take_final_snapshot():
+    """At exit: snapshot and mark it clean, so the next start skips the replay"""
+    try:
+        count = take_snapshot(offload=None)  # Exiting: the event loop may be gone
+        snapshot.mark_clean(SNAPSHOT_PATH)
+        logger.info("Snapshot of %d PCs written to %s", count, SNAPSHOT_PATH)
+    except Exception as e:
+        logger.exception("Error writing the final snapshot: %s", e)
+
+def run_snapshots():
+    """Background task: snapshot every SNAPSHOT_INTERVAL seconds"""
+    while True:
+        time.sleep(SNAPSHOT_INTERVAL)
+        try:
+            take_snapshot()
+        except Exception as e:
+            logger.exception("Error writing snapshot: %s", e)
+
+def restore_snapshot():
+    """Refill memory from the last snapshot; False when there is none to use
+
+    Unless the snapshot was written at shutdown, samples stored after it
+    was taken are replayed from the segment files.
+    """
+    started = time.perf_counter()
+    clean = snapshot.take_clean_mark(SNAPSHOT_PATH)
+    try:
+        loaded = snapshot.load(SNAPSHOT_PATH)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("Ignoring snapshot %s: %s", SNAPSHOT_PATH, e)
+        return False
+    if loaded is None:
+        return False
+    meta, hosts = loaded
+    newest = {}
+    last_seen = {}
+    latest = []
+    for info, columns in hosts:
+        pc_name = info['pc_name']
+        size = len(columns[0])
+        if not size or not owns(pc_name):
+            continue
+        static = info.get('static') or {}
+        newest[pc_name] = columns[0][size - 1]
+        latest.append((pc_name, columns[0][size - 1], [column[size - 1] for column in columns[1:]], static))
+        metrics_store.restore(pc_name, info['seq'], columns, static, info.get('unordered_seq', 0))
+        if info.get('labels'):
+            label_index.set(pc_name, info['labels'])
+        if 'last_seen' in info:
+            last_seen[pc_name] = info['last_seen']
+    fleet.update(latest)
+    client_registry.restore(last_seen)
+    replayed = 0 if clean else replay_segments(meta['taken_at'], newest)
+    logger.info("Restored %d PCs from %s in %.0f ms (%s)", len(newest), SNAPSHOT_PATH,
+                (time.perf_counter() - started) * 1000,
+                'clean shutdown' if clean else f'{replayed} newer samples replayed from disk')
+    return True
+
+def replay_segments(taken_at, newest):
+    """Store samples that reached disk after a snapshot; returns how many
+
+    ``newest`` maps each snapshotted PC to its newest timestamp there; other
+    PCs on disk contribute what they stored since ``taken_at``.
+    """
+    entries = []
+    for pc_name in segment_store.hosts():
+        after = newest.get(pc_name)
+        if after is None:
+            records = segment_store.read_range(pc_name, start=taken_at)
+        else:
+            records = [record for record in segment_store.read_range(pc_name, start=after)
+                       if record[0] > after]
+        if records:
+            static = segment_store.static(pc_name)
+            entries.extend((pc_name, ts, values, static) for ts, values in records)
+    if entries:
+        metrics_store.extend(entries)
+        rollup_store.extend((pc_name, ts, values) for pc_name, ts, values, _ in entries)
+        fleet.update(entries)
+        seen = {}
+        for pc_name, ts, _, _ in entries:
+            seen[pc_name] = max(ts, seen.get(pc_name, ts))
+        client_registry.restore(seen)
+    return len(entries)
+
 def cleanup_inactive_clients():
-    """Periodically cleanup inactive clients"""
+    """Periodically cleanup inactive clients and expired history segments"""
+    last_retention = 0
     while True:
         try:
-            current_time = datetime.now()
-            inactive_clients = [
-                pc for pc, last_time in last_seen.items()
-                if (current_time - last_time) > timedelta(minutes=5)
-            ]
+            started = time.perf_counter()
+            # Whole-segment retention on disk, once per segment period
+            if time.time() - last_retention >= segment_store.segment_seconds:
+                removed = segment_store.enforce_retention(offload=run_blocking)
+                if removed:
+                    logger.info("Removed %d expired history segments", removed)
+                last_retention = time.time()
+
+            client_registry.advance()
             
-            for pc in inactive_clients:
-                active_clients.discard(pc)
-                if pc in last_seen:
-                    del last_seen[pc]
-                if pc in metrics_store:
-                    del metrics_store[pc]
+            for pc in client_registry.pop_offline():
+                if pc in client_registry:
+                    continue  # Reported again since it went offline
+                # Drop the in-memory copy only; history stays on disk
+                metrics_store.remove(pc)
+                rollup_store.remove(pc)
+                extended_store.remove(pc)
+                fleet.remove(pc)
+                label_index.remove(pc)
+                wire_registry.remove(pc)  # Binary agents re-hello, re-sending their labels
+                if anomaly_detector is not None:
+                    publish_anomalies(anomaly_detector.remove(pc))
+                publish_alerts(alert_engine.remove(pc))
+                logger.info("PC %s went offline; evicted from memory", pc)
+            cleanup_seconds.observe(time.perf_counter() - started)
             
-            time.sleep(60)  # Check every minute
+            time.sleep(CLEANUP_INTERVAL)
         except Exception as e:
-            print(f"Error in cleanup: {e}")
-            time.sleep(60)
+            logger.exception("Error in cleanup: %s", e)
+            time.sleep(CLEANUP_INTERVAL)
+
+def start_background_tasks():
+    """Reload history and start the cleanup thread and Socket.IO fan-out"""
+    if SHARD_COUNT > 1:
+        logger.info("Shard %d of %d", SHARD_INDEX, SHARD_COUNT)
+    if SNAPSHOT_INTERVAL <= 0 or not restore_snapshot():
+        load_history()
+    if SNAPSHOT_INTERVAL > 0:
+        threading.Thread(target=run_snapshots, daemon=True).start()
+        atexit.register(take_final_snapshot)
 
-if __name__ == '__main__':
     # Start cleanup thread
     cleanup_thread = threading.Thread(target=cleanup_inactive_clients, daemon=True)
     cleanup_thread.start()
+
+    # Start the throttled Socket.IO fan-out
+    socketio.start_background_task(broadcaster.run)
+
+    if webhook_sink is not None:
+        webhook_sink.start()
+    if anomaly_detector is not None:
+        socketio.start_background_task(run_anomaly_detection)
+    logger.info("Loaded %d alert rules from %s", len(alert_engine.rules), ALERT_RULES_PATH)
+
+if __name__ == '__main__':
+    # Development server (Werkzeug, debug on); use serve.py in production
+    logging.basicConfig(level=logging.DEBUG if app.config['DEBUG'] else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    start_background_tasks()
     
     print("🚀 System Monitor Server Starting...")
     print("📊 Dashboard available at: http://localhost:5000")
     print("🌐 API endpoints:")
     print("   - POST /api/metrics (receive client data)")
-    print("   - GET  /api/clients (list active clients)")
-    print("   - GET  /api/metrics/<pc_name> (get PC metrics)")
+    print("   - POST /api/metrics/batch (receive many samples at once)")
+    print("   - POST /api/agents/hello (register for binary ingest)")
+    print("   - GET  /api/clients[?selector=rack=r1] (list active clients)")
+    print("   - GET  /api/alerts (alert rules and firing alerts)")
+    print("   - GET  /api/anomalies (hosts flagged by the anomaly detector)")
+    print("   - GET  /api/fleet/summary[?fields=&quantiles=&window=] (fleet-wide percentiles)")
+    print("   - GET  /api/fleet/topk?field=&k=[&order=asc] (top hosts by a field)")
+    print("   - GET  /api/metrics/<pc_name>[?start=&end=&fields=&limit=&since_seq=&max_points=] (get PC metrics)")
+    print("   - GET  /api/metrics/<pc_name>/extended[?keys=&prefix=&start=&end=&limit=] (per core/disk/NIC, top processes)")
     print("   - GET  /api/metrics (get all metrics)")
+    print("   - GET  /api/export?format=csv|ndjson|parquet[&hosts=&selector=&start=&end=&fields=] (bulk history)")
+    print("   - GET  /internal/metrics (the server's own metrics, Prometheus format)")
     print("\n⏳ Waiting for client connections...\n")
     
     try:
-        socketio.run(app, host='0.0.0.0', port=5000, debug=True)
+        socketio.run(app, host='0.0.0.0', port=5000, debug=app.config['DEBUG'])
     except Exception as e:
         print(f"Error starting server: {e}")
         print(traceback.format_exc()) 
\ No newline at end of file
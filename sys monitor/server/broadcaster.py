@@ -0,0 +1,171 @@
+"""
+Room-based, throttled Socket.IO fan-out for live metrics.
+
+Dashboards subscribe to hosts (room ``host:<pc_name>``) or groups (room
+``group:<name>``; ``group:all`` holds every host). Ingest only records the
+newest sample per host in each room that has watchers. A background task
+then emits one ``metrics_frame`` per room per tick, so broadcast cost
+follows what is actually being watched rather than the ingest rate.
+
+Clients acknowledge frames with ``frame_ack``, echoing the frame's
+``tick``. In-flight work is counted per client per tick, however many of
+its rooms got a frame in that tick. A client with too many unacknowledged
+ticks is skipped for the whole tick, and its frames are dropped rather
+than queued. Frames carry the latest state with per-host ``seq``
+numbers, so a skipped client catches up from the next frame or through
+the ``since_seq`` cursor API.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger('sysmon.broadcaster')
+
+ALL_GROUP = 'all'
+
+
+def host_room(pc_name):
+    return f'host:{pc_name}'
+
+
+def group_room(group):
+    return f'group:{group}'
+
+
+class Broadcaster:
+    """Coalesces per-room updates and emits them on a fixed tick"""
+
+    def __init__(self, socketio, interval=1.0, max_in_flight=2):
+        self.socketio = socketio
+        self.interval = interval
+        self.max_in_flight = max_in_flight
+        self.group_resolver = None  # Optional callable: pc_name -> group names
+        self.flush_timer = None     # Optional Histogram of flush durations
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self._lock = threading.Lock()
+        self._pending = {}       # room -> {pc_name: (seq, sample)}
+        self._watchers = {}      # room -> set of sids
+        self._client_rooms = {}  # sid -> set of rooms
+        self._in_flight = {}     # sid -> ticks with frames not yet acknowledged
+        self._frame_id = 0
+        self._tick = 0
+
+    def rooms_for(self, pc_name):
+        rooms = [host_room(pc_name), group_room(ALL_GROUP)]
+        if self.group_resolver is not None:
+            rooms.extend(group_room(group) for group in self.group_resolver(pc_name))
+        return rooms
+
+    def subscribe(self, sid, rooms):
+        with self._lock:
+            joined = self._client_rooms.setdefault(sid, set())
+            self._in_flight.setdefault(sid, set())
+            for room in rooms:
+                self._watchers.setdefault(room, set()).add(sid)
+                joined.add(room)
+
+    def unsubscribe(self, sid, rooms):
+        with self._lock:
+            joined = self._client_rooms.get(sid, set())
+            for room in rooms:
+                watchers = self._watchers.get(room)
+                if watchers is not None:
+                    watchers.discard(sid)
+                    if not watchers:
+                        del self._watchers[room]
+                        self._pending.pop(room, None)
+                joined.discard(room)
+
+    def disconnect(self, sid):
+        rooms = self._client_rooms.get(sid, set())
+        self.unsubscribe(sid, list(rooms))
+        with self._lock:
+            self._client_rooms.pop(sid, None)
+            self._in_flight.pop(sid, None)
+
+    def ack(self, sid, tick=None):
+        """``sid`` received the frames of ``tick`` (the oldest one if not given)"""
+        with self._lock:
+            ticks = self._in_flight.get(sid)
+            if not ticks:
+                return
+            if tick is None:
+                ticks.discard(min(ticks))
+            else:
+                ticks.discard(tick)  # Later frames of the same tick are no-ops
+
+    def is_watched(self, room):
+        with self._lock:
+            return bool(self._watchers.get(room))
+
+    def watcher_count(self):
+        with self._lock:
+            return len(self._client_rooms)
+
+    def pending_updates(self):
+        """Host updates waiting for the next flush, counted per room"""
+        with self._lock:
+            return sum(len(latest) for latest in self._pending.values())
+
+    def unacked_frames(self):
+        with self._lock:
+            return sum(len(ticks) for ticks in self._in_flight.values())
+
+    def publish(self, pc_name, seq, sample):
+        """Record the newest sample of ``pc_name`` for every watched room"""
+        rooms = self.rooms_for(pc_name)
+        with self._lock:
+            for room in rooms:
+                if room in self._watchers:
+                    self._pending.setdefault(room, {})[pc_name] = (seq, sample)
+
+    def flush(self):
+        """Emit one frame per room with pending updates"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._tick += 1
+            tick = self._tick
+            # Decided once per tick, so a client in many rooms is not counted per room
+            slow = {sid for sid, ticks in self._in_flight.items() if len(ticks) >= self.max_in_flight}
+            reached = set()
+            frames = []
+            for room, latest in pending.items():
+                watchers = self._watchers.get(room)
+                if not watchers:
+                    continue
+                skipped = watchers & slow
+                self.frames_dropped += len(skipped)
+                if len(skipped) == len(watchers):
+                    continue
+                reached.update(watchers - skipped)
+                self._frame_id += 1
+                frames.append((room, self._frame_id, latest, list(skipped)))
+            for sid in reached:
+                self._in_flight.setdefault(sid, set()).add(tick)
+
+        # Emit outside the lock so slow sockets never block ingest
+        for room, frame_id, latest, skipped in frames:
+            self.socketio.emit('metrics_frame', {
+                'room': room,
+                'frame': frame_id,
+                'tick': tick,
+                'metrics': [
+                    {'pc_name': pc_name, 'seq': seq, 'metrics': sample}
+                    for pc_name, (seq, sample) in latest.items()
+                ]
+            }, to=room, skip_sid=skipped or None)
+            self.frames_sent += 1
+
+    def run(self):
+        """Background task: flush every ``interval`` seconds"""
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                started = time.perf_counter()
+                self.flush()
+                if self.flush_timer is not None:
+                    self.flush_timer.observe(time.perf_counter() - started)
+            except Exception as e:
+                logger.exception("Error broadcasting metrics: %s", e)
@@ -0,0 +1,88 @@
+"""
+JSON codec for the ingest and query paths.
+
+Uses orjson when it is installed (it parses and serializes several times
+faster than the standard library and produces bytes directly) and falls
+back to ``json`` otherwise. Both sides produce compact UTF-8 bytes, so
+callers never care which one is active.
+
+Large responses are written as NDJSON (one JSON document per line) from a
+generator, so the whole document never has to exist in memory at once.
+
+Request bodies may arrive gzip or zstd compressed; ``decode_content``
+undoes that with a cap on the decompressed size.
+"""
+
+import json
+import zlib
+
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge, UnsupportedMediaType
+
+try:
+    import orjson
+except ImportError:  # Optional speed-up; pip install orjson
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # zstd request bodies are optional
+    zstandard = None
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+MAX_DECOMPRESSED_BYTES = 64 * 1024 * 1024  # Guard against compression bombs
+
+if orjson is not None:
+    CODEC = 'orjson'
+    DecodeError = orjson.JSONDecodeError
+
+    def loads(data):
+        """Parse JSON from bytes or str"""
+        return orjson.loads(data)
+
+    def dumps(obj):
+        """Serialize to compact JSON bytes"""
+        return orjson.dumps(obj)
+else:
+    CODEC = 'json'
+    DecodeError = json.JSONDecodeError
+    _encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
+    def loads(data):
+        """Parse JSON from bytes or str"""
+        return json.loads(data)
+
+    def dumps(obj):
+        """Serialize to compact JSON bytes"""
+        return _encoder.encode(obj).encode('utf-8')
+
+
+def ndjson_lines(documents):
+    """Yield each document as one line of NDJSON"""
+    for document in documents:
+        yield dumps(document) + b'\n'
+
+
+def decode_content(body, encoding, limit=MAX_DECOMPRESSED_BYTES):
+    """Undo a gzip/zstd Content-Encoding; raise an HTTPException for bad bodies"""
+    encoding = (encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        return body
+    if encoding == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            raw = decompressor.decompress(body, limit)
+        except (zlib.error, EOFError) as e:
+            # A 4xx, so agents drop the body instead of retrying it forever
+            raise BadRequest(f'Invalid gzip body: {e}')
+        if decompressor.unconsumed_tail:
+            raise RequestEntityTooLarge('Decompressed body too large')
+        if not decompressor.eof:
+            raise BadRequest('Invalid gzip body: truncated')
+    elif encoding == 'zstd' and zstandard is not None:
+        try:
+            raw = zstandard.ZstdDecompressor().decompress(body, max_output_size=limit)
+        except zstandard.ZstdError as e:
+            raise RequestEntityTooLarge(str(e))
+    else:
+        raise UnsupportedMediaType(f'Unsupported Content-Encoding: {encoding}')
+    return raw
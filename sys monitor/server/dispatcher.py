@@ -0,0 +1,473 @@
+"""
+Front dispatcher of the sharded server (``serve.py --shards N``).
+
+N shard processes each run the full app for the PCs that hash to them
+(sharding.py), so ingest, alerting and fan-out use N cores instead of one.
+The front sits on the public port and:
+
+- tells agents and dashboards where to go: ``/api/route?pc_name=`` names
+  the shard URL an agent uploads to directly, ``/api/shards`` lists the
+  shards a dashboard opens a Socket.IO connection to;
+- proxies ingest from agents that post to the front anyway, routed by the
+  ``X-Sysmon-Host`` header, the ``host_id`` of a binary body, or by
+  splitting a JSON batch per shard;
+- sends per-PC reads to the owning shard and answers fleet-wide reads
+  (``/api/clients``, ``/api/metrics``, alerts, anomalies, fleet views) by
+  asking every shard in parallel and merging the answers.
+
+The front keeps no state of its own. When a shard does not answer, merged
+reads list it under ``missing_shards`` and return what the others had.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
+
+import requests
+from flask import Flask, Response, jsonify, render_template, request
+from flask_cors import CORS
+from werkzeug.exceptions import BadRequest, HTTPException
+
+import codec
+import export
+import wire
+from fleet import DEFAULT_BUCKET_WIDTH, DEFAULT_BUCKETS, DEFAULT_ALPHA, merge_partials, parse_quantiles
+from instrumentation import CONTENT_TYPE, Registry, merge_text
+from labels import format_selector, parse_selector
+from metrics_store import valid_pc_name
+from sharding import SHARD_HEADER, shard_for, shard_for_host_id
+
+logger = logging.getLogger('sysmon.dispatcher')
+
+MAX_BATCH_SAMPLES = 10000  # Same bound as a single server's /api/metrics/batch
+FORWARDED_HEADERS = ('Content-Type', 'Content-Encoding', SHARD_HEADER)
+CHUNK_SIZE = 64 * 1024
+
+
+class ShardClient:
+    """Pooled HTTP connections from the front to every shard"""
+
+    def __init__(self, urls, timeout=10):
+        self.urls = list(urls)
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=len(self.urls), pool_maxsize=64)
+        self.session.mount('http://', adapter)
+        self._pool = ThreadPoolExecutor(max_workers=4 * len(self.urls), thread_name_prefix='scatter')
+
+    def __len__(self):
+        return len(self.urls)
+
+    def owner(self, pc_name):
+        return shard_for(pc_name, len(self.urls))
+
+    def request(self, shard, method, path, **kwargs):
+        return self.session.request(method, self.urls[shard] + path, timeout=self.timeout, **kwargs)
+
+    def _get_json(self, shard, path, params):
+        try:
+            reply = self.request(shard, 'GET', path, params=params)
+            return reply.status_code, codec.loads(reply.content)
+        except (requests.RequestException, ValueError) as e:
+            logger.warning("Shard %d did not answer %s: %s", shard, path, e)
+            return None, None
+
+    def scatter(self, path, params=None):
+        """GET ``path`` from every shard at once; ``[(status, payload)]`` in shard order
+
+        ``status`` is None for a shard that could not be reached.
+        """
+        futures = [self._pool.submit(self._get_json, shard, path, params)
+                   for shard in range(len(self.urls))]
+        return [future.result() for future in futures]
+
+    def get_all(self, path):
+        """GET ``path`` from every shard at once; a requests.Response or None per shard"""
+        def get(shard):
+            try:
+                return self.request(shard, 'GET', path)
+            except requests.RequestException as e:
+                logger.warning("Shard %d did not answer %s: %s", shard, path, e)
+                return None
+        return list(self._pool.map(get, range(len(self.urls))))
+
+    def post_all(self, path, bodies, headers):
+        """POST ``{shard: body}`` concurrently; ``{shard: requests.Response or None}``"""
+        def post(shard):
+            try:
+                return self.request(shard, 'POST', path, data=bodies[shard], headers=headers)
+            except requests.RequestException as e:
+                logger.warning("Shard %d did not take %s: %s", shard, path, e)
+                return None
+        futures = {shard: self._pool.submit(post, shard) for shard in bodies}
+        return {shard: future.result() for shard, future in futures.items()}
+
+
+def create_app(shard_urls, public_ports, advertise_host=None):
+    """The front Flask app for shards at ``shard_urls`` (reached from outside on ``public_ports``)"""
+    app = Flask(__name__)
+    CORS(app)
+    shards = ShardClient(shard_urls)
+
+    def json_response(payload, status=200):
+        return Response(codec.dumps(payload), status=status, mimetype='application/json')
+
+    def relay(reply):
+        """Hand a shard's reply back unchanged"""
+        return Response(reply.content, status=reply.status_code,
+                        content_type=reply.headers.get('Content-Type', 'application/json'))
+
+    def relay_stream(reply):
+        def chunks():
+            try:
+                yield from reply.iter_content(CHUNK_SIZE)
+            finally:
+                reply.close()
+        return Response(chunks(), status=reply.status_code,
+                        content_type=reply.headers.get('Content-Type', 'application/json'))
+
+    def public_url(shard):
+        """URL of a shard as seen by whoever sent this request"""
+        host = advertise_host or urlsplit(request.host_url).hostname
+        if ':' in host:
+            host = f'[{host}]'  # IPv6 literal
+        return f'{request.scheme}://{host}:{public_ports[shard]}'
+
+    def gather(path, merge, params=None):
+        """Scatter a GET and merge the 200 answers; a shard's 4xx is returned as is"""
+        replies = shards.scatter(path, request.query_string if params is None else params)
+        for status, payload in replies:
+            if status is not None and 400 <= status < 500:
+                return json_response(payload, status)
+        answers = [payload for status, payload in replies if status == 200]
+        if not answers:
+            return jsonify({'error': 'No shard answered'}), 502
+        result = merge(answers)
+        missing = [shard for shard, (status, _) in enumerate(replies) if status != 200]
+        if missing:
+            result['missing_shards'] = missing
+        return json_response(result)
+
+    @app.route('/')
+    def dashboard():
+        return render_template('dashboard.html')
+
+    @app.route('/api/shards')
+    def get_shards():
+        """The shards, for dashboards that subscribe to each one's Socket.IO stream"""
+        return jsonify({'shards': [{'shard': shard, 'url': public_url(shard)}
+                                   for shard in range(len(shards))]})
+
+    @app.route('/api/route')
+    def get_route():
+        """The shard an agent should upload ``?pc_name=`` to"""
+        pc_name = request.args.get('pc_name')
+        if not valid_pc_name(pc_name):
+            return jsonify({'error': 'pc_name must be a non-empty string'}), 400
+        shard = shards.owner(pc_name)
+        return jsonify({'pc_name': pc_name, 'shard': shard, 'shards': len(shards),
+                        'url': public_url(shard)})
+
+    @app.route('/api/agents/hello', methods=['POST'])
+    def agent_hello():
+        try:
+            body = request.get_data()
+            pc_name = request.headers.get(SHARD_HEADER)
+            if not pc_name:
+                data = codec.loads(codec.decode_content(body, request.headers.get('Content-Encoding')))
+                pc_name = data.get('pc_name') if isinstance(data, dict) else None
+            if not valid_pc_name(pc_name):
+                return jsonify({'error': 'Invalid data format'}), 400
+            return relay(shards.request(shards.owner(pc_name), 'POST', request.path, data=body,
+                                        headers=forwarded_headers()))
+        except HTTPException as e:
+            return jsonify({'error': e.description}), e.code
+        except ValueError as e:
+            return jsonify({'error': f'Invalid JSON: {e}'}), 400
+        except requests.RequestException as e:
+            return jsonify({'error': f'Shard unavailable: {e}'}), 503
+
+    def forwarded_headers():
+        return {name: request.headers[name] for name in FORWARDED_HEADERS if name in request.headers}
+
+    @app.route('/api/metrics', methods=['POST'])
+    @app.route('/api/metrics/batch', methods=['POST'])
+    def receive_metrics():
+        """Ingest posted to the front: pass it to the shard(s) owning its PCs"""
+        try:
+            body = request.get_data()
+            headers = forwarded_headers()
+            pc_name = request.headers.get(SHARD_HEADER)
+            if pc_name:
+                reply = shards.request(shards.owner(pc_name), 'POST', request.path, data=body, headers=headers)
+                if reply.status_code != 421:
+                    return relay(reply)
+                # The header did not name every PC of the body: split it below
+
+            raw = codec.decode_content(body, request.headers.get('Content-Encoding'))
+            if request.mimetype in wire.BINARY_MIMETYPES:
+                try:
+                    host_id = wire.peek_host_id(request.mimetype, raw)
+                except wire.WireError as e:
+                    return jsonify({'error': str(e)}), 400
+                return relay(shards.request(shard_for_host_id(host_id, len(shards)), 'POST',
+                                            request.path, data=body, headers=headers))
+            try:
+                data = codec.loads(raw)
+            except ValueError as e:
+                raise BadRequest(f'Invalid JSON: {e}')
+            if request.path == '/api/metrics':
+                if not isinstance(data, dict) or not valid_pc_name(data.get('pc_name')):
+                    return jsonify({'error': 'Invalid data format'}), 400
+                return relay(shards.request(shards.owner(data['pc_name']), 'POST', request.path,
+                                            data=body, headers=headers))
+            return split_batch(data, body, headers)
+        except HTTPException as e:
+            return jsonify({'error': e.description}), e.code
+        except requests.RequestException as e:
+            return jsonify({'error': f'Shard unavailable: {e}'}), 503
+
+    def split_batch(data, body, headers):
+        """Send each shard the samples of its PCs; one reply for the whole batch
+
+        The shards validate their part independently: when one rejects its
+        samples, the others may already have stored theirs. The agent then
+        retries the whole batch; the shards that stored their part skip
+        those samples (MetricsStore.extend_new), so nothing is stored twice.
+        """
+        samples = data.get('samples') if isinstance(data, dict) else data
+        if not isinstance(samples, list):
+            return jsonify({'error': 'Invalid data format'}), 400
+        if len(samples) > MAX_BATCH_SAMPLES:
+            return jsonify({'error': f'Batch too large (max {MAX_BATCH_SAMPLES} samples)'}), 413
+        groups = {}  # shard -> indexes into samples
+        errors = []
+        for index, sample in enumerate(samples):
+            if not isinstance(sample, dict) or not valid_pc_name(sample.get('pc_name')):
+                errors.append({'index': index, 'error': 'Invalid data format'})
+            else:
+                groups.setdefault(shards.owner(sample['pc_name']), []).append(index)
+        if errors:
+            return jsonify({'error': 'Invalid samples in batch', 'details': errors}), 400
+        if len(groups) <= 1:
+            shard = next(iter(groups), 0)
+            return relay(shards.request(shard, 'POST', request.path, data=body, headers=headers))
+
+        bodies = {shard: codec.dumps({'samples': [samples[i] for i in indexes]})
+                  for shard, indexes in groups.items()}
+        replies = shards.post_all(request.path, bodies, {'Content-Type': 'application/json'})
+        accepted = 0
+        failures = []
+        for shard, reply in replies.items():
+            if reply is None:
+                failures.append((503, {'error': f'Shard {shard} unavailable'}))
+                continue
+            payload = codec.loads(reply.content)
+            if reply.status_code == 200:
+                accepted += payload.get('accepted', 0)
+                continue
+            for detail in payload.get('details', []):
+                detail['index'] = groups[shard][detail['index']]  # Back to the caller's numbering
+            failures.append((reply.status_code, payload))
+        if failures:
+            # A 5xx makes the agent retry the batch; it wins over a 4xx
+            status, payload = max(failures, key=lambda failure: failure[0] >= 500)
+            return json_response(dict(payload, accepted=accepted), status)
+        return jsonify({'status': 'success', 'accepted': accepted}), 200
+
+    @app.route('/api/metrics/<pc_name>')
+    @app.route('/api/metrics/<pc_name>/extended')
+    def get_host_metrics(pc_name):
+        """Per-PC reads go to the shard that owns the PC"""
+        path = f'/api/metrics/{quote(pc_name, safe="")}'
+        if request.path.endswith('/extended'):
+            path += '/extended'
+        try:
+            reply = shards.request(shards.owner(pc_name), 'GET', path,
+                                   params=request.query_string, stream=True)
+        except requests.RequestException as e:
+            return jsonify({'error': f'Shard unavailable: {e}'}), 503
+        return relay_stream(reply)
+
+    @app.route('/api/metrics')
+    def get_all_metrics():
+        """Every shard's PCs, streamed one shard and one PC at a time"""
+        ndjson = (request.args.get('format') == 'ndjson'
+                  or request.accept_mimetypes.best == codec.NDJSON_MIMETYPE)
+
+        def shard_lines():
+            for shard in range(len(shards)):
+                try:
+                    reply = shards.request(shard, 'GET', '/api/metrics',
+                                           params={'format': 'ndjson'}, stream=True)
+                except requests.RequestException as e:
+                    logger.warning("Shard %d did not answer /api/metrics: %s", shard, e)
+                    continue
+                with reply:
+                    if reply.status_code != 200:
+                        continue
+                    for line in reply.iter_lines(CHUNK_SIZE):
+                        if line:
+                            yield line
+
+        if ndjson:
+            return Response((line + b'\n' for line in shard_lines()), mimetype=codec.NDJSON_MIMETYPE)
+
+        def object_chunks():
+            yield b'{'
+            separator = b''
+            for line in shard_lines():
+                document = codec.loads(line)
+                yield separator + codec.dumps(document['pc_name']) + b':' + codec.dumps(document['metrics'])
+                separator = b','
+            yield b'}'
+        return Response(object_chunks(), mimetype='application/json')
+
+    @app.route('/api/export')
+    def export_history():
+        """Every shard's export, one shard after the other
+
+        CSV and NDJSON are passed through (the header line of CSV only
+        once); Parquet is rewritten from the shards' NDJSON into one file.
+        """
+        fmt = request.args.get('format', 'csv')
+        if fmt not in export.available_formats():
+            hint = ' (pyarrow is not installed)' if fmt == 'parquet' else ''
+            return jsonify({'error': f'Unsupported format: {fmt}{hint}',
+                            'formats': export.available_formats()}), 400
+        params = dict(request.args.items(), format='ndjson' if fmt == 'parquet' else fmt)
+        fields = export.selected_fields(request.args.get('fields'))
+        # Open every shard's stream first, so a shard error is still a proper status
+        replies = []
+
+        def close_all():
+            for reply in replies:
+                reply.close()
+        try:
+            for shard in range(len(shards)):
+                reply = shards.request(shard, 'GET', '/api/export', params=params, stream=True)
+                replies.append(reply)
+                if reply.status_code != 200:
+                    answer = relay(reply)  # Read before closing
+                    close_all()
+                    return answer
+        except requests.RequestException as e:
+            close_all()
+            return jsonify({'error': f'Shard unavailable: {e}'}), 503
+
+        def shard_chunks():
+            for shard, reply in enumerate(replies):
+                skip_header = fmt == 'csv' and shard > 0
+                for chunk in reply.iter_content(CHUNK_SIZE):
+                    if skip_header:
+                        newline = chunk.find(b'\n')
+                        if newline < 0:
+                            continue
+                        chunk, skip_header = chunk[newline + 1:], False
+                    if chunk:
+                        yield chunk
+
+        def body():
+            try:
+                if fmt == 'parquet':
+                    lines = (line for reply in replies for line in reply.iter_lines(CHUNK_SIZE))
+                    yield from export.encode(fmt, export.ndjson_chunks(lines), fields)
+                else:
+                    yield from shard_chunks()
+            finally:
+                close_all()
+        return Response(body(), mimetype=export.MIMETYPES[fmt],
+                        headers={'Content-Disposition': f'attachment; filename="sysmon-export.{fmt}"'})
+
+    @app.route('/api/clients')
+    def get_clients():
+        def merge(answers):
+            result = {'active_clients': [], 'last_seen': {}, 'status': {}, 'counts': {}, 'labels': {}}
+            for answer in answers:
+                result['active_clients'].extend(answer['active_clients'])
+                for key in ('last_seen', 'status', 'labels'):
+                    result[key].update(answer.get(key, {}))
+                for state, count in answer.get('counts', {}).items():
+                    result['counts'][state] = result['counts'].get(state, 0) + count
+            return result
+        return gather('/api/clients', merge)
+
+    @app.route('/api/alerts')
+    def get_alerts():
+        def merge(answers):
+            firing = [event for answer in answers for event in answer['firing']]
+            return {'rules': answers[0]['rules'], 'firing': sorted(firing, key=lambda event: event['since'])}
+        return gather('/api/alerts', merge)
+
+    @app.route('/api/anomalies')
+    def get_anomalies():
+        def merge(answers):
+            if not answers[0].get('enabled'):
+                return answers[0]
+            flagged = [event for answer in answers for event in answer['flagged']]
+            runs = [answer['last_run'] for answer in answers if answer.get('last_run')]
+            return dict(answers[0],
+                        flagged=sorted(flagged, key=lambda event: event['since']),
+                        last_run=max(runs) if runs else None,
+                        last_duration_ms=max(answer['last_duration_ms'] for answer in answers),
+                        hosts_scored=sum(answer['hosts_scored'] for answer in answers))
+        return gather('/api/anomalies', merge)
+
+    @app.route('/api/fleet/topk')
+    def get_fleet_topk():
+        """Each shard's top k, merged: the fleet's top k is among them"""
+        k = request.args.get('k', 10, type=int)
+
+        def merge(answers):
+            descending = answers[0]['order'] == 'desc'
+            hosts = [host for answer in answers for host in answer['hosts']]
+            hosts.sort(key=lambda host: (host['value'], host['pc_name']), reverse=descending)
+            return dict(answers[0], hosts=hosts[:k])
+        return gather('/api/fleet/topk', merge)
+
+    @app.route('/api/fleet/summary')
+    def get_fleet_summary():
+        """Exact ``current`` stats from every shard's sorted values, window sketches merged"""
+        try:
+            quantiles = parse_quantiles(request.args.get('quantiles'))
+            selector = request.args.get('selector')
+            selector = parse_selector(selector) if selector else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        window = request.args.get('window', 300, type=float)
+        window = min(max(window, 0), DEFAULT_BUCKET_WIDTH * DEFAULT_BUCKETS)
+
+        def merge(answers):
+            fields = list(answers[0]['current'])
+            result = merge_partials(answers, fields, quantiles, window, DEFAULT_ALPHA)
+            if selector is not None:
+                result['selector'] = format_selector(selector)
+            return result
+        return gather('/internal/fleet/partial', merge)
+
+    @app.route('/internal/metrics')
+    def get_internal_metrics():
+        """Every shard's own metrics in one scrape, told apart by their ``shard`` label"""
+        replies = shards.get_all('/internal/metrics')
+        up = Registry()
+        for shard, reply in enumerate(replies):
+            answered = reply is not None and reply.status_code == 200
+            up.callback('sysmon_shard_up', 'Whether the shard answered this scrape',
+                        lambda answered=answered: int(answered), shard=str(shard))
+        texts = [reply.text for reply in replies if reply is not None and reply.status_code == 200]
+        return Response(merge_text([up.render()] + texts), content_type=CONTENT_TYPE)
+
+    @app.route('/<path:path>')
+    def passthrough(path):
+        """Anything else (test pages, static files) is served by shard 0"""
+        try:
+            reply = shards.request(0, 'GET', '/' + path, params=request.query_string, stream=True)
+        except requests.RequestException as e:
+            return jsonify({'error': f'Shard unavailable: {e}'}), 503
+        return relay_stream(reply)
+
+    @app.errorhandler(404)
+    def not_found_error(error):
+        return jsonify({'error': 'Not Found'}), 404
+
+    return app
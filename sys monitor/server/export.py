@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Streaming bulk export of stored history (``GET /api/export`` and a CLI).
+
+Rows are read from the segment files one segment (one PC-hour) at a time
+and encoded as they are read, so memory stays flat however many PCs and
+days are exported. One row per sample, ``pc_name, timestamp, <fields>``:
+
+- ``csv``: a header line, then one line per sample; missing values are
+  empty. Timestamps are ISO 8601 like the rest of the API.
+- ``ndjson``: one flat JSON object per line; missing values are null.
+- ``parquet`` (when pyarrow is installed): row groups of ROW_GROUP_SIZE
+  rows; timestamps are UTC ``timestamp[us]`` and missing values null.
+
+All three load directly in pandas (``read_csv``, ``read_json(lines=True)``,
+``read_parquet``) and DuckDB (``read_csv_auto``, ``read_json_auto``,
+``read_parquet``).
+
+As a CLI it downloads from a running server, or reads a data directory
+directly when the server is down:
+
+    python server/export.py --format parquet -o fleet.parquet --start 2024-05-01
+    python server/export.py --server http://monitor:5000 --selector role=db -o db.csv
+    python server/export.py --data-dir server/data --hosts PC-1,PC-2 -o two.ndjson
+"""
+
+import argparse
+import csv
+import io
+import math
+import os
+import sys
+import time
+
+import codec
+from metrics_store import INTEGER_FIELDS, NUMERIC_FIELDS, _to_json, format_timestamp, parse_timestamp
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet export is optional; pip install pyarrow
+    pyarrow = None
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': codec.NDJSON_MIMETYPE,
+    'parquet': 'application/vnd.apache.parquet',
+}
+ROW_GROUP_SIZE = 100000  # Parquet rows buffered before a row group is written
+CHUNK_ROWS = 1000        # Rows per chunk when re-reading an NDJSON export
+
+
+def available_formats():
+    return [fmt for fmt in MIMETYPES if fmt != 'parquet' or pyarrow is not None]
+
+
+def selected_fields(value):
+    """``?fields=a,b`` in NUMERIC_FIELDS order (unvalidated), or all of them"""
+    wanted = {field.strip() for field in (value or '').split(',') if field.strip()}
+    return tuple(field for field in NUMERIC_FIELDS if field in wanted) if wanted else NUMERIC_FIELDS
+
+
+def host_chunks(segment_store, hosts, start=None, end=None):
+    """``(pc_name, records)`` for ``hosts``, one segment of records at a time"""
+    for pc_name in hosts:
+        for records in segment_store.iter_range(pc_name, start, end):
+            yield pc_name, records
+
+
+def ndjson_chunks(lines):
+    """``(pc_name, records)`` back from the lines of an NDJSON export"""
+    pc_name, records = None, []
+    for line in lines:
+        if not line:
+            continue
+        row = codec.loads(line)
+        if row['pc_name'] != pc_name or len(records) >= CHUNK_ROWS:
+            if records:
+                yield pc_name, records
+            pc_name, records = row['pc_name'], []
+        values = [math.nan if row.get(field) is None else float(row[field]) for field in NUMERIC_FIELDS]
+        records.append((parse_timestamp(row['timestamp']), values))
+    if records:
+        yield pc_name, records
+
+
+def encode(fmt, chunks, fields=NUMERIC_FIELDS):
+    """The export of ``chunks`` in ``fmt``, as an iterator of byte strings"""
+    columns = [NUMERIC_FIELDS.index(field) for field in fields]
+    if fmt == 'csv':
+        return _csv(chunks, fields, columns)
+    if fmt == 'ndjson':
+        return _ndjson(chunks, fields, columns)
+    if fmt == 'parquet' and pyarrow is not None:
+        return _parquet(chunks, fields, columns)
+    raise ValueError(f'Unsupported export format: {fmt}')
+
+
+def _csv(chunks, fields, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(['pc_name', 'timestamp', *fields])
+    for pc_name, records in chunks:
+        writer.writerows([pc_name, format_timestamp(ts), *(_to_json(field, values[i])
+                                                           for field, i in zip(fields, columns))]
+                         for ts, values in records)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')  # Header of an empty export
+
+
+def _ndjson(chunks, fields, columns):
+    for pc_name, records in chunks:
+        lines = []
+        for ts, values in records:
+            row = {'pc_name': pc_name, 'timestamp': format_timestamp(ts)}
+            for field, i in zip(fields, columns):
+                row[field] = _to_json(field, values[i])
+            lines.append(codec.dumps(row))
+        lines.append(b'')
+        yield b'\n'.join(lines)
+
+
+class _Sink:
+    """Write-only file pyarrow writes into; ``drain`` hands over what it got"""
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def _parquet(chunks, fields, columns):
+    schema = pyarrow.schema(
+        [('pc_name', pyarrow.string()), ('timestamp', pyarrow.timestamp('us', tz='UTC'))]
+        + [(field, pyarrow.int64() if field in INTEGER_FIELDS else pyarrow.float64()) for field in fields])
+    sink = _Sink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd')
+
+    def flush(names, stamps, values):
+        arrays = [pyarrow.array(names, pyarrow.string()),
+                  pyarrow.array(stamps, pyarrow.timestamp('us', tz='UTC'))]
+        for field, column in zip(fields, values):
+            if field in INTEGER_FIELDS:
+                arrays.append(pyarrow.array([None if math.isnan(v) else int(v) for v in column], pyarrow.int64()))
+            else:
+                arrays.append(pyarrow.array(column, pyarrow.float64(), from_pandas=True))  # NaN -> null
+        writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+
+    names, stamps, values = [], [], [[] for _ in fields]
+    for pc_name, records in chunks:
+        for ts, row in records:
+            names.append(pc_name)
+            stamps.append(round(ts * 1e6))
+            for column, i in zip(values, columns):
+                column.append(row[i])
+        if len(names) >= ROW_GROUP_SIZE:
+            flush(names, stamps, values)
+            names, stamps, values = [], [], [[] for _ in fields]
+            yield sink.drain()
+    if names:
+        flush(names, stamps, values)
+    writer.close()
+    yield sink.drain()
+
+
+def download(args, output):
+    """Stream ``/api/export`` of a running server into ``output``"""
+    import requests
+    params = {name: getattr(args, name) for name in ('format', 'hosts', 'selector', 'start', 'end', 'fields')
+              if getattr(args, name)}
+    with requests.get(args.server.rstrip('/') + '/api/export', params=params, stream=True,
+                      timeout=60) as reply:
+        if reply.status_code != 200:
+            raise SystemExit(f"Export failed ({reply.status_code}): {reply.text}")
+        for chunk in reply.iter_content(1024 * 1024):
+            output.write(chunk)
+
+
+def read_local(args, output):
+    """Export straight from a data directory (no server needed)"""
+    from segment_store import SegmentStore
+    if args.selector:
+        raise SystemExit('--selector needs a running server (labels are kept in its memory)')
+    if args.format not in available_formats():
+        raise SystemExit(f'--format {args.format} needs pyarrow (pip install pyarrow)')
+    store = SegmentStore(args.data_dir)
+    on_disk = set(store.hosts())
+    hosts = [pc for pc in args.hosts.split(',') if pc in on_disk] if args.hosts else sorted(on_disk)
+    start = parse_timestamp(args.start) if args.start else None
+    end = parse_timestamp(args.end) if args.end else None
+    for chunk in encode(args.format, host_chunks(store, hosts, start, end), selected_fields(args.fields)):
+        output.write(chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export stored metrics history')
+    parser.add_argument('--server', default='http://localhost:5000',
+                        help='Server to export from (default: http://localhost:5000)')
+    parser.add_argument('--data-dir', default=None,
+                        help='Read this data directory directly instead of asking a server')
+    parser.add_argument('--format', choices=list(MIMETYPES), default='csv', help='Output format (default: csv)')
+    parser.add_argument('--hosts', default=None, help='Comma-separated PCs (default: all)')
+    parser.add_argument('--selector', default=None, help='Label selector, e.g. rack=r1,role=db')
+    parser.add_argument('--start', default=None, help='ISO timestamp or epoch seconds (default: oldest)')
+    parser.add_argument('--end', default=None, help='ISO timestamp or epoch seconds, exclusive (default: now)')
+    parser.add_argument('--fields', default=None, help='Comma-separated numeric fields (default: all)')
+    parser.add_argument('-o', '--output', default=None, help='Output file (default: stdout)')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        if args.data_dir:
+            read_local(args, output)
+        else:
+            download(args, output)
+    finally:
+        if args.output:
+            output.close()
+    if args.output:
+        print(f"Wrote {os.path.getsize(args.output) / 1e6:.1f} MB to {args.output} "
+              f"in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
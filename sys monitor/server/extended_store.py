@@ -0,0 +1,233 @@
+"""
+Extended per-host metrics from the agents' collectors.
+
+Besides the fixed NUMERIC_FIELDS, agents report per-core CPU, per-mount
+disk usage, per-disk I/O rates, per-NIC rates, load average and the top
+processes (see CollectorRegistry in client/monitor_client.py). How many
+cores, disks and NICs there are differs from host to host, so these are
+not columns of the main store. The nested structures are flattened into
+named scalar series instead::
+
+    cpu_core.<n>                                  per-core CPU %
+    load.1m, load.5m, load.15m
+    disk.<mount>.percent / .used_gb / .total_gb
+    disk_io.<disk>.read_iops / .write_iops / .read_mb_s / .write_mb_s
+    net.<nic>.rx_mb_s / .tx_mb_s
+    network_recv_mb_s, network_sent_mb_s, process_count
+
+Every host keeps a small ring buffer with one ``array('d')`` column per
+series it has reported. The top-process lists are not numeric; only the
+latest ones are kept, as the host's ``detail``.
+
+Extended metrics live in memory only (the last ``capacity`` samples per
+host). The on-disk history and the rollup tiers hold NUMERIC_FIELDS.
+"""
+
+import math
+from array import array
+
+from metrics_store import DEFAULT_STRIPES, NAN, StripedLock, format_timestamp
+
+DEFAULT_CAPACITY = 360  # 30 minutes at the default 5 s interval
+
+# Flat series that are reported as-is
+EXTENDED_SCALARS = ('network_recv_mb_s', 'network_sent_mb_s', 'process_count')
+
+# Prefixes of the flattened per-device series
+EXTENDED_PREFIXES = ('cpu_core.', 'load.', 'disk.', 'disk_io.', 'net.')
+
+# Non-numeric fields kept as the latest detail only
+DETAIL_FIELDS = ('top_cpu', 'top_memory')
+
+LOAD_WINDOWS = ('1m', '5m', '15m')
+DISK_METRICS = ('percent', 'used_gb', 'total_gb')
+
+MAX_KEY_LENGTH = 128
+MAX_KEYS = 256  # Series per host; later keys are ignored
+
+
+def is_extended_key(key):
+    """True for a flattened series name this module would produce"""
+    return (isinstance(key, str) and len(key) <= MAX_KEY_LENGTH
+            and (key in EXTENDED_SCALARS or key.startswith(EXTENDED_PREFIXES)))
+
+
+def _number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def flatten_extended(sample):
+    """Numeric extended metrics of a client sample as ``{series: float}``"""
+    scalars = {}
+
+    def put(key, value):
+        value = _number(value)
+        if value is not None and len(key) <= MAX_KEY_LENGTH:
+            scalars[key] = value
+
+    cores = sample.get('cpu_per_core')
+    if isinstance(cores, list):
+        for index, value in enumerate(cores):
+            put(f'cpu_core.{index}', value)
+    load = sample.get('load_avg')
+    if isinstance(load, list):
+        for window, value in zip(LOAD_WINDOWS, load):
+            put(f'load.{window}', value)
+    disks = sample.get('disks')
+    if isinstance(disks, list):
+        for disk in disks:
+            if isinstance(disk, dict) and isinstance(disk.get('mount'), str):
+                for metric in DISK_METRICS:
+                    put(f"disk.{disk['mount']}.{metric}", disk.get(metric))
+    for field, prefix in (('disk_io', 'disk_io'), ('net_rates', 'net')):
+        devices = sample.get(field)
+        if isinstance(devices, dict):
+            for device, rates in devices.items():
+                if isinstance(rates, dict):
+                    for metric, value in rates.items():
+                        put(f'{prefix}.{device}.{metric}', value)
+    for field in EXTENDED_SCALARS:
+        put(field, sample.get(field))
+    return scalars
+
+
+def sample_detail(detail):
+    """The top-process lists (DETAIL_FIELDS) of a sample or detail dict"""
+    return {field: detail[field] for field in DETAIL_FIELDS
+            if isinstance(detail.get(field), list)}
+
+
+def split_extended(sample):
+    """``(scalars, detail)`` of a client sample"""
+    return flatten_extended(sample), sample_detail(sample)
+
+
+class ExtendedSeries:
+    """Ring buffer of flattened extended metrics for a single PC"""
+
+    __slots__ = ('capacity', 'timestamps', 'columns', 'detail', 'detail_timestamp',
+                 '_head', '_size')
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.columns = {}  # series name -> array('d'), NaN where not reported
+        self.detail = {}
+        self.detail_timestamp = None
+        self._head = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, timestamp, scalars):
+        """Append one sample's ``{series: value}``; missing series read as NaN"""
+        slot = self._head
+        self.timestamps[slot] = timestamp
+        columns = self.columns
+        for key, column in columns.items():
+            column[slot] = scalars.get(key, NAN)
+        if not scalars.keys() <= columns.keys():
+            for key, value in scalars.items():
+                if key not in columns and len(columns) < MAX_KEYS:
+                    column = columns[key] = array('d', [NAN]) * self.capacity
+                    column[slot] = value
+        self._head = (slot + 1) % self.capacity
+        if self._size < self.capacity:
+            self._size += 1
+
+    def set_detail(self, timestamp, detail):
+        """Keep ``detail`` unless a newer one is already stored"""
+        if self.detail_timestamp is None or timestamp >= self.detail_timestamp:
+            self.detail = detail
+            self.detail_timestamp = timestamp
+
+    def rows(self, keys=None, start=None, end=None, limit=None):
+        """``{timestamp, data}`` rows oldest first, with reported series only"""
+        columns = [(key, column) for key, column in self.columns.items()
+                   if keys is None or key in keys]
+        timestamps = self.timestamps
+        first = (self._head - self._size) % self.capacity
+        slots = [(first + i) % self.capacity for i in range(self._size)]
+        slots = [slot for slot in slots
+                 if (start is None or timestamps[slot] >= start)
+                 and (end is None or timestamps[slot] < end)]
+        slots.sort(key=lambda slot: timestamps[slot])
+        if limit is not None:
+            slots = slots[len(slots) - limit:] if limit > 0 else []
+        rows = []
+        for slot in slots:
+            data = {key: column[slot] for key, column in columns if not math.isnan(column[slot])}
+            if data:
+                timestamp = format_timestamp(timestamps[slot])
+                rows.append({'timestamp': timestamp, 'data': data})
+        return rows
+
+    def nbytes(self):
+        return 8 * self.capacity * (1 + len(self.columns))
+
+
+class ExtendedStore:
+    """Mapping of PC name to its ExtendedSeries, safe to share between threads"""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, stripes=DEFAULT_STRIPES):
+        self.capacity = capacity
+        self._hosts = {}
+        self._lock = StripedLock(stripes)
+
+    def __contains__(self, pc_name):
+        return pc_name in self._hosts
+
+    def __len__(self):
+        return len(self._hosts)
+
+    def extend(self, entries):
+        """Store ``(pc_name, timestamp, scalars, detail)`` entries"""
+        by_host = {}
+        for entry in entries:
+            by_host.setdefault(entry[0], []).append(entry)
+        for pc_name, host_entries in by_host.items():
+            with self._lock(pc_name):
+                series = self._hosts.get(pc_name)
+                if series is None:
+                    series = self._hosts[pc_name] = ExtendedSeries(self.capacity)
+                for _, timestamp, scalars, detail in host_entries:
+                    if scalars:
+                        series.append(timestamp, scalars)
+                    if detail:
+                        series.set_detail(timestamp, detail)
+
+    def query(self, pc_name, keys=None, prefix=None, start=None, end=None, limit=None):
+        """Series names, rows and latest detail of ``pc_name``, or None
+
+        ``keys`` (a set of names) and ``prefix`` narrow the series returned.
+        """
+        with self._lock(pc_name):
+            series = self._hosts.get(pc_name)
+            if series is None:
+                return None
+            names = sorted(series.columns)
+            if prefix:
+                names = [name for name in names if name.startswith(prefix)]
+            if keys is not None:
+                names = [name for name in names if name in keys]
+            detail = series.detail
+            return {
+                'keys': names,
+                'metrics': series.rows(frozenset(names), start, end, limit),
+                'detail': dict(detail, timestamp=format_timestamp(series.detail_timestamp))
+                if detail else {},
+            }
+
+    def remove(self, pc_name):
+        with self._lock(pc_name):
+            self._hosts.pop(pc_name, None)
+
+    def hosts(self):
+        return list(self._hosts)
+
+    def nbytes(self):
+        return sum(series.nbytes() for series in list(self._hosts.values()))
@@ -0,0 +1,357 @@
+"""
+Fleet-wide aggregates kept up to date on every ingest.
+
+Two structures answer ``/api/fleet/topk`` and ``/api/fleet/summary``
+without touching the per-PC stores:
+
+- the latest value of every numeric field per PC, plus one sorted list of
+  ``(value, pc_name)`` per field. A new sample moves its PC within each
+  list (two binary searches), so the top or bottom K hosts and exact
+  percentiles across the fleet are slices of an already sorted list.
+- one DDSketch per field per time bucket (1 minute by default, the last
+  hour kept). Every sample is added to its bucket's sketches; a window
+  query merges the buckets it spans. Quantiles are within ``alpha``
+  (1%) relative error, whatever the number of samples.
+
+Only hosts that report while the server runs are counted; a PC is removed
+when the cleanup thread evicts it. Queries may be narrowed to a set of PCs
+(a label selector, see labels.py): top-K and ``current`` then use just
+those PCs' latest values, while the sketches stay fleet-wide.
+
+A sharded server answers a summary from every shard's ``partial()`` (the
+sorted latest values and the merged window sketches, both mergeable
+without loss) combined by ``merge_partials``.
+"""
+
+import heapq
+import math
+import threading
+import time
+from bisect import bisect_left, insort
+
+from metrics_store import NUMERIC_FIELDS, format_timestamp
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.95, 0.99)
+DEFAULT_ALPHA = 0.01        # Relative accuracy of the sketches
+DEFAULT_BUCKET_WIDTH = 60   # Seconds per sketch bucket
+DEFAULT_BUCKETS = 60        # Buckets kept: one hour
+
+# Values this close to zero are counted apart (log is undefined at 0)
+MIN_INDEXABLE = 1e-9
+
+
+class DDSketch:
+    """Streaming quantile sketch with relative error ``alpha``
+
+    A positive value v lands in bucket ceil(log_gamma(v)) with
+    gamma = (1 + alpha) / (1 - alpha); negative values are mirrored into a
+    second store. The number of buckets grows with the log of the value
+    range, not with the number of values.
+    """
+
+    __slots__ = ('gamma', 'log_gamma', 'positive', 'negative', 'zero', 'count', 'min', 'max')
+
+    def __init__(self, alpha=DEFAULT_ALPHA):
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        if value > MIN_INDEXABLE:
+            key = math.ceil(math.log(value) / self.log_gamma)
+            self.positive[key] = self.positive.get(key, 0) + 1
+        elif value < -MIN_INDEXABLE:
+            key = math.ceil(math.log(-value) / self.log_gamma)
+            self.negative[key] = self.negative.get(key, 0) + 1
+        else:
+            self.zero += 1
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def to_dict(self):
+        """JSON-safe state, for merging sketches across processes"""
+        return {'positive': {str(key): count for key, count in self.positive.items()},
+                'negative': {str(key): count for key, count in self.negative.items()}, 'zero': self.zero,
+                'count': self.count, 'min': self.min if self.count else None,
+                'max': self.max if self.count else None}
+
+    @classmethod
+    def from_dict(cls, state, alpha=DEFAULT_ALPHA):
+        sketch = cls(alpha)
+        sketch.positive = {int(key): count for key, count in state['positive'].items()}
+        sketch.negative = {int(key): count for key, count in state['negative'].items()}
+        sketch.zero = state['zero']
+        sketch.count = state['count']
+        if sketch.count:
+            sketch.min, sketch.max = state['min'], state['max']
+        return sketch
+
+    def merge(self, other):
+        for store, theirs in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in theirs.items():
+                store[key] = store.get(key, 0) + count
+        self.zero += other.zero
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        """Value at quantile ``q`` (0..1), or None when empty"""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        # Most negative first: larger keys are larger magnitudes
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return max(-self._value(key), self.min)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return min(self._value(key), self.max)
+        return self.max
+
+
+def _round(value):
+    return None if value is None else round(value, 4)
+
+
+def parse_quantiles(value):
+    """Parse ?quantiles=0.5,0.99, or the defaults"""
+    if not value:
+        return DEFAULT_QUANTILES
+    quantiles = tuple(float(q) for q in value.split(',') if q.strip())
+    if not quantiles or not all(0 <= q <= 1 for q in quantiles):
+        raise ValueError('quantiles must be between 0 and 1')
+    return quantiles
+
+
+def _current_stats(n, value_at, total, quantiles):
+    """Stats of ``n`` sorted latest values (``value_at(i)`` is the i-th) summing to ``total``"""
+    stats = {'hosts': n}
+    if n:
+        stats.update(min=value_at(0), max=value_at(n - 1), mean=_round(total / n))
+        for q in quantiles:
+            stats[f'p{q * 100:g}'] = value_at(round(q * (n - 1)))
+    return stats
+
+
+def _window_stats(sketch, quantiles):
+    stats = {'samples': sketch.count}
+    if sketch.count:
+        stats.update(min=sketch.min, max=sketch.max)
+        for q in quantiles:
+            stats[f'p{q * 100:g}'] = _round(sketch.quantile(q))
+    return stats
+
+
+def merge_partials(partials, fields=NUMERIC_FIELDS, quantiles=DEFAULT_QUANTILES, window=None,
+                   alpha=DEFAULT_ALPHA):
+    """Combine ``FleetAggregates.partial()`` results into a ``summary()`` result"""
+    current = {}
+    for field in fields:
+        values = list(heapq.merge(*(partial['current'][field]['values'] for partial in partials)))
+        total = math.fsum(partial['current'][field]['sum'] for partial in partials)
+        current[field] = _current_stats(len(values), values.__getitem__, total, quantiles)
+    result = {'hosts': sum(partial['hosts'] for partial in partials), 'current': current}
+    windows = [partial['window'] for partial in partials if 'window' in partial]
+    if window and windows:
+        merged = {}
+        for field in fields:
+            sketch = DDSketch(alpha)
+            for part in windows:
+                sketch.merge(DDSketch.from_dict(part['fields'][field], alpha))
+            merged[field] = _window_stats(sketch, quantiles)
+        result['window'] = {'seconds': window, 'buckets': max(part['buckets'] for part in windows),
+                            'relative_error': alpha, 'fields': merged}
+    return result
+
+
+class FleetAggregates:
+    """Latest values, sorted per field, and per-bucket sketches of the fleet
+
+    One lock guards everything; updates are a few binary searches and
+    dictionary increments per sample.
+    """
+
+    def __init__(self, bucket_width=DEFAULT_BUCKET_WIDTH, buckets=DEFAULT_BUCKETS,
+                 alpha=DEFAULT_ALPHA):
+        self.bucket_width = bucket_width
+        self.buckets = buckets
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._latest = {}   # pc_name -> (timestamp, values)
+        self._sorted = [[] for _ in NUMERIC_FIELDS]  # per field: sorted (value, pc_name)
+        self._sums = [0.0] * len(NUMERIC_FIELDS)
+        self._sketches = {}  # bucket start -> [DDSketch per field]
+        self._newest_bucket = None
+
+    def __len__(self):
+        return len(self._latest)
+
+    def __contains__(self, pc_name):
+        return pc_name in self._latest
+
+    def __iter__(self):
+        return iter(list(self._latest))
+
+    def update(self, entries):
+        """Fold decoded ``(pc_name, epoch, values, static)`` entries in"""
+        newest = {}
+        for entry in entries:
+            current = newest.get(entry[0])
+            if current is None or entry[1] >= current[1]:
+                newest[entry[0]] = entry
+        with self._lock:
+            for _, timestamp, values, _ in entries:
+                self._add_to_sketches(timestamp, values)
+            # Only the newest sample per PC moves it in the sorted lists
+            for pc_name, (_, timestamp, values, _) in newest.items():
+                current = self._latest.get(pc_name)
+                if current is None or timestamp >= current[0]:
+                    self._set_latest(pc_name, timestamp, values, current)
+
+    def _set_latest(self, pc_name, timestamp, values, current):
+        for i, value in enumerate(values):
+            old = math.nan if current is None else current[1][i]
+            if value == old or (math.isnan(value) and math.isnan(old)):
+                continue  # Unchanged (totals, static sizes): nothing to move
+            column = self._sorted[i]
+            if not math.isnan(old):
+                del column[bisect_left(column, (old, pc_name))]
+                self._sums[i] -= old
+            if not math.isnan(value):
+                insort(column, (value, pc_name))
+                self._sums[i] += value
+        self._latest[pc_name] = (timestamp, list(values))
+
+    def _add_to_sketches(self, timestamp, values):
+        start = timestamp - timestamp % self.bucket_width
+        if self._newest_bucket is not None and start <= self._newest_bucket - self.buckets * self.bucket_width:
+            return  # Older than anything kept
+        if start > time.time() + self.bucket_width:
+            return  # From a clock far ahead; it would expire every real bucket
+        sketches = self._sketches.get(start)
+        if sketches is None:
+            sketches = self._sketches[start] = [DDSketch(self.alpha) for _ in NUMERIC_FIELDS]
+            if self._newest_bucket is None or start > self._newest_bucket:
+                self._newest_bucket = start
+                oldest = start - self.buckets * self.bucket_width
+                for expired in [key for key in self._sketches if key <= oldest]:
+                    del self._sketches[expired]
+        for sketch, value in zip(sketches, values):
+            if not math.isnan(value):
+                sketch.add(value)
+
+    def remove(self, pc_name):
+        """Drop a PC from the latest values (its samples stay in the sketches)"""
+        with self._lock:
+            current = self._latest.pop(pc_name, None)
+            if current is None:
+                return
+            for i, value in enumerate(current[1]):
+                if not math.isnan(value):
+                    column = self._sorted[i]
+                    del column[bisect_left(column, (value, pc_name))]
+                    self._sums[i] -= value
+
+    def _column(self, i, hosts):
+        """Sorted ``(value, pc_name)`` of field ``i``, for ``hosts`` or everyone"""
+        if hosts is None:
+            return self._sorted[i]
+        latest = self._latest
+        return sorted((latest[pc_name][1][i], pc_name) for pc_name in hosts
+                      if pc_name in latest and not math.isnan(latest[pc_name][1][i]))
+
+    def topk(self, field, k=10, ascending=False, hosts=None):
+        """The ``k`` PCs with the highest (or lowest) latest ``field``"""
+        i = NUMERIC_FIELDS.index(field)
+        with self._lock:
+            if hosts is None:
+                column = self._sorted[i]
+                picked = column[:k] if ascending else column[:-k - 1:-1] if k > 0 else []
+            else:
+                latest = self._latest
+                values = ((latest[pc_name][1][i], pc_name) for pc_name in hosts
+                          if pc_name in latest and not math.isnan(latest[pc_name][1][i]))
+                picked = heapq.nsmallest(k, values) if ascending else heapq.nlargest(k, values)
+            return [{'pc_name': pc_name, 'value': value,
+                     'timestamp': format_timestamp(self._latest[pc_name][0])}
+                    for value, pc_name in picked]
+
+    def summary(self, fields=NUMERIC_FIELDS, quantiles=DEFAULT_QUANTILES, window=None, now=None,
+                hosts=None):
+        """Aggregates of the latest values and, with ``window`` seconds, of recent samples
+
+        ``current`` is exact (from the sorted latest values); ``window``
+        comes from the sketches of the buckets overlapping the last
+        ``window`` seconds before ``now`` (default: the end of the newest
+        bucket, so agent clock skew does not empty the window). With
+        ``hosts`` only ``current`` is returned.
+        """
+        with self._lock:
+            current = {}
+            for field in fields:
+                i = NUMERIC_FIELDS.index(field)
+                column = self._column(i, hosts)
+                total = self._sums[i] if hosts is None else math.fsum(value for value, _ in column)
+                current[field] = _current_stats(len(column), lambda j: column[j][0], total, quantiles)
+            result = {'hosts': self._count_hosts(hosts), 'current': current}
+
+            if window and hosts is None:
+                buckets, sketches = self._window_sketches(fields, window, now)
+                result['window'] = {'seconds': window, 'buckets': buckets, 'relative_error': self.alpha,
+                                    'fields': {field: _window_stats(sketches[field], quantiles)
+                                               for field in fields}}
+        return result
+
+    def partial(self, fields=NUMERIC_FIELDS, window=None, now=None, hosts=None):
+        """This process's share of a summary, for ``merge_partials`` (JSON-safe)"""
+        with self._lock:
+            current = {}
+            for field in fields:
+                i = NUMERIC_FIELDS.index(field)
+                column = self._column(i, hosts)
+                total = self._sums[i] if hosts is None else math.fsum(value for value, _ in column)
+                current[field] = {'values': [value for value, _ in column], 'sum': total}
+            result = {'hosts': self._count_hosts(hosts), 'current': current}
+            if window and hosts is None:
+                buckets, sketches = self._window_sketches(fields, window, now)
+                result['window'] = {'buckets': buckets,
+                                    'fields': {field: sketch.to_dict() for field, sketch in sketches.items()}}
+        return result
+
+    def _count_hosts(self, hosts):
+        if hosts is None:
+            return len(self._latest)
+        return sum(1 for pc_name in hosts if pc_name in self._latest)
+
+    def _window_sketches(self, fields, window, now):
+        """``(bucket count, {field: merged DDSketch})`` over the last ``window`` seconds"""
+        if now is None:
+            now = self._newest_bucket + self.bucket_width if self._newest_bucket is not None else 0
+        since = now - window
+        buckets = [sketches for start, sketches in self._sketches.items()
+                   if start + self.bucket_width > since and start < now]
+        merged = {}
+        for field in fields:
+            i = NUMERIC_FIELDS.index(field)
+            sketch = merged[field] = DDSketch(self.alpha)
+            for sketches in buckets:
+                sketch.merge(sketches[i])
+        return len(buckets), merged
@@ -0,0 +1,168 @@
+"""
+Host labels and an inverted index for label selectors.
+
+Agents describe where they run with a few labels (``rack=r12``,
+``role=db``, ``dc=ams1``), sent with every JSON sample and with the binary
+hello. The index maps each ``key`` to ``{value: set of PCs}``, so a
+selector is answered by intersecting a handful of sets instead of looking
+at every host.
+
+Selector syntax, comma-separated terms that must all hold::
+
+    rack=r12            label equals the value
+    rack=r12|r13        label is one of the values
+    role!=db            label missing or different
+    gpu                 label present, any value
+    !gpu                label missing
+"""
+
+import re
+import threading
+
+MAX_LABELS = 32
+MAX_VALUE_LENGTH = 128
+
+_KEY = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.\-/]{0,62}$')
+_VALUE = re.compile(r'^[A-Za-z0-9_.\-/:]*$')
+_TERM = re.compile(r'^\s*(?P<absent>!)?\s*(?P<key>[^\s=!|,]+)\s*'
+                   r'(?:(?P<op>!=|=)\s*(?P<values>[^\s=!,]*))?\s*$')
+
+
+def parse_labels(labels):
+    """Validate a ``{key: value}`` dict from an agent; return it with str values
+
+    Raises ValueError naming the first problem.
+    """
+    if not isinstance(labels, dict):
+        raise ValueError('labels must be an object')
+    if len(labels) > MAX_LABELS:
+        raise ValueError(f'At most {MAX_LABELS} labels')
+    parsed = {}
+    for key, value in labels.items():
+        if not isinstance(key, str) or not _KEY.match(key):
+            raise ValueError(f'Invalid label name {key!r}')
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise ValueError(f'Label {key} must be a string')
+        value = str(value)
+        if len(value) > MAX_VALUE_LENGTH or not _VALUE.match(value):
+            raise ValueError(f'Invalid value for label {key}')
+        parsed[key] = value
+    return parsed
+
+
+def parse_selector(text):
+    """Parse ``rack=r1|r2,role!=db,gpu,!spare`` into a tuple of ``(key, op, values)``
+
+    ``op`` is '=', '!=', None (label present) or '!' (label missing);
+    ``values`` a frozenset. Raises ValueError for malformed terms.
+    """
+    terms = []
+    for part in (text or '').split(','):
+        if not part.strip():
+            continue
+        match = _TERM.match(part)
+        if (match is None or not _KEY.match(match.group('key'))
+                or (match.group('absent') and match.group('op'))):
+            raise ValueError(f'Invalid selector term {part.strip()!r}')
+        op = '!' if match.group('absent') else match.group('op')
+        values = frozenset(match.group('values').split('|')) if op in ('=', '!=') else frozenset()
+        terms.append((match.group('key'), op, values))
+    if not terms:
+        raise ValueError('Empty selector')
+    return tuple(sorted(terms, key=lambda term: (term[0], term[1] or '', sorted(term[2]))))
+
+
+def format_selector(selector):
+    """Canonical text of a parsed selector (equal selectors, equal text)"""
+    parts = []
+    for key, op, values in selector:
+        if op is None:
+            parts.append(key)
+        elif op == '!':
+            parts.append(f'!{key}')
+        else:
+            parts.append(f"{key}{op}{'|'.join(sorted(values))}")
+    return ','.join(parts)
+
+
+def selector_matches(selector, labels):
+    """True when a PC with ``labels`` satisfies every term"""
+    for key, op, values in selector:
+        value = labels.get(key)
+        if op is None:
+            if value is None:
+                return False
+        elif op == '!':
+            if value is not None:
+                return False
+        elif op == '=':
+            if value not in values:
+                return False
+        elif value in values:
+            return False
+    return True
+
+
+class LabelIndex:
+    """PC labels plus an inverted index ``key -> value -> set of PCs``"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._labels = {}  # pc_name -> {key: value}
+        self._index = {}   # key -> {value: set of pc_names}
+
+    def __len__(self):
+        return len(self._labels)
+
+    def set(self, pc_name, labels):
+        """Replace the labels of ``pc_name`` (a no-op when unchanged)"""
+        if self._labels.get(pc_name) == labels:
+            return
+        with self._lock:
+            self._unindex(pc_name)
+            if labels:
+                self._labels[pc_name] = dict(labels)
+                for key, value in labels.items():
+                    self._index.setdefault(key, {}).setdefault(value, set()).add(pc_name)
+
+    def _unindex(self, pc_name):
+        for key, value in self._labels.pop(pc_name, {}).items():
+            values = self._index[key]
+            hosts = values[value]
+            hosts.discard(pc_name)
+            if not hosts:
+                del values[value]
+                if not values:
+                    del self._index[key]
+
+    def remove(self, pc_name):
+        with self._lock:
+            self._unindex(pc_name)
+
+    def labels(self, pc_name):
+        return self._labels.get(pc_name, {})
+
+    def select(self, selector, universe):
+        """PCs of ``universe`` (live PCs: any container) matching a parsed selector
+
+        '=' and presence terms are looked up in the index and intersected,
+        smallest set first; '!=' and '!' terms then subtract their matches.
+        Only a selector made of those alone has to start from ``universe``.
+        """
+        with self._lock:
+            including = []
+            excluding = []
+            for key, op, values in selector:
+                by_value = self._index.get(key, {})
+                wanted = by_value.values() if op in (None, '!') else (
+                    by_value[value] for value in values if value in by_value)
+                hosts = set().union(*wanted)
+                (excluding if op in ('!=', '!') else including).append(hosts)
+            including.sort(key=len)
+            selected = set(including[0]) if including else set(universe)
+            for hosts in including[1:]:
+                selected &= hosts
+            selected = {pc_name for pc_name in selected if pc_name in universe}
+            for hosts in excluding:
+                selected -= hosts
+            return selected
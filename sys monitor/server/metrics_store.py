@@ -0,0 +1,493 @@
+"""
+Columnar in-memory metrics store.
+
+Each PC gets a fixed-capacity ring buffer made of ``array('d')`` columns,
+one per numeric field plus an epoch-float timestamp column, instead of a
+deque of per-sample dicts. Static strings such as ``os_info`` are interned
+and kept once per PC.
+"""
+
+import math
+import sys
+import threading
+from bisect import bisect_left
+from array import array
+from datetime import datetime
+
+# Numeric fields stored as columns (everything else in a sample is ignored
+# except the static fields below)
+NUMERIC_FIELDS = (
+    'cpu_percent',
+    'memory_percent',
+    'memory_used_gb',
+    'memory_total_gb',
+    'disk_percent',
+    'disk_used_gb',
+    'disk_total_gb',
+    'network_sent_mb',
+    'network_recv_mb',
+    'uptime_seconds',
+)
+
+# Fields that are reported as integers by the clients
+INTEGER_FIELDS = frozenset(['uptime_seconds'])
+
+# Per-PC strings that rarely change; stored once, not per sample
+STATIC_FIELDS = ('os_info',)
+
+# Everything a query may project with ?fields=
+QUERYABLE_FIELDS = frozenset(NUMERIC_FIELDS + STATIC_FIELDS)
+
+DEFAULT_CAPACITY = 1000  # Keep last 1000 data points per PC
+DEFAULT_STRIPES = 64  # Lock stripes shared out among all PCs
+
+NAN = float('nan')
+
+
+def parse_timestamp(value):
+    """Convert a client ISO timestamp (or epoch number) to epoch seconds"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).timestamp()
+
+
+def format_timestamp(epoch):
+    """Convert epoch seconds back to the ISO format the clients send"""
+    return datetime.fromtimestamp(epoch).isoformat()
+
+
+def _to_float(value):
+    if value is None:
+        return NAN
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+
+def _to_json(field, value):
+    if math.isnan(value):
+        return None
+    if field in INTEGER_FIELDS:
+        return int(value)
+    return value
+
+
+def sample_values(sample):
+    """Numeric fields of a client sample as floats, in NUMERIC_FIELDS order"""
+    return [_to_float(sample.get(field)) for field in NUMERIC_FIELDS]
+
+
+def sample_static(sample):
+    """Static strings (STATIC_FIELDS) present in a client sample"""
+    return {field: str(sample[field]) for field in STATIC_FIELDS
+            if sample.get(field) is not None}
+
+
+def valid_pc_name(pc_name):
+    """PC names are non-empty strings (they key dicts and name directories)"""
+    return isinstance(pc_name, str) and pc_name != ''
+
+
+def decode_sample(sample):
+    """Decode a client sample into ``(pc_name, epoch, values, static)``
+
+    This is the only pass over the parsed dict on ingest; every store takes
+    the decoded entry. Raises KeyError, TypeError or ValueError for a
+    missing or malformed ``pc_name`` or timestamp.
+    """
+    pc_name = sample['pc_name']
+    if not valid_pc_name(pc_name):
+        raise TypeError('pc_name must be a non-empty string')
+    return (pc_name, parse_timestamp(sample['timestamp']),
+            sample_values(sample), sample_static(sample))
+
+
+def build_row(pc_name, epoch, values, static, fields=None):
+    """Build the API's ``{timestamp, data}`` dict from stored column values
+
+    ``fields`` limits ``data`` to those fields (plus the timestamp).
+    """
+    timestamp = format_timestamp(epoch)
+    if fields is None:
+        data = {'pc_name': pc_name, 'timestamp': timestamp}
+        for field, value in zip(NUMERIC_FIELDS, values):
+            data[field] = _to_json(field, value)
+        data.update(static)
+    else:
+        data = {'timestamp': timestamp}
+        for field, value in zip(NUMERIC_FIELDS, values):
+            if field in fields:
+                data[field] = _to_json(field, value)
+        for field, value in static.items():
+            if field in fields:
+                data[field] = value
+    return {'timestamp': timestamp, 'data': data}
+
+
+class _LogicalTimestamps:
+    """Read-only chronological view of a ring's timestamp column, for bisect"""
+
+    __slots__ = ('timestamps', 'first', 'size', 'capacity')
+
+    def __init__(self, series):
+        self.timestamps = series.timestamps
+        self.capacity = series.capacity
+        self.size = len(series)
+        self.first = (series._head - self.size) % self.capacity
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        return self.timestamps[(self.first + index) % self.capacity]
+
+
+class HostSeries:
+    """Fixed-capacity ring buffer of samples for a single PC"""
+
+    __slots__ = ('pc_name', 'capacity', 'timestamps', 'columns', 'static',
+                 'seq', '_head', '_size', '_unordered_seq')
+
+    def __init__(self, pc_name, capacity=DEFAULT_CAPACITY):
+        self.pc_name = sys.intern(pc_name)
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.columns = {
+            field: array('d', bytes(8 * capacity)) for field in NUMERIC_FIELDS
+        }
+        self.static = {}
+        self.seq = 0  # Sequence number of the newest sample (1-based)
+        self._head = 0  # Next slot to write
+        self._size = 0
+        self._unordered_seq = 0  # Newest seq that arrived out of time order
+
+    def __len__(self):
+        return self._size
+
+    def append(self, timestamp, sample):
+        """Append one sample (a client metrics dict) at epoch ``timestamp``"""
+        self.append_decoded(timestamp, sample_values(sample), sample_static(sample))
+
+    def append_decoded(self, timestamp, values, static):
+        """Append decoded values and keep the newest static strings interned"""
+        self.append_values(timestamp, values)
+        for field, value in static.items():
+            if self.static.get(field) != value:
+                self.static[field] = sys.intern(value)
+
+    def append_values(self, timestamp, values):
+        """Append one record of floats given in NUMERIC_FIELDS order"""
+        slot = self._head
+        if self._size and timestamp < self.timestamps[(slot - 1) % self.capacity]:
+            self._unordered_seq = self.seq + 1
+        self.timestamps[slot] = timestamp
+        for column, value in zip(self.columns.values(), values):
+            column[slot] = value
+
+        self.seq += 1
+        self._head = (slot + 1) % self.capacity
+        if self._size < self.capacity:
+            self._size += 1
+
+    def slots(self):
+        """Physical slot indices in chronological order"""
+        start = (self._head - self._size) % self.capacity
+        end = start + self._size
+        if end <= self.capacity:
+            return range(start, end)
+        return list(range(start, self.capacity)) + list(range(0, end - self.capacity))
+
+    def first_seq(self):
+        """Sequence number of the oldest sample still in the buffer"""
+        return self.seq - self._size + 1
+
+    def oldest_timestamp(self):
+        if not self._size:
+            return None
+        return self.timestamps[(self._head - self._size) % self.capacity]
+
+    def is_time_ordered(self):
+        """True when every buffered sample arrived in timestamp order"""
+        return self._unordered_seq < self.first_seq()
+
+    def has_timestamp(self, timestamp):
+        """Whether a sample at exactly ``timestamp`` is still buffered"""
+        if not self._size:
+            return False
+        if self.is_time_ordered():
+            if timestamp > self.timestamps[(self._head - 1) % self.capacity]:
+                return False  # The usual case: newer than everything buffered
+            view = _LogicalTimestamps(self)
+            index = bisect_left(view, timestamp)
+            return index < len(view) and view[index] == timestamp
+        timestamps = self.timestamps
+        return any(timestamps[slot] == timestamp for slot in self.slots())
+
+    def select(self, start=None, end=None, since_seq=None, limit=None):
+        """Chronological slot list for samples matching the query
+
+        ``start``/``end`` bound epoch timestamps as [start, end), found by
+        binary search while the buffer is time-ordered. ``since_seq`` keeps
+        samples newer than that sequence number and ``limit`` keeps the most
+        recent N of what remains.
+        """
+        lo, hi = 0, self._size
+        if since_seq is not None:
+            lo = max(lo, since_seq - self.first_seq() + 1)
+
+        first = (self._head - self._size) % self.capacity
+        capacity = self.capacity
+        if self.is_time_ordered():
+            view = _LogicalTimestamps(self)
+            if start is not None:
+                lo = max(lo, bisect_left(view, start))
+            if end is not None:
+                hi = min(hi, bisect_left(view, end))
+            logical = range(lo, hi)
+        else:
+            # Rare: a late sample is still buffered, so scan instead
+            timestamps = self.timestamps
+            logical = [
+                i for i in range(lo, hi)
+                if (start is None or timestamps[(first + i) % capacity] >= start)
+                and (end is None or timestamps[(first + i) % capacity] < end)
+            ]
+            logical.sort(key=lambda i: timestamps[(first + i) % capacity])
+
+        if limit is not None and len(logical) > limit:
+            logical = logical[len(logical) - limit:] if limit > 0 else logical[:0]
+        return [(first + i) % capacity for i in logical]
+
+    def project(self, slots, fields=None):
+        """Rows for ``slots``; with ``fields`` only those columns are serialized"""
+        if fields is None:
+            return [self.row(slot) for slot in slots]
+        columns = [(field, column) for field, column in self.columns.items() if field in fields]
+        static = {field: value for field, value in self.static.items() if field in fields}
+        timestamps = self.timestamps
+        rows = []
+        for slot in slots:
+            timestamp = format_timestamp(timestamps[slot])
+            data = {'timestamp': timestamp}
+            for field, column in columns:
+                data[field] = _to_json(field, column[slot])
+            if static:
+                data.update(static)
+            rows.append({'timestamp': timestamp, 'data': data})
+        return rows
+
+    def row(self, slot):
+        """Rebuild the client metrics dict stored at ``slot``"""
+        values = [column[slot] for column in self.columns.values()]
+        return build_row(self.pc_name, self.timestamps[slot], values, self.static)
+
+    def rows(self):
+        """All samples, oldest first, in the API's ``{timestamp, data}`` shape"""
+        return [self.row(slot) for slot in self.slots()]
+
+    def latest(self):
+        """Most recent sample, or None if the buffer is empty"""
+        if not self._size:
+            return None
+        return self.row((self._head - 1) % self.capacity)
+
+    def nbytes(self):
+        """Approximate memory held by the column buffers"""
+        columns = [self.timestamps] + list(self.columns.values())
+        return sum(col.itemsize * len(col) for col in columns)
+
+    def export(self):
+        """Copies of the timestamp and field columns, oldest sample first"""
+        first = (self._head - self._size) % self.capacity
+        end = first + self._size
+        if end <= self.capacity:
+            return [column[first:end] for column in [self.timestamps, *self.columns.values()]]
+        return [column[first:] + column[:end - self.capacity]
+                for column in [self.timestamps, *self.columns.values()]]
+
+    @classmethod
+    def from_columns(cls, pc_name, capacity, seq, columns, static, unordered_seq=0):
+        """Rebuild a series from ``export()`` columns (taken over, not copied)"""
+        series = cls.__new__(cls)
+        size = min(len(columns[0]), capacity)
+        padding = bytes(8 * (capacity - size))
+        for i, column in enumerate(columns):
+            if len(column) > size:
+                columns[i] = column = column[len(column) - size:]  # Keep the newest
+            column.frombytes(padding)
+        series.pc_name = sys.intern(pc_name)
+        series.capacity = capacity
+        series.timestamps = columns[0]
+        series.columns = dict(zip(NUMERIC_FIELDS, columns[1:]))
+        series.static = {field: sys.intern(value) for field, value in static.items()}
+        series.seq = seq
+        series._head = size % capacity
+        series._size = size
+        series._unordered_seq = unordered_seq
+        return series
+
+
+class StripedLock:
+    """Fixed pool of locks; a key always maps to the same stripe
+
+    Work for different PCs rarely shares a stripe, so ingest for one PC
+    does not wait behind another the way it would with one global lock.
+    """
+
+    def __init__(self, stripes=DEFAULT_STRIPES):
+        self.locks = [threading.Lock() for _ in range(stripes)]
+
+    def index(self, key):
+        return hash(key) % len(self.locks)
+
+    def __call__(self, key):
+        return self.locks[hash(key) % len(self.locks)]
+
+
+class MetricsStore:
+    """Mapping of PC name to its HostSeries ring buffer
+
+    Safe to share between request threads: each PC's series is only read
+    or written while holding that PC's stripe lock, and listings return
+    snapshots. Callers should go through the store rather than holding on
+    to a HostSeries from ``get``.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, stripes=DEFAULT_STRIPES):
+        self.capacity = capacity
+        self._hosts = {}
+        self._lock = StripedLock(stripes)
+
+    def __contains__(self, pc_name):
+        return pc_name in self._hosts
+
+    def __len__(self):
+        return len(self._hosts)
+
+    def _series(self, pc_name):
+        # Caller holds the stripe lock of pc_name
+        series = self._hosts.get(pc_name)
+        if series is None:
+            series = self._hosts[pc_name] = HostSeries(pc_name, self.capacity)
+        return series
+
+    def append(self, pc_name, timestamp, sample):
+        """Store a sample for ``pc_name``; returns the PC's new ``seq``"""
+        with self._lock(pc_name):
+            series = self._series(pc_name)
+            series.append(timestamp, sample)
+            return series.seq
+
+    def extend(self, entries):
+        """Store many decoded ``(pc_name, timestamp, values, static)`` entries
+
+        Returns ``{pc_name: seq}`` after the last sample stored for each PC.
+        """
+        by_host = {}
+        for entry in entries:
+            by_host.setdefault(entry[0], []).append(entry)
+        seqs = {}
+        for pc_name, host_entries in by_host.items():
+            with self._lock(pc_name):
+                series = self._series(pc_name)
+                for _, timestamp, values, static in host_entries:
+                    series.append_decoded(timestamp, values, static)
+                seqs[pc_name] = series.seq
+        return seqs
+
+    def extend_new(self, entries):
+        """Like ``extend``, but skip samples whose PC already holds that timestamp
+
+        A batch retried after a lost reply (or after a sharded front got a
+        partial failure) is then stored once. Returns ``({pc_name: seq},
+        indexes of the stored entries)``; only samples still buffered are
+        recognized.
+        """
+        by_host = {}
+        for index, entry in enumerate(entries):
+            by_host.setdefault(entry[0], []).append(index)
+        seqs = {}
+        stored = []
+        for pc_name, indexes in by_host.items():
+            with self._lock(pc_name):
+                series = self._series(pc_name)
+                for index in indexes:
+                    _, timestamp, values, static = entries[index]
+                    if series.has_timestamp(timestamp):
+                        continue
+                    series.append_decoded(timestamp, values, static)
+                    stored.append(index)
+                seqs[pc_name] = series.seq
+        stored.sort()
+        return seqs, stored
+
+    def query(self, pc_name, start=None, end=None, since_seq=None, limit=None, fields=None):
+        """Rows for a range or cursor, or None when memory cannot answer it
+
+        Returns ``{'metrics': rows, 'last_seq': seq}`` plus ``truncated``
+        when ``since_seq`` fell out of the buffer. A ``since_seq`` newer than
+        ``last_seq`` comes from before the PC was evicted and its sequence
+        restarted: every buffered sample is returned, flagged ``truncated``
+        and ``reset``. None means the PC is not in memory or ``start`` is
+        older than its oldest buffered sample.
+        """
+        with self._lock(pc_name):
+            series = self._hosts.get(pc_name)
+            if series is None:
+                return None
+            reset = since_seq is not None and since_seq > series.seq
+            if reset:
+                since_seq = None
+            if since_seq is None and start is not None and not (
+                    len(series) and start >= series.oldest_timestamp()):
+                return None
+            slots = series.select(start, end, since_seq, limit)
+            result = {'metrics': series.project(slots, fields), 'last_seq': series.seq}
+            if since_seq is not None and since_seq + 1 < series.first_seq():
+                result['truncated'] = True  # The cursor fell out of the buffer
+            if reset:
+                result['truncated'] = result['reset'] = True
+            return result
+
+    def rows(self, pc_name, fields=None, max_count=None):
+        """All buffered rows of ``pc_name``, oldest first
+
+        Returns None when the PC is not in memory or holds more than
+        ``max_count`` samples.
+        """
+        with self._lock(pc_name):
+            series = self._hosts.get(pc_name)
+            if series is None or (max_count is not None and len(series) > max_count):
+                return None
+            return series.project(series.select(), fields)
+
+    def get(self, pc_name):
+        return self._hosts.get(pc_name)
+
+    def remove(self, pc_name):
+        with self._lock(pc_name):
+            self._hosts.pop(pc_name, None)
+
+    def hosts(self):
+        return list(self._hosts)  # Snapshot; safe while other threads insert
+
+    def nbytes(self):
+        return sum(series.nbytes() for series in list(self._hosts.values()))
+
+    def export(self, pc_name):
+        """``(seq, unordered_seq, static, columns)`` copied under the PC's lock, or None"""
+        with self._lock(pc_name):
+            series = self._hosts.get(pc_name)
+            if series is None:
+                return None
+            return series.seq, series._unordered_seq, dict(series.static), series.export()
+
+    def restore(self, pc_name, seq, columns, static, unordered_seq=0):
+        """Install a series exported by ``export`` (e.g. from a snapshot)"""
+        series = HostSeries.from_columns(pc_name, self.capacity, seq, columns, static, unordered_seq)
+        with self._lock(pc_name):
+            self._hosts[pc_name] = series
+
+    def items(self):
+        return list(self._hosts.items())
@@ -0,0 +1,167 @@
+"""
+Liveness tracking for reporting PCs.
+
+A PC is ``online`` while it keeps reporting, ``stale`` once it has been
+silent for ``stale_after`` seconds, and ``offline`` after ``offline_after``
+seconds, at which point it leaves the registry and its in-memory data can
+be dropped. Both thresholds live here so the client list and eviction
+always agree.
+
+Hosts are kept in two min-heaps of ``(last_seen, pc_name)``, one per live
+state. ``touch`` just pushes a new entry; superseded entries are skipped
+when they surface (lazy deletion). ``advance`` pops only the entries that
+crossed a threshold, so expiring k hosts costs O(k log N) instead of a
+scan of every host, and the client listing is rebuilt only when it is
+out of date.
+"""
+
+import heapq
+import threading
+import time
+from datetime import datetime
+
+ONLINE = 'online'
+STALE = 'stale'
+OFFLINE = 'offline'
+
+DEFAULT_STALE_AFTER = 30        # Seconds of silence before a PC is stale
+DEFAULT_OFFLINE_AFTER = 5 * 60  # Seconds of silence before it is dropped
+
+
+class HostRegistry:
+    """Last-seen time and online/stale state of every live PC"""
+
+    def __init__(self, stale_after=DEFAULT_STALE_AFTER, offline_after=DEFAULT_OFFLINE_AFTER,
+                 snapshot_ttl=1.0):
+        self.stale_after = stale_after
+        self.offline_after = offline_after
+        self.snapshot_ttl = snapshot_ttl
+        self._lock = threading.Lock()
+        self._last_seen = {}   # pc_name -> epoch seconds
+        self._state = {}       # pc_name -> ONLINE or STALE
+        self._online = []      # heap of (last_seen, pc_name)
+        self._stale = []       # heap of (last_seen, pc_name)
+        self._offline = []     # Dropped since the last pop_offline()
+        self._version = 0      # Bumped when membership or a state changes
+        self._snapshot = None
+        self._snapshot_version = -1
+        self._snapshot_at = 0.0
+
+    def __contains__(self, pc_name):
+        return pc_name in self._last_seen
+
+    def __len__(self):
+        return len(self._last_seen)
+
+    def touch(self, pc_name, when=None):
+        """Record that ``pc_name`` reported at ``when`` (default: now)"""
+        when = time.time() if when is None else when
+        with self._lock:
+            self._touch(pc_name, when)
+
+    def touch_many(self, pc_names, when=None):
+        when = time.time() if when is None else when
+        with self._lock:
+            for pc_name in pc_names:
+                self._touch(pc_name, when)
+
+    def restore(self, last_seen):
+        """Mark hosts seen at given times (``{pc_name: epoch}``, e.g. from a snapshot)
+
+        Hosts start online; the next ``advance`` moves any that have been
+        silent too long on to stale or offline.
+        """
+        with self._lock:
+            for pc_name, when in last_seen.items():
+                self._touch(pc_name, when)
+
+    def _touch(self, pc_name, when):
+        previous = self._last_seen.get(pc_name)
+        if previous is not None and when <= previous:
+            return  # Late (replayed) sample; liveness only moves forward
+        self._last_seen[pc_name] = when
+        if self._state.get(pc_name) != ONLINE:
+            self._state[pc_name] = ONLINE
+            self._version += 1
+        heapq.heappush(self._online, (when, pc_name))
+        if len(self._online) > 2 * len(self._last_seen) + 1024:
+            self._compact()
+
+    def _compact(self):
+        # Drop superseded heap entries once they outnumber the live ones
+        self._online = [(seen, pc) for seen, pc in self._online
+                        if self._last_seen.get(pc) == seen and self._state[pc] == ONLINE]
+        heapq.heapify(self._online)
+
+    def last_seen(self, pc_name):
+        return self._last_seen.get(pc_name)
+
+    def state(self, pc_name):
+        return self._state.get(pc_name, OFFLINE)
+
+    def advance(self, now=None):
+        """Move hosts that crossed a threshold to stale or offline
+
+        Returns the names that went offline in this call; they are also
+        queued for ``pop_offline``.
+        """
+        now = time.time() if now is None else now
+        went_offline = []
+        with self._lock:
+            stale_cutoff = now - self.stale_after
+            while self._online and self._online[0][0] < stale_cutoff:
+                seen, pc_name = heapq.heappop(self._online)
+                if self._last_seen.get(pc_name) == seen and self._state[pc_name] == ONLINE:
+                    self._state[pc_name] = STALE
+                    heapq.heappush(self._stale, (seen, pc_name))
+                    self._version += 1
+
+            offline_cutoff = now - self.offline_after
+            while self._stale and self._stale[0][0] < offline_cutoff:
+                seen, pc_name = heapq.heappop(self._stale)
+                if self._last_seen.get(pc_name) == seen and self._state[pc_name] == STALE:
+                    del self._last_seen[pc_name]
+                    del self._state[pc_name]
+                    went_offline.append(pc_name)
+                    self._version += 1
+            self._offline.extend(went_offline)
+        return went_offline
+
+    def pop_offline(self):
+        """Hosts that went offline since the last call, for eviction"""
+        with self._lock:
+            offline, self._offline = self._offline, []
+        return offline
+
+    def snapshot(self, now=None):
+        """The ``/api/clients`` payload, rebuilt at most once per ``snapshot_ttl``
+
+        A state change (host appearing, going stale or offline) always
+        forces a rebuild; otherwise only ``last_seen`` could be out of date,
+        by at most ``snapshot_ttl`` seconds.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            if (self._snapshot is not None and self._snapshot_version == self._version
+                    and now - self._snapshot_at < self.snapshot_ttl):
+                return self._snapshot
+            states = dict(self._state)
+            last_seen = {pc: datetime.fromtimestamp(seen).isoformat()
+                         for pc, seen in self._last_seen.items()}
+            version = self._version
+
+        counts = {ONLINE: 0, STALE: 0}
+        for state in states.values():
+            counts[state] += 1
+        snapshot = {
+            'active_clients': list(states),
+            'last_seen': last_seen,
+            'status': states,
+            'counts': counts,
+        }
+        with self._lock:
+            if version >= self._snapshot_version:
+                self._snapshot = snapshot
+                self._snapshot_version = version
+                self._snapshot_at = now
+        return snapshot
@@ -0,0 +1,265 @@
+"""
+Multi-resolution rollups (downsampling tiers) per PC.
+
+Every sample is folded into fixed-width time buckets for each tier as it
+arrives. A bucket keeps count plus min, max, sum (for the mean) and last
+of every numeric field. Queries choose the finest tier whose bucket count
+for the requested range fits within ``max_points``, so a week-long chart
+costs a few hundred points instead of every raw sample.
+"""
+
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+
+from metrics_store import NUMERIC_FIELDS, StripedLock, format_timestamp, _to_json
+
+# (bucket width in seconds, buckets kept in memory)
+DEFAULT_TIERS = (
+    (10, 360),     # 1 hour of 10 s buckets
+    (60, 360),     # 6 hours of 1 min buckets
+    (300, 288),    # 1 day of 5 min buckets
+    (3600, 168),   # 7 days of 1 h buckets
+)
+
+class RollupTier:
+    """Time-ordered buckets of one width for a single PC
+
+    Columns are ``array('d')`` that grow until ``capacity`` buckets and are
+    then trimmed from the front in chunks, which keeps them sorted for
+    bisect and makes trimming amortized O(1).
+    """
+
+    __slots__ = ('width', 'capacity', 'starts', 'counts', 'last_ts',
+                 'mins', 'maxs', 'sums', 'lasts', 'trimmed')
+
+    def __init__(self, width, capacity):
+        self.width = width
+        self.capacity = capacity
+        self.starts = array('d')
+        self.counts = array('d')
+        self.last_ts = array('d')
+        self.mins = [array('d') for _ in NUMERIC_FIELDS]
+        self.maxs = [array('d') for _ in NUMERIC_FIELDS]
+        self.sums = [array('d') for _ in NUMERIC_FIELDS]
+        self.lasts = [array('d') for _ in NUMERIC_FIELDS]
+        self.trimmed = False  # Whether buckets were ever dropped from the front
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _new_bucket(self, start, timestamp, values):
+        self.starts.append(start)
+        self.counts.append(1)
+        self.last_ts.append(timestamp)
+        for i, value in enumerate(values):
+            self.mins[i].append(value)
+            self.maxs[i].append(value)
+            self.sums[i].append(value)
+            self.lasts[i].append(value)
+
+        # Trim a whole extra capacity at once once we hold twice as much
+        if len(self.starts) >= 2 * self.capacity:
+            drop = len(self.starts) - self.capacity
+            self.trimmed = True
+            for column in (self.starts, self.counts, self.last_ts):
+                del column[:drop]
+            for columns in (self.mins, self.maxs, self.sums, self.lasts):
+                for column in columns:
+                    del column[:drop]
+
+    def _merge(self, slot, timestamp, values):
+        self.counts[slot] += 1
+        newer = timestamp >= self.last_ts[slot]
+        if newer:
+            self.last_ts[slot] = timestamp
+        for i, value in enumerate(values):
+            if math.isnan(value):
+                self.sums[i][slot] = value  # Mean of a gappy bucket is unknown
+                continue
+            low = self.mins[i][slot]
+            if math.isnan(low) or value < low:
+                self.mins[i][slot] = value
+            high = self.maxs[i][slot]
+            if math.isnan(high) or value > high:
+                self.maxs[i][slot] = value
+            self.sums[i][slot] += value
+            if newer or math.isnan(self.lasts[i][slot]):
+                self.lasts[i][slot] = value
+
+    def add(self, timestamp, values):
+        """Fold one sample (floats in NUMERIC_FIELDS order) into its bucket"""
+        start = (timestamp // self.width) * self.width
+        starts = self.starts
+        if not starts or start > starts[-1]:
+            self._new_bucket(start, timestamp, values)
+        elif start == starts[-1]:
+            self._merge(len(starts) - 1, timestamp, values)
+        else:
+            # Late sample: merge into an existing bucket, if we still have it
+            slot = bisect_left(starts, start)
+            if slot < len(starts) and starts[slot] == start:
+                self._merge(slot, timestamp, values)
+
+    def window(self, start=None, end=None):
+        """Range of bucket slots overlapping [start, end)"""
+        lo = 0 if start is None else bisect_right(self.starts, start - self.width)
+        hi = len(self.starts) if end is None else bisect_left(self.starts, end)
+        return range(max(lo, len(self.starts) - self.capacity), hi)
+
+    def covers(self, start):
+        """Whether the retained buckets reach back to ``start``"""
+        if not self.starts:
+            return False
+        return self.starts[max(0, len(self.starts) - self.capacity)] <= start
+
+    def holds_all(self):
+        """Whether every bucket since the first sample is still retained"""
+        return not self.trimmed and len(self.starts) <= self.capacity
+
+    def oldest(self):
+        """Start of the oldest retained bucket, or None when empty"""
+        if not self.starts:
+            return None
+        return self.starts[max(0, len(self.starts) - self.capacity)]
+
+    def point(self, pc_name, slot, fields=NUMERIC_FIELDS):
+        """One bucket in the API shape; ``data`` holds the mean of each field"""
+        timestamp = format_timestamp(self.starts[slot])
+        count = self.counts[slot]
+        data = {'pc_name': pc_name, 'timestamp': timestamp}
+        stats = {'min': {}, 'max': {}, 'last': {}}
+        for i, field in enumerate(NUMERIC_FIELDS):
+            if field not in fields:
+                continue
+            data[field] = _to_json(field, self.sums[i][slot] / count)
+            stats['min'][field] = _to_json(field, self.mins[i][slot])
+            stats['max'][field] = _to_json(field, self.maxs[i][slot])
+            stats['last'][field] = _to_json(field, self.lasts[i][slot])
+        point = {'timestamp': timestamp, 'count': int(count), 'data': data}
+        point.update(stats)
+        return point
+
+
+class HostRollups:
+    """All rollup tiers for a single PC"""
+
+    __slots__ = ('pc_name', 'tiers')
+
+    def __init__(self, pc_name, tiers=DEFAULT_TIERS):
+        self.pc_name = pc_name
+        self.tiers = [RollupTier(width, capacity) for width, capacity in tiers]
+
+    def add(self, timestamp, values):
+        for tier in self.tiers:
+            tier.add(timestamp, values)
+
+
+class RollupStore:
+    """Mapping of PC name to its HostRollups, updated on ingest
+
+    Like MetricsStore, each PC's tiers are only touched under its stripe
+    lock, so concurrent ingest and queries for different PCs do not contend.
+    """
+
+    def __init__(self, tiers=DEFAULT_TIERS, stripes=64):
+        self.tier_spec = tuple(tiers)
+        self._hosts = {}
+        self._lock = StripedLock(stripes)
+
+    def __contains__(self, pc_name):
+        return pc_name in self._hosts
+
+    def _host(self, pc_name):
+        # Caller holds the stripe lock of pc_name
+        host = self._hosts.get(pc_name)
+        if host is None:
+            host = self._hosts[pc_name] = HostRollups(pc_name, self.tier_spec)
+        return host
+
+    def add(self, pc_name, timestamp, values):
+        with self._lock(pc_name):
+            self._host(pc_name).add(timestamp, values)
+
+    def extend(self, entries):
+        """Fold many ``(pc_name, timestamp, values)`` entries, one lock per PC"""
+        by_host = {}
+        for pc_name, timestamp, values in entries:
+            by_host.setdefault(pc_name, []).append((timestamp, values))
+        for pc_name, records in by_host.items():
+            with self._lock(pc_name):
+                host = self._host(pc_name)
+                for timestamp, values in records:
+                    host.add(timestamp, values)
+
+    def get(self, pc_name):
+        return self._hosts.get(pc_name)
+
+    def remove(self, pc_name):
+        with self._lock(pc_name):
+            self._hosts.pop(pc_name, None)
+
+    def choose_tier(self, pc_name, start, end, max_points):
+        """Finest tier that covers ``start`` with at most ``max_points`` buckets
+
+        Without ``start`` the tier must cover everything held for the PC:
+        finer tiers that already dropped their oldest buckets are skipped.
+        When no tier fits, the coarsest candidate is returned (and ``points``
+        then reports it truncated). Returns None when no in-memory tier
+        reaches back to ``start``. The caller must hold the stripe lock of
+        ``pc_name``; see ``query``.
+        """
+        host = self._hosts.get(pc_name)
+        if host is None:
+            return None
+        if start is None:
+            tiers = [tier for tier in host.tiers if tier.holds_all()]
+            if not tiers:  # Every tier dropped buckets: take the one reaching furthest back
+                tiers = [min((tier for tier in host.tiers if len(tier)), key=RollupTier.oldest,
+                             default=host.tiers[-1])]
+        else:
+            tiers = [tier for tier in host.tiers if tier.covers(start)]
+        fallback = None
+        for tier in tiers:
+            if len(tier.window(start, end)) <= max_points:
+                return tier
+            fallback = tier
+        return fallback
+
+    def query(self, pc_name, start, end, max_points, fields=NUMERIC_FIELDS):
+        """Return (points, bucket width, truncated) from the best tier, or None"""
+        with self._lock(pc_name):
+            tier = self.choose_tier(pc_name, start, end, max_points)
+            if tier is None:
+                return None
+            found, truncated = points(tier, pc_name, start, end, max_points, fields)
+            return found, tier.width, truncated
+
+
+def pick_width(start, end, max_points, tiers=DEFAULT_TIERS):
+    """Finest configured bucket width giving at most max_points over the range"""
+    span = max(0.0, end - start)
+    for width, _ in tiers:
+        if span / width <= max_points:
+            return width
+    return tiers[-1][0]
+
+
+def downsample(records, width):
+    """Roll ``(timestamp, values)`` records (e.g. read from disk) into one tier"""
+    tier = RollupTier(width, max(1, len(records)))
+    for timestamp, values in records:
+        tier.add(timestamp, values)
+    return tier
+
+
+def points(tier, pc_name, start, end, max_points, fields=NUMERIC_FIELDS):
+    """``(points, truncated)``: the newest ``max_points`` buckets of ``tier`` in [start, end)
+
+    ``truncated`` is True when older buckets in the range were left out.
+    """
+    slots = tier.window(start, end)
+    truncated = len(slots) > max_points
+    if truncated:
+        slots = slots[-max_points:]
+    return [tier.point(pc_name, slot, fields) for slot in slots], truncated
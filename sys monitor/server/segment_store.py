@@ -0,0 +1,336 @@
+"""
+Persistent per-PC time-series storage on disk.
+
+Every PC gets a directory of append-only segment files. A segment covers a
+fixed span of time (one hour by default) and holds fixed-width records:
+the epoch timestamp followed by every field of NUMERIC_FIELDS, all as
+little-endian float64. Range reads map the segment with ``mmap`` and only
+decode the records that fall inside the requested window. Retention
+deletes whole segment files.
+
+Layout::
+
+    <root>/<quoted pc_name>/<segment start epoch>.seg
+    <root>/<quoted pc_name>/static.json     (os_info and friends)
+
+PC names are percent-quoted with a leading ``.`` escaped as well, so no
+name (``..`` included) can point outside its own directory under root.
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote, unquote
+
+try:
+    import resource
+except ImportError:  # Windows: no RLIMIT_NOFILE to size the writer cache from
+    resource = None
+
+from metrics_store import NUMERIC_FIELDS, sample_static, sample_values
+
+MAGIC = b'SMSEG001'
+HEADER = struct.Struct('<8sI4x')  # magic, values per record, padding
+SEGMENT_SUFFIX = '.seg'
+STATIC_FILE = 'static.json'
+
+DEFAULT_SEGMENT_SECONDS = 3600  # One segment file per PC per hour
+DEFAULT_RETENTION_SECONDS = 7 * 24 * 3600  # Keep a week of history
+REMOVE_BATCH = 256  # Expired segments deleted per blocking call
+MIN_OPEN_FILES = 256
+FD_RESERVE = 512  # Descriptors left for sockets, snapshots and reads
+
+logger = logging.getLogger('sysmon.segments')
+NATIVE_LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+def _call(func, *args):
+    return func(*args)
+
+
+def default_max_open_files():
+    """Segment writers to keep open: what RLIMIT_NOFILE leaves after FD_RESERVE
+
+    Every reporting PC writes to one segment at a time, so this caps the
+    fleet size written without reopening files (serve.py raises the soft
+    limit to the hard one at startup).
+    """
+    if resource is None:
+        return MIN_OPEN_FILES
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return 65536
+    return max(MIN_OPEN_FILES, soft - FD_RESERVE)
+
+
+def host_dirname(pc_name):
+    """Directory name for ``pc_name``: quoted, never empty, ``.`` or ``..``"""
+    if not pc_name:
+        raise ValueError('pc_name must not be empty')
+    name = quote(pc_name, safe='')
+    if name.startswith('.'):
+        name = '%2E' + name[1:]
+    return name
+
+
+class SegmentStore:
+    """Append-only, time-partitioned segment files for every PC
+
+    ``owns`` (pc_name -> bool) narrows ``hosts()`` and retention to some
+    PCs, for shards of a sharded server sharing one ``root``.
+    ``max_open_files`` bounds the LRU of open segment writers (default:
+    sized from the descriptor limit, see default_max_open_files). With
+    more PCs reporting than that, appends close and reopen files.
+    """
+
+    def __init__(self, root, segment_seconds=DEFAULT_SEGMENT_SECONDS,
+                 retention_seconds=DEFAULT_RETENTION_SECONDS, max_open_files=None, owns=None):
+        self.root = root
+        self.owns = owns
+        self.segment_seconds = segment_seconds
+        self.retention_seconds = retention_seconds
+        self.max_open_files = max_open_files or default_max_open_files()
+        self.reopened = 0  # Writers closed to stay under max_open_files
+        self.ncols = 1 + len(NUMERIC_FIELDS)
+        self.record = struct.Struct('<%dd' % self.ncols)
+        self._writers = OrderedDict()  # (pc_name, segment start) -> file, LRU order
+        self._static = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _host_dir(self, pc_name):
+        return os.path.join(self.root, host_dirname(pc_name))
+
+    def _segment_start(self, timestamp):
+        return int(timestamp // self.segment_seconds) * self.segment_seconds
+
+    def _segment_path(self, pc_name, start):
+        return os.path.join(self._host_dir(pc_name), f'{start}{SEGMENT_SUFFIX}')
+
+    def _segments(self, pc_name):
+        """Sorted segment start times on disk for ``pc_name``"""
+        try:
+            names = os.listdir(self._host_dir(pc_name))
+        except FileNotFoundError:
+            return []
+        starts = []
+        for name in names:
+            if name.endswith(SEGMENT_SUFFIX):
+                try:
+                    starts.append(int(name[:-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+        starts.sort()
+        return starts
+
+    def has_host(self, pc_name):
+        return os.path.isdir(self._host_dir(pc_name))
+
+    def hosts(self):
+        """Names of all PCs (that this store owns) with data on disk"""
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        hosts = [unquote(name) for name in names
+                 if os.path.isdir(os.path.join(self.root, name))]
+        if self.owns is not None:
+            hosts = [pc_name for pc_name in hosts if self.owns(pc_name)]
+        return hosts
+
+    def _writer(self, pc_name, start):
+        key = (pc_name, start)
+        f = self._writers.get(key)
+        if f is not None:
+            self._writers.move_to_end(key)
+            return f
+
+        os.makedirs(self._host_dir(pc_name), exist_ok=True)
+        path = self._segment_path(pc_name, start)
+        # Unbuffered, so every record reaches the OS in a single write()
+        f = open(path, 'ab', buffering=0)
+        if f.tell() == 0:
+            f.write(HEADER.pack(MAGIC, self.ncols))
+        self._writers[key] = f
+        while len(self._writers) > self.max_open_files:
+            _, old = self._writers.popitem(last=False)
+            old.close()
+            if not self.reopened:
+                logger.warning("More PCs reporting than max_open_files (%d); segment files are now "
+                               "reopened per write. Raise --max-open-files (and ulimit -n)",
+                               self.max_open_files)
+            self.reopened += 1
+        return f
+
+    def _update_static(self, pc_name, values):
+        static = self._static.get(pc_name)
+        if static is None:
+            static = self._static[pc_name] = self._load_static(pc_name)
+        changed = False
+        for field, value in values.items():
+            if static.get(field) != value:
+                static[field] = value
+                changed = True
+        if changed:
+            path = os.path.join(self._host_dir(pc_name), STATIC_FILE)
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(static, f)
+            os.replace(path + '.tmp', path)
+
+    def append(self, pc_name, timestamp, sample):
+        """Persist one sample; ``timestamp`` is epoch seconds"""
+        self.extend([(pc_name, timestamp, sample_values(sample), sample_static(sample))])
+
+    def extend(self, entries):
+        """Persist many decoded ``(pc_name, timestamp, values, static)`` entries"""
+        pack = self.record.pack
+        with self._lock:
+            for pc_name, timestamp, values, static in entries:
+                f = self._writer(pc_name, self._segment_start(timestamp))
+                f.write(pack(timestamp, *values))
+                if static:
+                    self._update_static(pc_name, static)
+
+    def close(self):
+        with self._lock:
+            for f in self._writers.values():
+                f.close()
+            self._writers.clear()
+
+    def _load_static(self, pc_name):
+        path = os.path.join(self._host_dir(pc_name), STATIC_FILE)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def static(self, pc_name):
+        """Static strings (e.g. os_info) last reported by ``pc_name``"""
+        static = self._static.get(pc_name)
+        if static is None:
+            static = self._load_static(pc_name)
+        return dict(static)
+
+    def _read_segment(self, path, start=None, end=None):
+        """Decode records with start <= timestamp < end from one segment"""
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return []
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= HEADER.size:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, ncols = HEADER.unpack_from(mm, 0)
+                if magic != MAGIC:
+                    return []
+                record_size = 8 * ncols
+                count = (size - HEADER.size) // record_size  # Ignore a torn tail
+                rows = []
+                if NATIVE_LITTLE_ENDIAN:
+                    # Zero-copy view of the records as float64
+                    with memoryview(mm) as raw:
+                        with raw[HEADER.size:HEADER.size + count * record_size].cast('d') as values:
+                            for i, ts in enumerate(values[::ncols]):
+                                if (start is None or ts >= start) and (end is None or ts < end):
+                                    rows.append((ts, values[i * ncols + 1:(i + 1) * ncols].tolist()))
+                else:
+                    record = struct.Struct('<%dd' % ncols)
+                    for i in range(count):
+                        offset = HEADER.size + i * record_size
+                        ts = struct.unpack_from('<d', mm, offset)[0]
+                        if (start is None or ts >= start) and (end is None or ts < end):
+                            rows.append((ts, list(record.unpack_from(mm, offset)[1:])))
+                return rows
+
+    def _pad(self, values):
+        # Segments written before a field was added have fewer columns
+        missing = len(NUMERIC_FIELDS) - len(values)
+        if missing > 0:
+            values.extend([float('nan')] * missing)
+        return values[:len(NUMERIC_FIELDS)]
+
+    def read_range(self, pc_name, start=None, end=None):
+        """Records for ``pc_name`` with start <= timestamp < end, oldest first
+
+        Returns a list of ``(timestamp, values)`` with values in
+        NUMERIC_FIELDS order. Only segments overlapping the window are
+        opened.
+        """
+        rows = []
+        for records in self.iter_range(pc_name, start, end):
+            rows.extend(records)
+        return rows
+
+    def iter_range(self, pc_name, start=None, end=None):
+        """Like ``read_range``, but one segment's records at a time (for exports)"""
+        for seg_start in self._segments(pc_name):
+            if end is not None and seg_start >= end:
+                break
+            if start is not None and seg_start + self.segment_seconds <= start:
+                continue
+            rows = self._read_segment(self._segment_path(pc_name, seg_start), start, end)
+            if not rows:
+                continue
+            # Late (journal-replayed) samples can land out of order within a
+            # segment; segments themselves never overlap
+            rows.sort(key=lambda row: row[0])
+            yield [(ts, self._pad(values)) for ts, values in rows]
+
+    def read_recent(self, pc_name, count):
+        """The newest ``count`` records for ``pc_name``, oldest first"""
+        rows = []
+        for seg_start in reversed(self._segments(pc_name)):
+            rows.extend(self._read_segment(self._segment_path(pc_name, seg_start)))
+            if len(rows) >= count:
+                break
+        rows.sort(key=lambda row: row[0])
+        return [(ts, self._pad(values)) for ts, values in rows[-count:]]
+
+    def _expired(self, cutoff):
+        """``(pc_name, segment start)`` of every segment that ends before ``cutoff``"""
+        expired = []
+        for pc_name in self.hosts():
+            for seg_start in self._segments(pc_name):
+                if seg_start + self.segment_seconds > cutoff:
+                    break
+                expired.append((pc_name, seg_start))
+        return expired
+
+    def _remove(self, segments):
+        removed = 0
+        for pc_name, seg_start in segments:
+            try:
+                os.remove(self._segment_path(pc_name, seg_start))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def enforce_retention(self, now=None, offload=None):
+        """Delete whole segments older than the retention window
+
+        ``offload(func, *args)`` runs the directory scan and the deletes
+        (see snapshot.write); the store's lock is only taken in the caller.
+        """
+        offload = offload or _call
+        now = time.time() if now is None else now
+        expired = offload(self._expired, now - self.retention_seconds)
+        removed = 0
+        for i in range(0, len(expired), REMOVE_BATCH):
+            batch = expired[i:i + REMOVE_BATCH]
+            with self._lock:
+                for key in batch:
+                    f = self._writers.pop(key, None)
+                    if f is not None:
+                        f.close()
+            removed += offload(self._remove, batch)
+        return removed
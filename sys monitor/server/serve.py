@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Production launcher for the System Monitor server.
+
+Unlike ``python app.py`` this runs with debug and the reloader off, logs
+through ``logging`` (plain or JSON lines), and serves with an async worker
+model:
+
+    python serve.py --worker eventlet      # pip install eventlet
+    python serve.py --worker gevent        # pip install gevent gevent-websocket
+    python serve.py --worker threading     # no extra dependency (Werkzeug)
+    python serve.py --shards 8             # 8 processes, hosts hashed across them
+
+The worker library is monkey-patched before the app is imported, which is
+why this is a separate entry point.
+
+With ``--shards N`` this process starts N shard servers (this same script,
+on ports --port+1 ... --port+N, each told its slice through SYSMON_SHARD),
+restarts any that exit, and serves the front dispatcher (dispatcher.py)
+on --port.
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from sharding import SHARD_ENV
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per log line"""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if os.environ.get(SHARD_ENV):
+            entry['shard'] = os.environ[SHARD_ENV]
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def configure_logging(level, fmt):
+    handler = logging.StreamHandler(sys.stdout)
+    if fmt == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        shard = f'[shard {os.environ[SHARD_ENV]}] ' if os.environ.get(SHARD_ENV) else ''
+        handler.setFormatter(logging.Formatter(f'%(asctime)s %(levelname)s {shard}%(name)s: %(message)s'))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
+    # Per-request access lines are noise at fleet scale
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    logging.getLogger('engineio').setLevel(logging.WARNING)
+    logging.getLogger('socketio').setLevel(logging.WARNING)
+
+
+WORKER_PACKAGES = {'eventlet': 'eventlet', 'gevent': 'gevent gevent-websocket'}
+
+
+def patch_worker(worker):
+    """Monkey-patch the standard library for the chosen green-thread library
+
+    Returns the worker actually used: ``threading`` when the library is
+    not installed.
+    """
+    try:
+        if worker == 'eventlet':
+            import eventlet
+            eventlet.monkey_patch()
+        elif worker == 'gevent':
+            from gevent import monkey
+            monkey.patch_all()
+    except ImportError:
+        print(f"⚠️  {worker} is not installed (pip install {WORKER_PACKAGES[worker]}); "
+              f"falling back to the threading worker", file=sys.stderr)
+        return 'threading'
+    return worker
+
+
+def raise_fd_limit():
+    """Raise the soft descriptor limit to the hard one; returns the new soft limit
+
+    Each reporting PC keeps a segment file open, so the default soft
+    limit (often 1024) would cap the fleet written without reopening files.
+    """
+    if resource is None:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass  # e.g. macOS rejects RLIM_INFINITY; keep the soft limit
+    return soft
+
+
+def shard_command(args, port):
+    return [sys.executable, os.path.abspath(__file__), '--host', args.host, '--port', str(port),
+            '--worker', args.worker, '--log-level', args.log_level, '--log-format', args.log_format]
+
+
+def supervise(args, ports, logger):
+    """Start one shard server per port and restart any that exits
+
+    Returns a function that stops them all.
+    """
+    stopping = threading.Event()
+    processes = [None] * len(ports)
+
+    def start(index):
+        env = dict(os.environ, **{SHARD_ENV: f'{index}/{len(ports)}'})
+        processes[index] = subprocess.Popen(shard_command(args, ports[index]), env=env)
+
+    def watch():
+        while not stopping.wait(1.0):
+            for index, process in enumerate(processes):
+                if process.poll() is not None:
+                    logger.warning("Shard %d exited with %s; restarting", index, process.returncode)
+                    start(index)
+
+    def stop():
+        stopping.set()
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    for index in range(len(ports)):
+        start(index)
+    threading.Thread(target=watch, daemon=True, name='shard-supervisor').start()
+    return stop
+
+
+def serve_front(front, host, port, worker):
+    """Serve the (plain WSGI) dispatcher with the chosen worker library"""
+    if worker == 'eventlet':
+        import eventlet
+        import eventlet.wsgi
+        eventlet.wsgi.server(eventlet.listen((host, port)), front, log_output=False)
+    elif worker == 'gevent':
+        from gevent.pywsgi import WSGIServer
+        WSGIServer((host, port), front, log=None).serve_forever()
+    else:
+        from werkzeug.serving import run_simple
+        run_simple(host, port, front, threaded=True)
+
+
+def run_sharded(args):
+    """Shard servers plus the front dispatcher on args.port"""
+    logger = logging.getLogger('sysmon.server')
+    base = args.shard_base_port or args.port + 1
+    ports = [base + index for index in range(args.shards)]
+    # The front reaches the shards over loopback when they listen everywhere
+    internal = '127.0.0.1' if args.host in ('0.0.0.0', '::', '') else args.host
+    stop = supervise(args, ports, logger)
+    # SIGTERM must stop the shards too, not orphan them
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    from dispatcher import create_app
+    front = create_app([f'http://{internal}:{port}' for port in ports], ports, args.advertise_host)
+    logger.info("Front dispatcher on %s:%d, %d shards on ports %d-%d",
+                args.host, args.port, args.shards, ports[0], ports[-1])
+    try:
+        serve_front(front, args.host, args.port, args.worker)
+    finally:
+        stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='System Monitor Server (production mode)')
+    parser.add_argument('--host', default='0.0.0.0', help='Bind address (default: 0.0.0.0)')
+    parser.add_argument('--port', type=int, default=5000, help='Port (default: 5000)')
+    parser.add_argument('--worker', choices=['eventlet', 'gevent', 'threading'], default='eventlet',
+                        help='Async worker model (default: eventlet)')
+    parser.add_argument('--log-level', default='info',
+                        choices=['debug', 'info', 'warning', 'error'],
+                        help='Log level (default: info)')
+    parser.add_argument('--log-format', choices=['text', 'json'], default='text',
+                        help='Log line format (default: text)')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='Server processes, each owning a hash slice of the PCs, behind a '
+                             'front dispatcher on --port (default: 1, a single process)')
+    parser.add_argument('--shard-base-port', type=int, default=None,
+                        help='Port of the first shard (default: --port + 1)')
+    parser.add_argument('--advertise-host', default=None,
+                        help='Host name agents and browsers use to reach the shard ports '
+                             '(default: the one they reached the front with)')
+    parser.add_argument('--max-open-files', type=int, default=None,
+                        help='Segment files kept open for appends, about one per reporting PC '
+                             '(default: the descriptor limit less 512, after raising it to the hard limit)')
+    args = parser.parse_args()
+
+    args.worker = patch_worker(args.worker)
+    os.environ['SYSMON_ASYNC_MODE'] = args.worker
+    os.environ['SYSMON_DEBUG'] = '0'
+    raise_fd_limit()
+    if args.max_open_files:
+        os.environ['SYSMON_MAX_OPEN_FILES'] = str(args.max_open_files)  # Inherited by shards
+    configure_logging(args.log_level, args.log_format)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    if args.shards > 1 and not os.environ.get(SHARD_ENV):
+        run_sharded(args)
+        return
+    import app as server
+
+    logger = logging.getLogger('sysmon.server')
+    # Exit through atexit on SIGTERM (deploys, the shard supervisor) so the
+    # final snapshot is written
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    server.start_background_tasks()
+    logger.info("Serving on %s:%d with %s workers", args.host, args.port, args.worker)
+
+    options = {}
+    if args.worker == 'threading':
+        logger.warning("threading worker uses Werkzeug; prefer eventlet or gevent for large fleets")
+        options['allow_unsafe_werkzeug'] = True
+    server.socketio.run(server.app, host=args.host, port=args.port, debug=False,
+                        use_reloader=False, log_output=False, **options)
+
+
+if __name__ == '__main__':
+    main()
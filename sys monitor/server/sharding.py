@@ -0,0 +1,72 @@
+"""
+Host-to-shard routing for the sharded server (``serve.py --shards N``).
+
+Every PC belongs to exactly one of N shard processes, picked by a jump
+consistent hash of its ``pc_name``: all of a PC's state (buffers, rollups,
+alert and anomaly state, labels) lives in one process, and changing N
+moves only about 1/N of the PCs. The front dispatcher (dispatcher.py)
+and the shards compute the same function, so any of them can tell where
+a PC belongs without asking.
+
+A shard learns its place from ``SYSMON_SHARD=<index>/<count>``; without
+it the server is the single shard ``0/1`` and owns every PC.
+
+Binary ingest carries a ``host_id`` instead of the name. Shards hand out
+host ids in strides of N (shard i gives out i+1, i+1+N, ...), so a frame
+names its shard as ``(host_id - 1) % N``.
+"""
+
+import hashlib
+import os
+from functools import lru_cache
+
+SHARD_ENV = 'SYSMON_SHARD'
+SHARD_HEADER = 'X-Sysmon-Host'  # Lets the front route a body without parsing it
+
+_JUMP_MULTIPLIER = 2862933555777941757
+_MASK64 = (1 << 64) - 1
+
+
+def jump_hash(key, buckets):
+    """Jump consistent hash (Lamping & Veach) of a 64-bit key into [0, buckets)"""
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * _JUMP_MULTIPLIER + 1) & _MASK64
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+@lru_cache(maxsize=65536)
+def shard_for(pc_name, shards):
+    """Index of the shard that owns ``pc_name``"""
+    if shards <= 1:
+        return 0
+    digest = hashlib.blake2b(pc_name.encode('utf-8'), digest_size=8).digest()
+    return jump_hash(int.from_bytes(digest, 'little'), shards)
+
+
+def shard_for_host_id(host_id, shards):
+    """Index of the shard that handed out a binary ``host_id``"""
+    return (host_id - 1) % shards if shards > 1 else 0
+
+
+def parse_shard(value):
+    """``'<index>/<count>'`` to ``(index, count)``; empty means ``(0, 1)``
+
+    Raises ValueError for anything else.
+    """
+    if not value:
+        return 0, 1
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError(f'{SHARD_ENV} must look like 2/8, not {value!r}')
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f'{SHARD_ENV}: shard {index} does not exist out of {count}')
+    return index, count
+
+
+def current_shard():
+    """``(index, count)`` of this process, from the environment"""
+    return parse_shard(os.environ.get(SHARD_ENV, ''))
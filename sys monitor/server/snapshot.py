@@ -0,0 +1,158 @@
+"""
+Binary snapshots of the in-memory metrics for a fast warm restart.
+
+Reloading every PC's recent history from the segment files means decoding
+(and re-aggregating) each record in Python, which takes minutes for a
+large fleet. A snapshot instead stores each PC's buffered columns exactly
+as they sit in memory, so loading is one ``frombytes`` per column.
+
+Layout (native byte order, recorded in the metadata)::
+
+    MAGIC
+    per PC: timestamps, then every field of ``fields``, ``size`` float64 each
+    metadata (JSON): fields, byte order, time taken, and per PC its
+                     pc_name, offset, size, seq, static strings, labels
+                     and last_seen
+    TRAILER: metadata offset, metadata length, MAGIC
+
+Columns are written first and the metadata last, so a snapshot streams
+to disk a few PCs at a time. It is written to a temporary file, fsynced
+and renamed over ``path``; a crash mid-write leaves the previous snapshot.
+
+The file calls block. Under eventlet or gevent a caller passes ``offload``
+to run them in a real OS thread, so the event loop (ingest, Socket.IO)
+keeps running while the disk works.
+"""
+
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+import codec
+from metrics_store import NUMERIC_FIELDS
+
+MAGIC = b'SMSNAP01'
+TRAILER = struct.Struct('<QQ8s')  # metadata offset, metadata length, magic
+CLEAN_SUFFIX = '.clean'
+WRITE_BATCH = 64  # PCs whose columns are handed to one blocking write
+
+
+def _call(func, *args):
+    return func(*args)
+
+
+def _write_columns(f, batch):
+    for columns in batch:
+        for column in columns:
+            column.tofile(f)
+
+
+def _finish(f, tmp, path, meta, offset):
+    try:
+        f.write(meta)
+        f.write(TRAILER.pack(offset, len(meta), MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    os.replace(tmp, path)
+
+
+def write(path, hosts, taken_at=None, offload=None):
+    """Write ``(info dict, columns)`` pairs atomically to ``path``
+
+    ``columns`` are arrays of float64: timestamps, then NUMERIC_FIELDS,
+    oldest sample first (``MetricsStore.export``). ``offload(func, *args)``
+    runs the blocking file calls; by default they run in the caller.
+    Returns the PC count.
+    """
+    offload = offload or _call
+    taken_at = time.time() if taken_at is None else taken_at
+    entries = []
+    tmp = f'{path}.{os.getpid()}.tmp'  # The dev reloader runs two servers
+    f = offload(open, tmp, 'wb')
+    try:
+        offload(f.write, MAGIC)
+        position = len(MAGIC)
+        batch = []
+        for info, columns in hosts:
+            entries.append(dict(info, offset=position, size=len(columns[0])))
+            position += 8 * len(columns[0]) * len(columns)
+            batch.append(columns)
+            if len(batch) >= WRITE_BATCH:
+                offload(_write_columns, f, batch)
+                batch = []
+        if batch:
+            offload(_write_columns, f, batch)
+        meta = codec.dumps({
+            'fields': list(NUMERIC_FIELDS),
+            'byteorder': sys.byteorder,
+            'taken_at': taken_at,
+            'hosts': entries,
+        })
+    except BaseException:
+        f.close()
+        raise
+    offload(_finish, f, tmp, path, meta, position)
+    return len(entries)
+
+
+def _column(view, offset, size):
+    column = array('d')
+    column.frombytes(view[offset:offset + 8 * size])
+    return column
+
+
+def load(path):
+    """``(metadata, [(info, columns)])`` from a snapshot, or None if there is none
+
+    Columns come back in NUMERIC_FIELDS order even when the snapshot was
+    taken with other fields (missing ones are NaN). Raises ValueError for
+    a damaged snapshot or one from a machine of the other byte order.
+    """
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        if size < len(MAGIC) + TRAILER.size:
+            raise ValueError('snapshot is truncated')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            offset, length, magic = TRAILER.unpack_from(mm, size - TRAILER.size)
+            if mm[:len(MAGIC)] != MAGIC or magic != MAGIC or offset + length > size - TRAILER.size:
+                raise ValueError('not a snapshot, or truncated')
+            meta = codec.loads(mm[offset:offset + length])
+            if meta['byteorder'] != sys.byteorder:
+                raise ValueError(f"snapshot is {meta['byteorder']}-endian")
+            fields = meta['fields']
+            positions = [fields.index(field) + 1 if field in fields else None
+                         for field in NUMERIC_FIELDS]
+            hosts = []
+            for info in meta.pop('hosts'):
+                start, count = info['offset'], info['size']
+                if start + 8 * count * (1 + len(fields)) > offset:
+                    raise ValueError(f"snapshot entry of {info['pc_name']} is out of bounds")
+                stored = [_column(view, start + 8 * count * i, count) for i in range(1 + len(fields))]
+                columns = [stored[0]] + [stored[i] if i is not None else array('d', [float('nan')]) * count
+                                         for i in positions]
+                hosts.append((info, columns))
+    return meta, hosts
+
+
+def mark_clean(path):
+    """Record that ``path`` was written at shutdown, after the last sample"""
+    with open(path + CLEAN_SUFFIX, 'w'):
+        pass
+
+
+def take_clean_mark(path):
+    """Whether the snapshot was written at shutdown; clears the mark"""
+    try:
+        os.remove(path + CLEAN_SUFFIX)
+        return True
+    except FileNotFoundError:
+        return False
@@ -0,0 +1,267 @@
+"""
+Compact binary ingest formats, negotiated per request by Content-Type.
+
+A JSON sample repeats every key plus ``pc_name`` and ``os_info`` each
+time. Instead an agent can register once at ``POST /api/agents/hello``
+with its static attributes and the order of the fields it will send, and
+gets back a ``host_id`` and a ``schema_id``. Later samples only carry
+numbers:
+
+``application/x-sysmon-frame`` (always available)::
+
+    header  <2sBBIHH   magic b'SM', version 1, flags, host_id,
+                       schema_id, record count
+    record  <d + n*d   epoch timestamp, then the n schema fields as
+                       float64 (NaN = missing)
+    detail  <I + JSON  only with flags & FLAG_DETAIL: byte length, then
+                       {"timestamp": epoch, "top_cpu": [...], ...}
+
+``application/x-msgpack`` (when the ``msgpack`` package is installed)::
+
+    [host_id, schema_id, [[timestamp, v1, ..., vn], ...]]
+    [host_id, schema_id, records, detail]
+
+A schema may mix NUMERIC_FIELDS with the flattened extended series of
+extended_store.py (``cpu_core.0``, ``net.eth0.rx_mb_s``, ...). Decoding
+yields the ``(pc_name, epoch, values, static)`` entries the stores take
+plus, when the schema or body has any, the parallel extended
+``(scalars, detail)`` pairs. Registrations live in memory; after a server
+restart an unknown ``host_id`` is answered with 409 and the agent says
+hello again.
+"""
+
+import math
+import struct
+import threading
+
+import codec
+from extended_store import is_extended_key, sample_detail
+from metrics_store import NAN, NUMERIC_FIELDS, STATIC_FIELDS
+
+try:
+    import msgpack
+except ImportError:  # MessagePack is optional; frames need only struct
+    msgpack = None
+
+FRAME_MIMETYPE = 'application/x-sysmon-frame'
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+BINARY_MIMETYPES = frozenset([FRAME_MIMETYPE, MSGPACK_MIMETYPE])
+
+FRAME_MAGIC = b'SM'
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct('<2sBBIHH')
+FRAME_DETAIL_LENGTH = struct.Struct('<I')
+FLAG_DETAIL = 0x01  # A detail trailer follows the records
+MAX_FIELDS = 256
+
+
+class WireError(ValueError):
+    """Malformed binary body"""
+
+
+class UnknownHost(WireError):
+    """host_id or schema_id was not registered (e.g. the server restarted)"""
+
+
+def formats():
+    """Ingest Content-Types this server accepts"""
+    found = ['application/json', FRAME_MIMETYPE]
+    if msgpack is not None:
+        found.append(MSGPACK_MIMETYPE)
+    return found
+
+
+class WireRegistry:
+    """Host and schema ids handed out by the hello handshake
+
+    Host ids are ``offset + 1``, ``offset + 1 + stride``, ...; a sharded
+    server gives each shard its own offset (see sharding.py).
+    """
+
+    def __init__(self, offset=0, stride=1):
+        self.offset = offset
+        self.stride = stride
+        self._lock = threading.Lock()
+        self._schema_ids = {}  # field tuple -> schema_id
+        self._schemas = {}     # schema_id -> (fields, record struct, NUMERIC_FIELDS slots, extended)
+        self._host_ids = {}    # pc_name -> host_id
+        self._hosts = {}       # host_id -> (pc_name, static)
+        self._issued = 0       # Host ids handed out so far (never reused)
+
+    def register(self, pc_name, static, fields=NUMERIC_FIELDS):
+        """Register a host and its field order; return (host_id, schema_id)"""
+        fields = tuple(fields)
+        if not fields or len(fields) > MAX_FIELDS:
+            raise WireError(f'A schema needs 1 to {MAX_FIELDS} fields')
+        unknown = [str(field) for field in fields
+                   if field not in NUMERIC_FIELDS and not is_extended_key(field)]
+        if unknown:
+            raise WireError(f"Unknown fields: {', '.join(unknown)}")
+        if len(set(fields)) != len(fields):
+            raise WireError('Duplicate fields in schema')
+        static = {field: str(static[field]) for field in STATIC_FIELDS
+                  if static.get(field) is not None}
+
+        with self._lock:
+            schema_id = self._schema_ids.get(fields)
+            if schema_id is None:
+                schema_id = self._schema_ids[fields] = len(self._schemas) + 1
+                # Record position (after the timestamp) -> NUMERIC_FIELDS slot or series name
+                slots = [(i + 1, NUMERIC_FIELDS.index(field))
+                         for i, field in enumerate(fields) if field in NUMERIC_FIELDS]
+                extended = [(i + 1, field)
+                            for i, field in enumerate(fields) if field not in NUMERIC_FIELDS]
+                record = struct.Struct('<%dd' % (1 + len(fields)))
+                self._schemas[schema_id] = (fields, record, slots, extended)
+            host_id = self._host_ids.get(pc_name)
+            if host_id is None:
+                host_id = self._host_ids[pc_name] = self._issued * self.stride + self.offset + 1
+                self._issued += 1
+            self._hosts[host_id] = (pc_name, static)
+        return host_id, schema_id
+
+    def remove(self, pc_name):
+        """Forget an evicted host; its next upload gets UnknownHost and says hello again
+
+        The hello carries the agent's labels, so this is how they come back
+        after the PC was offline.
+        """
+        with self._lock:
+            host_id = self._host_ids.pop(pc_name, None)
+            if host_id is not None:
+                self._hosts.pop(host_id, None)
+
+    def _lookup(self, host_id, schema_id):
+        host = self._hosts.get(host_id)
+        schema = self._schemas.get(schema_id)
+        if host is None or schema is None:
+            raise UnknownHost(f'Unknown host_id {host_id} or schema_id {schema_id}')
+        return host, schema
+
+    def _entries(self, host, schema, records, detail=None):
+        """Decode records; return (entries, extended pairs or None)"""
+        pc_name, static = host
+        fields, _, slots, extended_slots = schema
+        direct = fields == NUMERIC_FIELDS
+        entries = []
+        extended = [] if extended_slots or detail else None
+        for record in records:
+            if len(record) != len(fields) + 1:
+                raise WireError(f'Expected {len(fields) + 1} values per record')
+            timestamp = record[0]
+            if not isinstance(timestamp, (int, float)) or not math.isfinite(timestamp):
+                raise WireError('Invalid record timestamp')
+            if direct:
+                values = [NAN if value is None else float(value) for value in record[1:]]
+            else:
+                values = [NAN] * len(NUMERIC_FIELDS)
+                for position, slot in slots:
+                    if record[position] is not None:
+                        values[slot] = float(record[position])
+            entries.append((pc_name, float(timestamp), values, static))
+            if extended is not None:
+                scalars = {}
+                for position, name in extended_slots:
+                    value = record[position]
+                    if value is not None and math.isfinite(value):
+                        scalars[name] = float(value)
+                extended.append((scalars, {}))
+
+        if detail and entries:
+            # Attach the detail to the record it was collected with (else the newest)
+            if not isinstance(detail, dict):
+                raise WireError('Detail must be an object')
+            when = detail.get('timestamp')
+            index = len(entries) - 1
+            for i, entry in enumerate(entries):
+                if entry[1] == when:
+                    index = i
+            extended[index] = (extended[index][0], sample_detail(detail))
+        return entries, extended
+
+    def decode_frame(self, body):
+        """Decode an ``application/x-sysmon-frame`` body"""
+        if len(body) < FRAME_HEADER.size:
+            raise WireError('Frame too short')
+        magic, version, flags, host_id, schema_id, count = FRAME_HEADER.unpack_from(body)
+        if magic != FRAME_MAGIC or version != FRAME_VERSION:
+            raise WireError('Not a version 1 sysmon frame')
+        host, schema = self._lookup(host_id, schema_id)
+        record = schema[1]
+        payload = memoryview(body)[FRAME_HEADER.size:]
+        size = count * record.size
+        detail = None
+        if flags & FLAG_DETAIL:
+            if len(payload) < size + FRAME_DETAIL_LENGTH.size:
+                raise WireError('Frame too short for its detail trailer')
+            (length,) = FRAME_DETAIL_LENGTH.unpack_from(payload, size)
+            trailer = payload[size + FRAME_DETAIL_LENGTH.size:]
+            if len(trailer) != length:
+                raise WireError(f'Detail trailer declares {length} bytes but carries {len(trailer)}')
+            try:
+                detail = codec.loads(bytes(trailer))
+            except ValueError as e:
+                raise WireError(f'Invalid detail trailer: {e}')
+            payload = payload[:size]
+        if len(payload) != size:
+            raise WireError(f'Frame declares {count} records but carries {len(payload)} bytes')
+        return self._entries(host, schema, record.iter_unpack(payload), detail)
+
+    def decode_msgpack(self, body):
+        """Decode an ``application/x-msgpack`` body"""
+        if msgpack is None:
+            raise WireError('msgpack is not installed on the server')
+        try:
+            message = msgpack.unpackb(body, raw=False)
+        except Exception as e:
+            raise WireError(f'Invalid MessagePack: {e}')
+        if not (isinstance(message, (list, tuple)) and len(message) in (3, 4)
+                and isinstance(message[2], (list, tuple))):
+            raise WireError('Expected [host_id, schema_id, records(, detail)]')
+        try:
+            host, schema = self._lookup(message[0], message[1])
+            detail = message[3] if len(message) == 4 else None
+            return self._entries(host, schema, message[2], detail)
+        except WireError:
+            raise
+        except (TypeError, ValueError) as e:
+            raise WireError(str(e))
+
+    def decode(self, mimetype, body):
+        """Decode a binary body into ``(entries, extended)``
+
+        ``extended`` is None, or a list of ``(scalars, detail)`` parallel
+        to ``entries``.
+        """
+        if mimetype == FRAME_MIMETYPE:
+            return self.decode_frame(body)
+        return self.decode_msgpack(body)
+
+
+def peek_host_id(mimetype, body):
+    """The ``host_id`` a binary body was sent under, without decoding its records"""
+    if mimetype == FRAME_MIMETYPE:
+        if len(body) < FRAME_HEADER.size:
+            raise WireError('Frame too short')
+        return FRAME_HEADER.unpack_from(body)[3]
+    if msgpack is None:
+        raise WireError('msgpack is not installed on the server')
+    try:
+        message = msgpack.unpackb(body, raw=False)
+        return int(message[0])
+    except Exception as e:
+        raise WireError(f'Invalid MessagePack: {e}')
+
+
+def encode_frame(host_id, schema_id, records, detail=None):
+    """Pack ``(timestamp, v1, ..., vn)`` records (and a detail dict) into one frame body"""
+    flags = FLAG_DETAIL if detail else 0
+    parts = [FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, flags, host_id, schema_id, len(records))]
+    if records:
+        record = struct.Struct('<%dd' % len(records[0]))
+        parts.extend(record.pack(*values) for values in records)
+    if detail:
+        trailer = codec.dumps(detail)
+        parts.append(FRAME_DETAIL_LENGTH.pack(len(trailer)))
+        parts.append(trailer)
+    return b''.join(parts)
@@ -0,0 +1,6 @@
+"""Unit tests import the server modules directly, as the benchmarks do"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
@@ -0,0 +1,138 @@
+"""Alert rules: expression parsing, rules files, firing and resolving"""
+
+import json
+import math
+
+import pytest
+
+from alerts import DEFAULT_RATE_WINDOW, FIRING, RESOLVED, AlertEngine, Rule, load_rules, parse_duration
+from metrics_store import NUMERIC_FIELDS
+
+
+def sample(timestamp, pc_name='pc-1', **values):
+    row = [math.nan] * len(NUMERIC_FIELDS)
+    for field, value in values.items():
+        row[NUMERIC_FIELDS.index(field)] = value
+    return (pc_name, timestamp, row, {})
+
+
+@pytest.mark.parametrize('value, seconds', [('90', 90.0), ('30s', 30.0), ('2m', 120.0), ('1.5h', 5400.0)])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == seconds
+
+
+def test_threshold_rule():
+    rule = Rule('cpu_high', 'cpu_percent > 90 for 2m')
+    assert (rule.field, rule.op, rule.threshold, rule.hold) == ('cpu_percent', '>', 90.0, 120.0)
+    assert rule.slot == NUMERIC_FIELDS.index('cpu_percent')
+    assert not rule.rate
+    assert rule.over == DEFAULT_RATE_WINDOW
+
+
+def test_rate_rule_with_window():
+    rule = Rule('disk_filling', 'rate(disk_used_gb) > 0.01 over 10m for 5m', 'critical')
+    assert rule.rate
+    assert rule.field == 'disk_used_gb'
+    assert (rule.over, rule.hold, rule.severity) == (600.0, 300.0, 'critical')
+
+
+def test_extended_field_and_negative_threshold():
+    rule = Rule('load', 'load.1m>=-1.5')
+    assert rule.field == 'load.1m'
+    assert rule.slot is None
+    assert (rule.op, rule.threshold) == ('>=', -1.5)
+
+
+@pytest.mark.parametrize('expr', [
+    None,
+    '',
+    'cpu_percent',
+    'cpu_percent > ',
+    'cpu_percent => 90',
+    'cpu_percent > high',
+    'cpu_percent > 90 for',
+    'cpu_percent > 90 for 2d',
+    'rate(cpu_percent > 90',
+])
+def test_malformed_expressions_are_rejected(expr):
+    with pytest.raises(ValueError, match='Cannot parse'):
+        Rule('bad', expr)
+
+
+def test_over_needs_rate():
+    with pytest.raises(ValueError, match='over'):
+        Rule('bad', 'cpu_percent > 90 over 5m')
+
+
+def test_load_rules(tmp_path):
+    path = tmp_path / 'rules.json'
+    path.write_text(json.dumps({
+        'rules': [{'name': 'cpu_high', 'expr': 'cpu_percent > 90'}, {'expr': 'disk_percent >= 95'}],
+        'webhook': 'http://127.0.0.1:9000/alerts',
+    }))
+    rules, webhook = load_rules(path)
+    assert [rule.name for rule in rules] == ['cpu_high', 'rule2']
+    assert rules[0].severity == 'warning'
+    assert webhook == 'http://127.0.0.1:9000/alerts'
+
+
+def test_load_rules_missing_file(tmp_path):
+    assert load_rules(tmp_path / 'missing.json') == ([], None)
+
+
+def test_load_rules_duplicate_name(tmp_path):
+    path = tmp_path / 'rules.json'
+    path.write_text(json.dumps({'rules': [{'name': 'a', 'expr': 'cpu_percent > 1'},
+                                          {'name': 'a', 'expr': 'cpu_percent > 2'}]}))
+    with pytest.raises(ValueError, match='Duplicate'):
+        load_rules(path)
+
+
+def test_hold_delays_firing_until_resolved():
+    engine = AlertEngine([Rule('cpu_high', 'cpu_percent > 90 for 2m')])
+    assert engine.evaluate([sample(0, cpu_percent=95)]) == []
+    assert engine.evaluate([sample(60, cpu_percent=95)]) == []
+    events = engine.evaluate([sample(120, cpu_percent=95)])
+    assert [(event['rule'], event['state']) for event in events] == [('cpu_high', FIRING)]
+    assert len(engine.firing()) == 1
+
+    events = engine.evaluate([sample(180, cpu_percent=50)])
+    assert [event['state'] for event in events] == [RESOLVED]
+    assert engine.firing() == []
+
+
+def test_dip_resets_the_hold():
+    engine = AlertEngine([Rule('cpu_high', 'cpu_percent > 90 for 2m')])
+    engine.evaluate([sample(0, cpu_percent=95), sample(60, cpu_percent=10), sample(120, cpu_percent=95)])
+    assert engine.evaluate([sample(180, cpu_percent=95)]) == []
+    assert engine.evaluate([sample(240, cpu_percent=95)])[0]['state'] == FIRING
+
+
+def test_missing_values_and_old_samples_are_skipped():
+    engine = AlertEngine([Rule('disk_full', 'disk_percent >= 95')])
+    assert engine.evaluate([sample(10, cpu_percent=99)]) == []
+    assert engine.evaluate([sample(20, disk_percent=99)])[0]['state'] == FIRING
+    # A replayed older sample does not resolve the alert
+    assert engine.evaluate([sample(15, disk_percent=10)]) == []
+
+
+def test_rate_rule_fires_on_growth():
+    engine = AlertEngine([Rule('filling', 'rate(disk_used_gb) > 0.5 over 10s')])
+    assert engine.evaluate([sample(0, disk_used_gb=100.0)]) == []
+    events = engine.evaluate([sample(10, disk_used_gb=110.0)])
+    assert events[0]['state'] == FIRING
+    assert events[0]['value'] == 1.0
+
+
+def test_extended_series():
+    engine = AlertEngine([Rule('load', 'load.1m > 4')])
+    events = engine.evaluate([sample(0)], [({'load.1m': 8.0}, None)])
+    assert events[0]['state'] == FIRING
+
+
+def test_remove_resolves_firing_alerts():
+    engine = AlertEngine([Rule('disk_full', 'disk_percent >= 95')])
+    engine.evaluate([sample(0, disk_percent=99), sample(0, 'pc-2', disk_percent=99)])
+    events = engine.remove('pc-1')
+    assert [(event['pc_name'], event['state'], event['reason']) for event in events] == [('pc-1', RESOLVED, 'offline')]
+    assert [event['pc_name'] for event in engine.firing()] == ['pc-2']
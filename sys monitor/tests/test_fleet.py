@@ -0,0 +1,108 @@
+"""Fleet aggregates: DDSketch accuracy and merging, top-K, summaries"""
+
+import math
+import random
+
+import pytest
+
+from fleet import DDSketch, FleetAggregates, merge_partials, parse_quantiles
+from metrics_store import NUMERIC_FIELDS
+
+QUANTILES = (0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99, 0.999, 1)
+
+
+def assert_relative_error(sketch, values, alpha):
+    ordered = sorted(values)
+    for q in QUANTILES:
+        exact = ordered[math.floor(q * (len(ordered) - 1))]
+        assert sketch.quantile(q) == pytest.approx(exact, rel=alpha, abs=1e-9), q
+
+
+@pytest.mark.parametrize('alpha', [0.01, 0.05])
+def test_quantiles_within_relative_error(alpha):
+    rng = random.Random(42)
+    values = [rng.lognormvariate(3, 2) for _ in range(20000)]
+    sketch = DDSketch(alpha)
+    for value in values:
+        sketch.add(value)
+    assert sketch.count == len(values)
+    assert (sketch.min, sketch.max) == (min(values), max(values))
+    assert_relative_error(sketch, values, alpha)
+
+
+def test_negative_and_zero_values():
+    rng = random.Random(7)
+    values = [rng.uniform(-1000, 1000) for _ in range(5000)] + [0.0] * 500
+    sketch = DDSketch()
+    for value in values:
+        sketch.add(value)
+    assert_relative_error(sketch, values, 0.01)
+
+
+def test_bucket_count_grows_with_range_not_samples():
+    sketch = DDSketch()
+    for i in range(100000):
+        sketch.add(1 + i % 100)
+    # log(100) / log(gamma) is about 231 buckets
+    assert len(sketch.positive) < 250
+
+
+def test_empty_sketch():
+    assert DDSketch().quantile(0.5) is None
+
+
+def test_merge_matches_one_sketch():
+    rng = random.Random(3)
+    values = [rng.expovariate(0.1) for _ in range(10000)]
+    left, right = DDSketch(), DDSketch()
+    for i, value in enumerate(values):
+        (left if i % 3 else right).add(value)
+    merged = DDSketch.from_dict(left.to_dict())
+    merged.merge(DDSketch.from_dict(right.to_dict()))
+    assert merged.count == len(values)
+    assert_relative_error(merged, values, 0.01)
+
+
+def test_parse_quantiles():
+    assert parse_quantiles('0.5, 0.99') == (0.5, 0.99)
+    assert parse_quantiles('') == (0.5, 0.9, 0.95, 0.99)
+    with pytest.raises(ValueError):
+        parse_quantiles('1.5')
+
+
+def entry(pc_name, timestamp, cpu):
+    values = [math.nan] * len(NUMERIC_FIELDS)
+    values[NUMERIC_FIELDS.index('cpu_percent')] = cpu
+    return (pc_name, timestamp, values, {})
+
+
+def test_topk_follows_latest_values():
+    fleet = FleetAggregates()
+    fleet.update([entry(f'pc-{i}', 1000.0, float(i)) for i in range(10)])
+    fleet.update([entry('pc-0', 1005.0, 50.0)])
+    assert [row['pc_name'] for row in fleet.topk('cpu_percent', 3)] == ['pc-0', 'pc-9', 'pc-8']
+    assert [row['pc_name'] for row in fleet.topk('cpu_percent', 2, ascending=True)] == ['pc-1', 'pc-2']
+    assert [row['pc_name'] for row in fleet.topk('cpu_percent', 2, hosts=['pc-1', 'pc-2', 'pc-3'])] == ['pc-3', 'pc-2']
+
+    fleet.remove('pc-0')
+    assert fleet.topk('cpu_percent', 1)[0]['pc_name'] == 'pc-9'
+    assert len(fleet) == 9
+
+
+def test_summary_and_sharded_merge_agree():
+    now = 1_700_000_000.0
+    entries = [entry(f'pc-{i}', now + i % 30, float(i % 100)) for i in range(1000)]
+    whole, left, right = FleetAggregates(), FleetAggregates(), FleetAggregates()
+    whole.update(entries)
+    left.update(entries[::2])
+    right.update(entries[1::2])
+
+    fields = ('cpu_percent',)
+    summary = whole.summary(fields, window=300)
+    merged = merge_partials([left.partial(fields, window=300), right.partial(fields, window=300)],
+                            fields, window=300)
+    assert summary['hosts'] == merged['hosts'] == 1000
+    assert summary['current'] == merged['current']
+    assert summary['current']['cpu_percent']['mean'] == 49.5
+    assert summary['window']['fields'] == merged['window']['fields']
+    assert summary['window']['fields']['cpu_percent']['p50'] == pytest.approx(49, rel=0.01)
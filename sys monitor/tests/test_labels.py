@@ -0,0 +1,96 @@
+"""Agent labels: validation, selector parsing and matching, the inverted index"""
+
+import pytest
+
+from labels import MAX_LABELS, LabelIndex, format_selector, parse_labels, parse_selector, selector_matches
+
+HOSTS = {
+    'pc-1': {'rack': 'r1', 'role': 'db', 'gpu': 'a100'},
+    'pc-2': {'rack': 'r1', 'role': 'web'},
+    'pc-3': {'rack': 'r2', 'role': 'db'},
+    'pc-4': {'rack': 'r3'},
+    'pc-5': {},
+}
+
+
+@pytest.fixture
+def index():
+    index = LabelIndex()
+    for pc_name, labels in HOSTS.items():
+        index.set(pc_name, labels)
+    return index
+
+
+def test_parse_selector():
+    # Terms come back sorted, so equal selectors compare equal
+    assert parse_selector('spare, role!=db,!gpu,rack=r1|r2') == (
+        ('gpu', '!', frozenset()),
+        ('rack', '=', frozenset({'r1', 'r2'})),
+        ('role', '!=', frozenset({'db'})),
+        ('spare', None, frozenset()),
+    )
+
+
+def test_format_selector_is_canonical():
+    assert format_selector(parse_selector('rack=r2|r1,!gpu')) == '!gpu,rack=r1|r2'
+    assert format_selector(parse_selector(' ! gpu , rack = r1|r2 ')) == '!gpu,rack=r1|r2'
+
+
+@pytest.mark.parametrize('text', ['', ' , ', 'rack==r1', 'rack=r1 r2', '=r1', '!gpu=a100', '!',
+                                  'gpu!', 'rack!r1', '-rack=r1', 'a|b'])
+def test_malformed_selectors_are_rejected(text):
+    with pytest.raises(ValueError):
+        parse_selector(text)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('rack=r1', {'pc-1', 'pc-2'}),
+    ('rack=r1|r2', {'pc-1', 'pc-2', 'pc-3'}),
+    ('rack=r1,role=db', {'pc-1'}),
+    ('rack=r9', set()),
+    ('role!=db', {'pc-2', 'pc-4', 'pc-5'}),
+    ('role!=db|web', {'pc-4', 'pc-5'}),
+    ('rack=r1,role!=db', {'pc-2'}),
+    ('role', {'pc-1', 'pc-2', 'pc-3'}),
+    ('!role', {'pc-4', 'pc-5'}),
+    ('role=db,!gpu', {'pc-3'}),
+    ('!gpu,!role', {'pc-4', 'pc-5'}),
+    ('missing', set()),
+    ('!missing', set(HOSTS)),
+])
+def test_index_and_matching_agree(index, text, expected):
+    selector = parse_selector(text)
+    assert index.select(selector, HOSTS) == expected
+    assert {pc_name for pc_name, labels in HOSTS.items() if selector_matches(selector, labels)} == expected
+
+
+def test_select_is_limited_to_the_universe(index):
+    assert index.select(parse_selector('rack=r1'), {'pc-2', 'pc-3'}) == {'pc-2'}
+    assert index.select(parse_selector('!gpu'), {'pc-1', 'pc-2'}) == {'pc-2'}
+
+
+def test_relabel_and_remove(index):
+    index.set('pc-1', {'rack': 'r2'})
+    assert index.select(parse_selector('rack=r2'), HOSTS) == {'pc-1', 'pc-3'}
+    assert index.select(parse_selector('gpu'), HOSTS) == set()
+    index.remove('pc-3')
+    assert index.select(parse_selector('rack=r2'), HOSTS) == {'pc-1'}
+    assert index.labels('pc-3') == {}
+
+
+def test_parse_labels():
+    assert parse_labels({'rack': 'r1', 'slot': 4}) == {'rack': 'r1', 'slot': '4'}
+
+
+@pytest.mark.parametrize('labels', [
+    ['rack=r1'],
+    {'-rack': 'r1'},
+    {'rack': 'r 1'},
+    {'rack': True},
+    {'rack': None},
+    {'rack': 'x' * 129},
+    {f'k{i}': 'v' for i in range(MAX_LABELS + 1)},
+])
+def test_invalid_labels_are_rejected(labels):
+    with pytest.raises(ValueError):
+        parse_labels(labels)
@@ -0,0 +1,69 @@
+"""HostRegistry liveness: online -> stale -> offline, driven by explicit clocks"""
+
+from registry import OFFLINE, ONLINE, STALE, HostRegistry
+
+
+def make_registry():
+    return HostRegistry(stale_after=30, offline_after=300, snapshot_ttl=0)
+
+
+def test_new_host_is_online():
+    registry = make_registry()
+    registry.touch('pc-1', when=1000)
+    assert registry.state('pc-1') == ONLINE
+    assert 'pc-1' in registry
+    assert registry.advance(now=1029) == []
+    assert registry.state('pc-1') == ONLINE
+
+
+def test_silent_host_goes_stale_then_offline():
+    registry = make_registry()
+    registry.touch('pc-1', when=1000)
+    assert registry.advance(now=1031) == []
+    assert registry.state('pc-1') == STALE
+    assert registry.snapshot(now=1031)['counts'] == {ONLINE: 0, STALE: 1}
+
+    assert registry.advance(now=1301) == ['pc-1']
+    assert registry.state('pc-1') == OFFLINE
+    assert 'pc-1' not in registry
+    assert registry.pop_offline() == ['pc-1']
+    assert registry.pop_offline() == []
+    assert registry.snapshot(now=1301)['active_clients'] == []
+
+
+def test_report_while_stale_brings_host_back_online():
+    registry = make_registry()
+    registry.touch('pc-1', when=1000)
+    registry.advance(now=1100)
+    assert registry.state('pc-1') == STALE
+
+    registry.touch('pc-1', when=1100)
+    assert registry.state('pc-1') == ONLINE
+    # The stale heap entry from before must not evict it later
+    assert registry.advance(now=1350) == []
+    assert registry.state('pc-1') == STALE
+    assert registry.advance(now=1401) == ['pc-1']
+
+
+def test_late_sample_does_not_move_last_seen_back():
+    registry = make_registry()
+    registry.touch('pc-1', when=1000)
+    registry.touch('pc-1', when=900)
+    assert registry.last_seen('pc-1') == 1000
+
+
+def test_hosts_expire_independently():
+    registry = make_registry()
+    registry.touch_many(['a', 'b'], when=1000)
+    registry.touch('c', when=1200)
+    assert sorted(registry.advance(now=1301)) == ['a', 'b']
+    assert registry.state('c') == STALE
+    assert len(registry) == 1
+
+
+def test_restore_starts_online_and_expires_on_advance():
+    registry = make_registry()
+    registry.restore({'fresh': 1000, 'old': 500})
+    assert registry.state('old') == ONLINE
+    assert registry.advance(now=1010) == ['old']
+    assert registry.state('fresh') == ONLINE
@@ -0,0 +1,143 @@
+"""Binary ingest: hello registration, frame/MessagePack round-trips, malformed bodies"""
+
+import math
+
+import pytest
+
+import wire
+from metrics_store import NUMERIC_FIELDS
+from wire import FRAME_HEADER, FRAME_MAGIC, UnknownHost, WireError, WireRegistry, encode_frame
+
+
+def record(timestamp, fields, base=1.0):
+    return (timestamp,) + tuple(base + i for i in range(len(fields)))
+
+
+def test_frame_round_trip_with_all_fields():
+    registry = WireRegistry()
+    host_id, schema_id = registry.register('pc-1', {'os_info': 'Linux 6.1'})
+    body = encode_frame(host_id, schema_id, [record(1000.0, NUMERIC_FIELDS), record(1005.0, NUMERIC_FIELDS, 2.0)])
+
+    entries, extended = registry.decode(wire.FRAME_MIMETYPE, body)
+    assert extended is None
+    assert [(pc, ts) for pc, ts, _, _ in entries] == [('pc-1', 1000.0), ('pc-1', 1005.0)]
+    assert entries[0][2] == [1.0 + i for i in range(len(NUMERIC_FIELDS))]
+    assert entries[0][3] == {'os_info': 'Linux 6.1'}
+
+
+def test_frame_with_subset_and_extended_fields():
+    registry = WireRegistry()
+    fields = ('memory_percent', 'cpu_percent', 'load.1m')
+    host_id, schema_id = registry.register('pc-1', {}, fields)
+    body = encode_frame(host_id, schema_id, [(1000.0, 40.0, 12.5, 0.75)],
+                        detail={'timestamp': 1000.0, 'top_cpu': [{'name': 'python', 'cpu_percent': 12.0}]})
+
+    entries, extended = registry.decode(wire.FRAME_MIMETYPE, body)
+    values = entries[0][2]
+    assert values[NUMERIC_FIELDS.index('cpu_percent')] == 12.5
+    assert values[NUMERIC_FIELDS.index('memory_percent')] == 40.0
+    assert math.isnan(values[NUMERIC_FIELDS.index('disk_percent')])
+    scalars, detail = extended[0]
+    assert scalars == {'load.1m': 0.75}
+    assert detail['top_cpu'][0]['name'] == 'python'
+
+
+def test_same_field_order_shares_a_schema():
+    registry = WireRegistry()
+    first = registry.register('pc-1', {})
+    second = registry.register('pc-2', {})
+    assert first[1] == second[1]
+    assert first[0] != second[0]
+
+
+@pytest.mark.parametrize('fields, message', [
+    ((), '1 to'),
+    (('cpu_percent', 'no_such_field'), 'Unknown fields'),
+    (('cpu_percent', 'cpu_percent'), 'Duplicate'),
+])
+def test_register_rejects_bad_schemas(fields, message):
+    with pytest.raises(WireError, match=message):
+        WireRegistry().register('pc-1', {}, fields)
+
+
+def test_truncated_frames_are_rejected():
+    registry = WireRegistry()
+    host_id, schema_id = registry.register('pc-1', {})
+    body = encode_frame(host_id, schema_id, [record(1000.0, NUMERIC_FIELDS)] * 2)
+
+    with pytest.raises(WireError, match='too short'):
+        registry.decode_frame(body[:FRAME_HEADER.size - 1])
+    with pytest.raises(WireError, match='declares 2 records'):
+        registry.decode_frame(body[:-8])
+    with pytest.raises(WireError, match='declares 2 records'):
+        registry.decode_frame(body + b'\0')
+
+
+def test_truncated_detail_trailer_is_rejected():
+    registry = WireRegistry()
+    host_id, schema_id = registry.register('pc-1', {})
+    body = encode_frame(host_id, schema_id, [record(1000.0, NUMERIC_FIELDS)], detail={'top_cpu': []})
+    with pytest.raises(WireError, match='Detail trailer declares'):
+        registry.decode_frame(body[:-1])
+
+
+def test_bad_magic_or_version_is_rejected():
+    registry = WireRegistry()
+    host_id, schema_id = registry.register('pc-1', {})
+    body = bytearray(encode_frame(host_id, schema_id, [record(1000.0, NUMERIC_FIELDS)]))
+    body[2] = 2  # Version
+    with pytest.raises(WireError, match='version 1'):
+        registry.decode_frame(bytes(body))
+    with pytest.raises(WireError, match='version 1'):
+        registry.decode_frame(b'XX' + bytes(body[2:]))
+
+
+def test_unknown_host_or_schema_asks_for_hello():
+    registry = WireRegistry()
+    host_id, schema_id = registry.register('pc-1', {})
+    with pytest.raises(UnknownHost):
+        registry.decode_frame(encode_frame(host_id + 1, schema_id, [record(1000.0, NUMERIC_FIELDS)]))
+    with pytest.raises(UnknownHost):
+        registry.decode_frame(encode_frame(host_id, schema_id + 1, [record(1000.0, NUMERIC_FIELDS)]))
+
+
+def test_removed_host_asks_for_hello_and_gets_a_new_id():
+    registry = WireRegistry()
+    host_id, schema_id = registry.register('pc-1', {})
+    registry.remove('pc-1')
+    with pytest.raises(UnknownHost):
+        registry.decode_frame(encode_frame(host_id, schema_id, [record(1000.0, NUMERIC_FIELDS)]))
+    assert registry.register('pc-1', {})[0] != host_id
+
+
+def test_non_finite_timestamp_is_rejected():
+    registry = WireRegistry()
+    host_id, schema_id = registry.register('pc-1', {})
+    with pytest.raises(WireError, match='timestamp'):
+        registry.decode_frame(encode_frame(host_id, schema_id, [record(math.nan, NUMERIC_FIELDS)]))
+
+
+def test_sharded_host_ids_follow_offset_and_stride():
+    registry = WireRegistry(offset=2, stride=4)
+    assert [registry.register(f'pc-{i}', {})[0] for i in range(3)] == [3, 7, 11]
+    assert wire.peek_host_id(wire.FRAME_MIMETYPE, FRAME_HEADER.pack(FRAME_MAGIC, 1, 0, 7, 1, 0)) == 7
+
+
+def test_msgpack_round_trip_and_malformed_bodies():
+    msgpack = pytest.importorskip('msgpack')
+    registry = WireRegistry()
+    fields = ('cpu_percent', 'memory_percent')
+    host_id, schema_id = registry.register('pc-1', {}, fields)
+
+    entries, _ = registry.decode(wire.MSGPACK_MIMETYPE, msgpack.packb([host_id, schema_id, [[1000.0, 5.0, None]]]))
+    assert entries[0][2][NUMERIC_FIELDS.index('cpu_percent')] == 5.0
+    assert math.isnan(entries[0][2][NUMERIC_FIELDS.index('memory_percent')])
+
+    with pytest.raises(WireError):
+        registry.decode_msgpack(msgpack.packb([host_id, schema_id, [[1000.0, 5.0]]]))  # Short record
+    with pytest.raises(WireError):
+        registry.decode_msgpack(msgpack.packb({'host_id': host_id}))
+    with pytest.raises(WireError):
+        registry.decode_msgpack(b'\xc1')  # Never-used MessagePack byte
+    with pytest.raises(UnknownHost):
+        registry.decode_msgpack(msgpack.packb([host_id, schema_id + 1, []]))